@@ -0,0 +1,37 @@
+"""
+Импорт сервисов в бенчмарках: пакет app сервиса и общий пакет common.
+
+Код сервиса – пакет app в <service>_service/, общий код – common/ в корне
+репозитория, так что для импорта app.* нужны оба пути. Все бенчмарки
+берут их отсюда, а не собирают sys.path каждый по-своему:
+
+    from _services import use_service
+
+    use_service("trip")
+    from app import crud  # noqa: E402
+
+Скрипты из benchmarks/ импортируют модуль как _services (папка скрипта
+уже в sys.path), пакет loadtest – как benchmarks._services.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+
+def use_service(service: str) -> str:
+    """
+    Делает app пакетом сервиса service ("booking", "trip", ...): его папка
+    встаёт первой в sys.path, ранее импортированный app выгружается.
+    Возвращает путь к папке сервиса.
+    """
+    path = os.path.join(ROOT, f"{service}_service")
+    for key in [k for k in sys.modules if k == "app" or k.startswith("app.")]:
+        del sys.modules[key]
+    if path in sys.path:
+        sys.path.remove(path)
+    sys.path.insert(0, path)
+    return path
@@ -0,0 +1,85 @@
+"""
+Нагрузка на car_service от карты: опрос полного списка GET /api/cars
+против чтения дельт из ленты изменений (GET /api/cars/changes) и
+рассылки событий подписчикам (ChangeFeed.subscribe) в одном event loop.
+
+    python benchmarks/bench_car_change_feed.py --cars 5000 --updates 200 --subscribers 500
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from _services import use_service
+
+use_service("car")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import main  # noqa: E402
+from app.feed import ChangeFeed  # noqa: E402
+
+
+def timed(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+async def fanout(subscribers: int, events: int) -> float:
+    feed = ChangeFeed()
+    received = 0
+
+    async def subscriber():
+        nonlocal received
+        async for event in feed.subscribe(heartbeat=60):
+            received += 1
+            if event["seq"] == events:
+                return
+
+    tasks = [asyncio.create_task(subscriber()) for _ in range(subscribers)]
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    for i in range(events):
+        feed.publish(f"car-{i}", "status", {"status": "reserved"})
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert received == subscribers * events
+    return time.perf_counter() - start
+
+
+def main_bench() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=5000)
+    parser.add_argument("--updates", type=int, default=200, help="изменений между двумя опросами")
+    parser.add_argument("--subscribers", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    client = TestClient(main.app)
+    payload = [
+        {"model": "Kia Rio", "plate_number": f"B{i:06d}", "color": "white", "location": "Москва",
+         "lat": 55.7 + random.random() / 10, "lon": 37.5 + random.random() / 10}
+        for i in range(args.cars)
+    ]
+    ids = [car["id"] for car in client.post("/api/cars/batch", json=payload).json()]
+
+    seq = main.feed.last_seq
+    for car_id in random.sample(ids, args.updates):
+        client.patch(f"/api/cars/{car_id}/location", json={"lat": 55.75, "lon": 37.61})
+
+    full = client.get("/api/cars")
+    delta = client.get("/api/cars/changes", params={"since": seq})
+    print(f"== Один опрос карты ({args.cars} машин, {args.updates} изменений с прошлого раза)")
+    print(f"GET /api/cars          {timed(lambda: client.get('/api/cars'), args.rounds):8.2f} мс  {len(full.content):>9} байт")
+    print(f"GET /api/cars/changes  {timed(lambda: client.get('/api/cars/changes', params={'since': seq}), args.rounds):8.2f} мс  {len(delta.content):>9} байт")
+
+    events = args.updates
+    elapsed = asyncio.run(fanout(args.subscribers, events))
+    print(f"\n== Рассылка {events} событий {args.subscribers} подписчикам")
+    print(f"{elapsed * 1000:.1f} мс, {args.subscribers * events / elapsed:.0f} доставок/с")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,183 @@
+"""
+Число SQL-запросов и латентность записей в crud.py: прежний путь
+(SELECT + изменение объекта + commit + refresh) против текущего
+(один INSERT/UPDATE ... RETURNING, expire_on_commit=False).
+
+    python benchmarks/bench_crud_round_trips.py --ops 2000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from _services import use_service
+
+
+def load_service(service: str, db_path: str):
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    use_service(service)
+    from app import crud, database, migrations, models, schemas
+    migrations.upgrade(database.engine)
+    return crud, database, models, schemas
+
+
+# ====== Прежние реализации (до перехода на RETURNING) ======
+
+def legacy_create_booking(db, models, crud, payload):
+    booking = models.Booking(
+        user_id=payload.user_id,
+        car_id=payload.car_id,
+        start_at=payload.start_at,
+        end_at=payload.end_at,
+        zone_id=payload.zone_id,
+        status=models.BookingStatus.created,
+    )
+    db.add(booking)
+    db.flush()
+    overlap = db.query(crud.overlap_exists(payload.car_id, payload.start_at, payload.end_at, booking.id)).scalar()
+    if overlap:
+        db.rollback()
+        raise crud.BookingConflictError()
+    db.commit()
+    db.refresh(booking)
+    return booking
+
+
+def legacy_extend_booking(db, models, crud, booking_id, new_end_at):
+    booking = db.query(models.Booking).filter(models.Booking.id == booking_id).first()
+    booking.end_at = new_end_at
+    booking.status = models.BookingStatus.extended
+    db.flush()
+    if db.query(crud.overlap_exists(booking.car_id, booking.start_at, new_end_at, booking.id)).scalar():
+        db.rollback()
+        raise crud.BookingConflictError()
+    db.commit()
+    db.refresh(booking)
+    return booking
+
+
+def legacy_cancel_booking(db, models, booking_id):
+    booking = db.query(models.Booking).filter(models.Booking.id == booking_id).first()
+    booking.status = models.BookingStatus.cancelled
+    db.commit()
+    db.refresh(booking)
+    return booking
+
+
+def legacy_start_trip(db, models, payload):
+    trip = models.Trip(
+        booking_id=payload.booking_id,
+        user_id=payload.user_id,
+        car_id=payload.car_id,
+        status=models.TripStatus.in_progress,
+    )
+    db.add(trip)
+    db.commit()
+    db.refresh(trip)
+    return trip
+
+
+def legacy_finish_trip(db, models, crud, trip_id, payload):
+    trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
+    for name, value in crud.finish_values(payload, trip).items():
+        setattr(trip, name, value)
+    db.commit()
+    db.refresh(trip)
+    return trip
+
+
+# ====== Замеры ======
+
+class Recorder:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self)
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+def measure(name: str, ops: int, recorder: Recorder, func):
+    latencies = []
+    statements = recorder.count
+    for i in range(ops):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    statements = (recorder.count - statements) / ops
+    latencies.sort()
+    return name, statements, statistics.median(latencies) * 1e6, latencies[int(ops * 0.99) - 1] * 1e6
+
+
+def bench_booking(ops: int):
+    crud, database, models, schemas = load_service("booking", os.path.join(tempfile.mkdtemp(), "b.db"))
+    legacy_session = sessionmaker(bind=database.engine, autoflush=False)  # прежние настройки сессии
+    recorder = Recorder(database.engine)
+    start_at = datetime(2030, 1, 1)
+
+    def payload(prefix, i):
+        return schemas.BookingCreate(
+            user_id=f"user-{i}", car_id=f"{prefix}-car-{i}", zone_id="zone-1",
+            start_at=start_at, end_at=start_at + timedelta(minutes=30),
+        )
+
+    rows = []
+    ids = {"old": [], "new": []}
+    with legacy_session() as db:
+        rows.append(measure("create (old)", ops, recorder,
+                            lambda i: ids["old"].append(legacy_create_booking(db, models, crud, payload("old", i)).id)))
+        rows.append(measure("extend (old)", ops, recorder,
+                            lambda i: legacy_extend_booking(db, models, crud, ids["old"][i], start_at + timedelta(hours=1))))
+        rows.append(measure("cancel (old)", ops, recorder,
+                            lambda i: legacy_cancel_booking(db, models, ids["old"][i])))
+    with database.SessionLocal() as db:
+        rows.append(measure("create (new)", ops, recorder,
+                            lambda i: ids["new"].append(crud.create_booking(db, payload("new", i)).id)))
+        rows.append(measure("extend (new)", ops, recorder,
+                            lambda i: crud.extend_booking(db, ids["new"][i], start_at + timedelta(hours=1))))
+        rows.append(measure("cancel (new)", ops, recorder,
+                            lambda i: crud.cancel_booking(db, ids["new"][i])))
+    return rows
+
+
+def bench_trip(ops: int):
+    crud, database, models, schemas = load_service("trip", os.path.join(tempfile.mkdtemp(), "t.db"))
+    legacy_session = sessionmaker(bind=database.engine, autoflush=False)
+    recorder = Recorder(database.engine)
+    start = schemas.TripStart(booking_id="b", user_id="u", car_id="c")
+    finish = schemas.TripFinish(distance_km=12.5, duration_minutes=30)
+
+    rows = []
+    ids = {"old": [], "new": []}
+    with legacy_session() as db:
+        rows.append(measure("start (old)", ops, recorder,
+                            lambda i: ids["old"].append(legacy_start_trip(db, models, start).id)))
+        rows.append(measure("finish (old)", ops, recorder,
+                            lambda i: legacy_finish_trip(db, models, crud, ids["old"][i], finish)))
+    with database.SessionLocal() as db:
+        rows.append(measure("start (new)", ops, recorder,
+                            lambda i: ids["new"].append(crud.start_trip(db, start).id)))
+        rows.append(measure("finish (new)", ops, recorder,
+                            lambda i: crud.finish_trip(db, ids["new"][i], finish)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    for service, bench in (("booking_service", bench_booking), ("trip_service", bench_trip)):
+        print(f"\n{service}: {args.ops} ops per operation")
+        print(f"  {'operation':14s} {'stmts/op':>8s} {'p50 us':>9s} {'p99 us':>9s}")
+        for name, statements, p50, p99 in bench(args.ops):
+            print(f"  {name:14s} {statements:8.1f} {p50:9.0f} {p99:9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Накладные расходы HTTP-метрик на запрос и время скрейпа /metrics:
+прежний middleware (BaseHTTPMiddleware, time.time(), метка = сырой путь)
+против common.metrics.PrometheusMiddleware (чистый ASGI, метка = шаблон
+маршрута, закешированные дочерние метрики).
+
+Запросы подаются прямо в ASGI-приложение, без сети и TestClient,
+поэтому разница между вариантами – это стоимость самого middleware.
+
+    python benchmarks/bench_metrics_middleware.py --requests 20000 --ids 100000
+"""
+import argparse
+import asyncio
+import sys
+import time
+from uuid import uuid4
+
+from fastapi import FastAPI
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+import _services  # noqa: E402,F401 – корень репозитория (common) в sys.path
+from common.metrics import PrometheusMiddleware  # noqa: E402
+
+SERVICE_NAME = "bench_service"
+
+
+def add_item_route(app: FastAPI) -> FastAPI:
+    @app.get("/api/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+
+    return app
+
+
+def make_plain_app() -> FastAPI:
+    return add_item_route(FastAPI())
+
+
+def make_legacy_app(registry: CollectorRegistry) -> FastAPI:
+    """Копия прежнего metrics_middleware из сервисов, на отдельном реестре."""
+    request_count = Counter(
+        "http_requests_total", "Total HTTP requests",
+        ["service", "method", "endpoint", "status_code"], registry=registry,
+    )
+    request_duration = Histogram(
+        "http_request_duration_seconds", "HTTP request duration in seconds",
+        ["service", "method", "endpoint"], registry=registry,
+    )
+    active_requests = Gauge("http_active_requests", "Active HTTP requests", ["service"], registry=registry)
+
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        start = time.time()
+        method = request.method
+        endpoint = request.url.path
+        active_requests.labels(service=SERVICE_NAME).inc()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            duration = time.time() - start
+            request_duration.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
+            request_count.labels(
+                service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)
+            ).inc()
+            active_requests.labels(service=SERVICE_NAME).dec()
+
+    return add_item_route(app)
+
+
+def make_shared_app() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+    return add_item_route(app)
+
+
+async def call(app, path: str) -> None:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 50000),
+        "server": ("bench", 80),
+    }
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def drive(app, paths) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        await call(app, path)
+    return time.perf_counter() - start
+
+
+def timed_scrape(registry, repeat: int = 3):
+    best, size = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(generate_latest(registry))
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20_000, help="запросов на замер накладных расходов")
+    parser.add_argument("--ids", type=int, default=100_000, help="различных id для замера скрейпа")
+    args = parser.parse_args()
+
+    legacy_registry = CollectorRegistry()
+    apps = {
+        "без метрик": make_plain_app(),
+        "прежний middleware": make_legacy_app(legacy_registry),
+        "common.metrics": make_shared_app(),
+    }
+
+    print(f"== Накладные расходы, {args.requests} запросов к одному пути")
+    fixed = ["/api/items/42"] * args.requests
+    baseline = None
+    for name, app in apps.items():
+        asyncio.run(drive(app, fixed[:1000]))  # прогрев
+        elapsed = asyncio.run(drive(app, fixed))
+        per_request = elapsed / args.requests * 1e6
+        if baseline is None:
+            baseline = per_request
+        print(f"{name:<20} {per_request:8.1f} мкс/запрос  (+{per_request - baseline:6.1f} мкс к голому приложению)")
+
+    print(f"\n== Скрейп /metrics после {args.ids} запросов с разными id")
+    distinct = [f"/api/items/{uuid4()}" for _ in range(args.ids)]
+    for name, registry in (("прежний middleware", legacy_registry), ("common.metrics", REGISTRY)):
+        app = apps[name]
+        elapsed = asyncio.run(drive(app, distinct))
+        scrape, size = timed_scrape(registry)
+        print(
+            f"{name:<20} {elapsed / args.ids * 1e6:8.1f} мкс/запрос, "
+            f"скрейп {scrape * 1000:9.1f} мс, ответ {size / 1024:10.1f} КиБ"
+        )
+
+
+if __name__ == "__main__":
+    main()
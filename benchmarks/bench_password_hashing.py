@@ -0,0 +1,107 @@
+"""
+Пропускная способность логина в user_service при хешировании паролей scrypt.
+
+1) стоимость одного хеша при разных work factor (N);
+2) логинов в секунду через пул потоков при 1..cpu_count воркерах –
+   hashlib.scrypt отпускает GIL, поэтому пул масштабируется по ядрам;
+3) задержка event loop во время «утреннего шторма» логинов: проверка
+   прямо в корутине против проверки в пуле.
+
+    python benchmarks/bench_password_hashing.py --logins 200
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _services import use_service
+
+use_service("user")
+from app import passwords  # noqa: E402
+
+PASSWORD = "correct horse battery staple"
+
+
+def bench_work_factors(rounds: int) -> None:
+    print("== Стоимость одного хеша (1 ядро)")
+    for n in (2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            passwords.hash_password(PASSWORD, n=n)
+        per_hash = (time.perf_counter() - start) / rounds
+        print(f"N=2**{n.bit_length() - 1:<3} {per_hash * 1000:7.1f} мс/хеш  {1 / per_hash:7.1f} хешей/с")
+
+
+async def login_storm(stored: str, logins: int) -> float:
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(passwords.verify_password_async(PASSWORD, stored) for _ in range(logins))
+    )
+    assert all(results)
+    return time.perf_counter() - start
+
+
+def bench_pool_scaling(stored: str, logins: int) -> None:
+    cpus = os.cpu_count() or 1
+    print(f"\n== Логины через пул, N={passwords.SCRYPT_N}, {logins} логинов, ядер: {cpus}")
+    workers = sorted({1, 2, 4, cpus})
+    for count in workers:
+        passwords._executor = ThreadPoolExecutor(max_workers=count)
+        elapsed = asyncio.run(login_storm(stored, logins))
+        passwords._executor.shutdown()
+        rate = logins / elapsed
+        print(f"воркеров {count:<3} {rate:8.1f} логинов/с  {rate / min(count, cpus):8.1f} на ядро")
+    passwords._executor = None
+
+
+async def loop_lag(storm) -> float:
+    """Максимальная задержка тикера с периодом 1 мс, пока идёт storm()."""
+    worst = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal worst
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            worst = max(worst, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    await storm()
+    done = True
+    await task
+    return worst
+
+
+def bench_loop_lag(stored: str, logins: int) -> None:
+    print(f"\n== Задержка event loop во время {logins} логинов")
+
+    async def inline():
+        for _ in range(logins):
+            assert passwords.verify_password(PASSWORD, stored)
+            await asyncio.sleep(0)
+
+    async def pooled():
+        await login_storm(stored, logins)
+
+    for name, storm in (("в корутине", inline), ("в пуле", pooled)):
+        worst = asyncio.run(loop_lag(storm))
+        print(f"{name:<12} макс. задержка тика {worst * 1000:8.1f} мс")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=10, help="хешей на замер work factor")
+    args = parser.parse_args()
+
+    bench_work_factors(args.rounds)
+    stored = passwords.hash_password(PASSWORD)
+    bench_pool_scaling(stored, args.logins)
+    bench_loop_lag(stored, min(args.logins, 50))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Планы и время типовых запросов booking_service/trip_service до и после
+миграции с индексами (migrations.upgrade) на синтетической SQLite-БД.
+
+    python benchmarks/bench_query_indexes.py --service booking --rows 1000000
+    python benchmarks/bench_query_indexes.py --service trip --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from _services import use_service
+
+SERVICES = {
+    "booking": {
+        "table": "bookings",
+        "statuses": ["created", "cancelled", "extended", "active", "expired"],
+        "active_status": "created",
+    },
+    "trip": {
+        "table": "trips",
+        "statuses": ["in_progress", "finished"],
+        "active_status": "in_progress",
+    },
+}
+
+QUERIES = {
+    "list by user": (
+        "SELECT * FROM {table} WHERE user_id = :user_id ORDER BY created_at, id LIMIT 20"
+    ),
+    "list by user+status": (
+        "SELECT * FROM {table} WHERE user_id = :user_id AND status = :status "
+        "ORDER BY created_at, id LIMIT 20"
+    ),
+    "count by user+status": (
+        "SELECT count(*) FROM {table} WHERE user_id = :user_id AND status = :status"
+    ),
+    "active by car": (
+        "SELECT id FROM {table} WHERE car_id = :car_id AND status = :status"
+    ),
+}
+
+
+def load_service(service: str, db_path: str):
+    # database.py читает DATABASE_URL при импорте
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    use_service(service)
+    from app import database, migrations, models
+    return database, migrations, models
+
+
+def make_row(service: str, i: int, users: int, cars: int, statuses, epoch: datetime) -> dict:
+    created_at = epoch + timedelta(seconds=i * 30, microseconds=random.randrange(1_000_000))
+    row = {
+        "id": f"{i:012d}",
+        "user_id": f"user-{random.randrange(users)}",
+        "car_id": f"car-{random.randrange(cars)}",
+        "status": random.choice(statuses),
+        "created_at": created_at,
+    }
+    if service == "booking":
+        row.update(start_at=created_at, end_at=created_at + timedelta(minutes=30), zone_id="zone-1")
+    else:
+        row.update(booking_id=f"booking-{i}", started_at=created_at)
+    return row
+
+
+def populate(engine, models, service: str, rows: int, batch: int = 50_000) -> None:
+    table = models.Base.metadata.tables[SERVICES[service]["table"]]
+    statuses = SERVICES[service]["statuses"]
+    users, cars = max(rows // 10, 1), max(rows // 50, 1)
+    epoch = datetime(2024, 1, 1)
+
+    with engine.begin() as conn:
+        # схема "как до миграций": таблица без вторичных индексов
+        table.create(conn)
+        for index in table.indexes:
+            index.drop(conn)
+        for start in range(0, rows, batch):
+            chunk = [
+                make_row(service, i, users, cars, statuses, epoch)
+                for i in range(start, min(start + batch, rows))
+            ]
+            conn.execute(table.insert(), chunk)
+
+
+def run_queries(engine, service: str, rows: int, repeats: int):
+    from sqlalchemy import text
+
+    cfg = SERVICES[service]
+    users, cars = max(rows // 10, 1), max(rows // 50, 1)
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            sql = sql.format(table=cfg["table"])
+            plan = conn.execute(
+                text("EXPLAIN QUERY PLAN " + sql),
+                {"user_id": "user-0", "car_id": "car-0", "status": cfg["active_status"]},
+            ).all()
+            timings = []
+            for _ in range(repeats):
+                params = {
+                    "user_id": f"user-{random.randrange(users)}",
+                    "car_id": f"car-{random.randrange(cars)}",
+                    "status": cfg["active_status"],
+                }
+                start = time.perf_counter()
+                conn.execute(text(sql), params).all()
+                timings.append((time.perf_counter() - start) * 1000)
+            results[name] = {
+                "plan": " | ".join(row[-1] for row in plan),
+                "median_ms": statistics.median(timings),
+                "max_ms": max(timings),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=SERVICES, default="booking")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    db_path = os.path.join(tempfile.mkdtemp(), f"bench_{args.service}.db")
+    database, migrations, models = load_service(args.service, db_path)
+
+    start = time.perf_counter()
+    populate(database.engine, models, args.service, args.rows)
+    print(f"populated {args.rows} rows in {time.perf_counter() - start:.1f}s ({db_path})")
+
+    before = run_queries(database.engine, args.service, args.rows, args.repeats)
+
+    start = time.perf_counter()
+    version = migrations.upgrade(database.engine)
+    print(f"migrated to version {version} in {time.perf_counter() - start:.1f}s")
+
+    after = run_queries(database.engine, args.service, args.rows, args.repeats)
+
+    for name in QUERIES:
+        b, a = before[name], after[name]
+        print(f"\n{name}")
+        print(f"  before: {b['median_ms']:9.3f} ms median, {b['max_ms']:9.3f} ms max  [{b['plan']}]")
+        print(f"  after:  {a['median_ms']:9.3f} ms median, {a['max_ms']:9.3f} ms max  [{a['plan']}]")
+        print(f"  speedup: x{b['median_ms'] / max(a['median_ms'], 1e-6):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Пропускная способность бэкендов common.repository: словарь в памяти
+против SQLite (WAL) на тех же операциях, что делают сервисы –
+add, get по ключу, find по индексу, find по уникальному полю, update.
+Для SQLite дополнительно – смешанная нагрузка из нескольких процессов,
+как при нескольких воркерах uvicorn на одном файле БД.
+
+    python benchmarks/bench_repository_backends.py --rows 20000 --workers 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import _services  # noqa: E402,F401 – корень репозитория (common) в sys.path
+from common.repository import make_repository  # noqa: E402
+
+STATUSES = ("available", "reserved", "in_trip", "unavailable")
+
+
+def open_repo(url: str):
+    return make_repository("cars", indexed=("status",), unique=("plate_number",), url=url)
+
+
+def car(i: int) -> dict:
+    return {
+        "id": f"car-{i}",
+        "model": "Kia Rio",
+        "plate_number": f"A{i:06d}",
+        "color": "white",
+        "location": "Москва",
+        "lat": 55.75 + (i % 1000) / 10000,
+        "lon": 37.61 + (i // 1000) / 10000,
+        # редкий статус – find по нему отдаёт немного записей
+        "status": "unavailable" if i % 100 == 0 else STATUSES[i % 3],
+    }
+
+
+def rate(label: str, count: int, fn) -> None:
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {count / elapsed:12.0f} оп/с")
+
+
+def bench_single(url: str, rows: int, ops: int) -> None:
+    repo = open_repo(url)
+    rate("add", rows, lambda i: repo.add(car(i)))
+    keys = [f"car-{random.randrange(rows)}" for _ in range(ops)]
+    rate("get по ключу", ops, lambda i: repo.get(keys[i]))
+    rate("find по уникальному полю", ops, lambda i: repo.find_one(plate_number=f"A{i % rows:06d}"))
+    rate("find по индексу (1% строк)", max(ops // 100, 10), lambda i: repo.find(status="unavailable"))
+    rate("update", ops, lambda i: repo.update(keys[i], status=STATUSES[i % 4]))
+
+
+def worker(url: str, rows: int, ops: int, seed: int, result) -> None:
+    repo = open_repo(url)
+    rnd = random.Random(seed)
+    start = time.perf_counter()
+    for i in range(ops):
+        key = f"car-{rnd.randrange(rows)}"
+        # 80% чтений, 20% записей
+        if i % 5 == 0:
+            repo.update(key, status=STATUSES[i % 4])
+        else:
+            repo.get(key)
+    result.put(time.perf_counter() - start)
+
+
+def bench_workers(url: str, rows: int, ops: int, workers: int) -> None:
+    for count in sorted({1, workers}):
+        result = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(url, rows, ops, seed, result)) for seed in range(count)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+        print(f"  процессов {count:<3} {count * ops / elapsed:12.0f} оп/с (80% get, 20% update)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--ops", type=int, default=5_000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    print("== memory://")
+    bench_single("memory://", args.rows, args.ops)
+
+    url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'cars.db')}"
+    print(f"\n== {url}")
+    bench_single(url, args.rows, args.ops)
+
+    print("\n== SQLite, несколько процессов на одном файле")
+    bench_workers(url, args.rows, args.ops, args.workers)
+
+
+if __name__ == "__main__":
+    main()
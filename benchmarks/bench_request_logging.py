@@ -0,0 +1,192 @@
+"""
+Логирование запросов user_service под конкурентной нагрузкой: прежняя
+схема (basicConfig, f-строка в http-middleware, request_id в атрибуте
+общего фильтра) против app/logs.py (contextvars, QueueHandler ->
+QueueListener, JSON).
+
+Запросы идут через ASGI пачками по --concurrency штук в одном event loop;
+обработчик пишет свою строку лога после await, как настоящие эндпоинты
+после похода в threadpool. --sink-delay имитирует медленного читателя
+stdout (сборщик логов, переполненный pipe).
+
+    python benchmarks/bench_request_logging.py --requests 20000 --concurrency 200
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import re
+import time
+import uuid
+
+from _services import use_service
+
+use_service("user")
+
+from fastapi import FastAPI, Request  # noqa: E402
+
+from app import logs  # noqa: E402
+
+
+class SlowSink(io.StringIO):
+    """Поток, каждая запись в который занимает delay секунд."""
+
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, s):
+        if self.delay:
+            time.sleep(self.delay)
+        return super().write(s)
+
+
+def reset_root() -> logging.Logger:
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    return root
+
+
+def add_handler(app: FastAPI) -> None:
+    handler_logger = logging.getLogger("app")
+
+    @app.get("/api/users/{user_id}")
+    async def get_user(user_id: str):
+        await asyncio.sleep(0)
+        handler_logger.info("user %s requested", user_id)
+        return {"id": user_id}
+
+
+def legacy_app(sink) -> FastAPI:
+    """Схема до перехода на app/logs.py."""
+    root = reset_root()
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s service=%(service)s instance=%(instance)s request_id=%(request_id)s %(message)s"
+    ))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    class ContextFilter(logging.Filter):
+        request_id = "-"
+
+        def filter(self, record):
+            record.service, record.instance, record.request_id = "user-service", "bench", self.request_id
+            return True
+
+    ctx_filter = ContextFilter()
+    logger = logging.getLogger("app")
+    logger.filters.clear()
+    logger.addFilter(ctx_filter)
+
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def observability_middleware(request: Request, call_next):
+        ctx_filter.request_id = request.headers.get("X-Request-ID") or str(uuid.uuid4())
+        start = time.perf_counter()
+        status_code = 500
+        try:
+            response = await call_next(request)
+            status_code = response.status_code
+            return response
+        finally:
+            logger.info(f"{request.method} {request.url.path} -> {status_code} duration={time.perf_counter() - start:.4f}s")
+
+    add_handler(app)
+    return app
+
+
+def queue_app(sink):
+    reset_root()
+    logging.getLogger("app").filters.clear()
+    listener = logs.setup_logging("user-service", "bench", stream=sink)
+    app = FastAPI()
+    app.add_middleware(logs.RequestLoggingMiddleware)
+    add_handler(app)
+    return app, listener
+
+
+async def get(app, path: str, request_id: str) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [(b"x-request-id", request_id.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def drive(app, requests: int, concurrency: int) -> list:
+    """Латентности запросов (с) при concurrency одновременных запросах."""
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await get(app, f"/api/users/u{i}", f"req-{i}")
+        latencies.append(time.perf_counter() - start)
+
+    async def run():
+        for offset in range(0, requests, concurrency):
+            await asyncio.gather(*(one(i) for i in range(offset, min(offset + concurrency, requests))))
+
+    asyncio.run(run())
+    return latencies
+
+
+def report(label: str, latencies: list, elapsed: float, wrong: int, lines: int) -> None:
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1e6  # noqa: E731
+    print(f"{label:<14} {len(latencies) / elapsed:9.0f} зап/с  p50 {p(0.5):8.0f} мкс  p99 {p(0.99):8.0f} мкс  "
+          f"чужой request_id: {wrong}/{lines}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--sink-delay", type=float, default=0.0, help="секунд на одну запись в поток логов")
+    args = parser.parse_args()
+
+    print(f"== {args.requests} запросов по {args.concurrency} одновременно, запись в лог {args.sink_delay * 1e6:.0f} мкс")
+    legacy_line = re.compile(r"request_id=(\S+) (?:user (u\d+) requested|GET /api/users/(u\d+) )")
+
+    sink = SlowSink(args.sink_delay)
+    app = legacy_app(sink)
+    start = time.perf_counter()
+    latencies = drive(app, args.requests, args.concurrency)
+    elapsed = time.perf_counter() - start
+    wrong = lines = 0
+    for match in legacy_line.finditer(sink.getvalue()):
+        lines += 1
+        wrong += match.group(1) != f"req-{(match.group(2) or match.group(3))[1:]}"
+    report("basicConfig", latencies, elapsed, wrong, lines)
+
+    sink = SlowSink(args.sink_delay)
+    app, listener = queue_app(sink)
+    start = time.perf_counter()
+    latencies = drive(app, args.requests, args.concurrency)
+    elapsed = time.perf_counter() - start
+    listener.stop()
+    drained = time.perf_counter() - start
+    wrong = lines = 0
+    for line in sink.getvalue().splitlines():
+        record = json.loads(line)
+        user_id = record["path"].rsplit("/", 1)[-1] if "path" in record else record["message"].split()[1]
+        lines += 1
+        wrong += record["request_id"] != f"req-{user_id[1:]}"
+    report("queue + JSON", latencies, elapsed, wrong, lines)
+    print(f"{'':<14} очередь дописана через {(drained - elapsed) * 1000:.0f} мс после последнего ответа")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Кеш готовых ответов (common/response_cache.py) на горячих GET: промах
+(модель Pydantic + сериализация + ETag, как без кеша) против попадания
+и против 304 по If-None-Match. Запросы идут через ASGI в одном процессе,
+поэтому сервис – один за запуск.
+
+    python benchmarks/bench_response_cache.py --service geo --items 300
+    python benchmarks/bench_response_cache.py --service car
+    python benchmarks/bench_response_cache.py --service user
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+
+import _services  # noqa: F401 – корень репозитория в sys.path
+
+from benchmarks.loadtest.drivers import AsgiDriver  # noqa: E402
+from common.response_cache import make_etag  # noqa: E402
+
+
+async def setup(driver, service: str, items: int):
+    """Данные сервиса; возвращает (кеш, путь горячего GET)."""
+    from app import main
+
+    if service == "geo":
+        for i in range(items):
+            await driver.send({"method": "POST", "path": "/api/zones", "json": {
+                "name": f"Зона {i}", "city": "Москва",
+                "polygon": f"[(55.{i:03d},37.50),(55.{i:03d},37.60),(55.{i + 1:03d},37.60),(55.{i + 1:03d},37.50)]",
+            }})
+        return main.zone_cache, "/api/zones"
+    if service == "car":
+        status, body = await driver.send({"method": "POST", "path": "/api/cars", "json": {
+            "model": "Kia Rio", "plate_number": "B000001", "color": "white", "location": "Москва",
+            "lat": 55.75, "lon": 37.61,
+        }})
+        return main.car_cache, f"/api/cars/{json.loads(body)['id']}"
+    logging.getLogger("app.access").disabled = True  # журнал доступа в stdout мешает выводу
+    status, body = await driver.send({"method": "POST", "path": "/api/users/register", "json": {
+        "phone": "+79990000000", "email": "bench@example.com", "full_name": "Bench User",
+        "driver_license": "7700000000", "password": "secret123",
+    }})
+    return main.user_cache, f"/api/users/{json.loads(body)['id']}"
+
+
+async def measure(driver, path: str, rounds: int, headers=None) -> float:
+    record = {"method": "GET", "path": path, "headers": headers or {}}
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await driver.send(record)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+async def run(service: str, items: int, rounds: int) -> None:
+    async with AsgiDriver(service) as driver:
+        cache, path = await setup(driver, service, items)
+        ttl = cache.ttl
+        cache.clear()
+        cache.ttl = 0  # каждый запрос – промах: модель, сериализация, ETag
+        miss = await measure(driver, path, rounds)
+        cache.ttl = ttl
+        cache.clear()
+        status, body = await driver.send({"method": "GET", "path": path})
+        hit = await measure(driver, path, rounds)
+        etag = make_etag(body)
+        not_modified = await measure(driver, path, rounds, {"if-none-match": etag})
+
+    label = "/api/zones" if service == "geo" else path.rsplit("/", 1)[0] + "/{id}"
+    print(f"== GET {label} ({service}, тело {len(body)} байт), мкс на запрос через ASGI")
+    print(f"промах        {miss:9.1f}")
+    print(f"попадание     {hit:9.1f}   x{miss / hit:.1f}")
+    print(f"304           {not_modified:9.1f}   x{miss / not_modified:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=("car", "geo", "user"), default="geo")
+    parser.add_argument("--items", type=int, default=300, help="зон в списке (geo)")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.service, args.items, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
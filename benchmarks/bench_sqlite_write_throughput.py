@@ -0,0 +1,121 @@
+"""
+Нагрузочный тест записи: POST /api/bookings и POST /api/trips/start на
+SQLite с настройками по умолчанию (rollback journal, synchronous=FULL) и с
+PRAGMA из database.make_engine (WAL, synchronous=NORMAL, mmap, cache).
+
+    python benchmarks/bench_sqlite_write_throughput.py --requests 2000 --concurrency 8
+
+Каждый профиль запускается в отдельном процессе, так как engine создаётся
+при импорте app.database из переменных окружения.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from _services import ROOT, use_service
+
+PROFILES = {
+    # поведение SQLite без наших PRAGMA
+    "default": {
+        "SQLITE_JOURNAL_MODE": "DELETE",
+        "SQLITE_SYNCHRONOUS": "FULL",
+        "SQLITE_MMAP_SIZE": "0",
+        "SQLITE_CACHE_SIZE": "-2000",
+        "SQLITE_TEMP_STORE": "",
+    },
+    # значения по умолчанию из make_engine
+    "tuned": {},
+}
+
+
+def booking_payload(i: int) -> tuple[str, dict]:
+    start_at = datetime(2030, 1, 1) + timedelta(minutes=i)
+    return "/api/bookings", {
+        "user_id": f"user-{i % 1000}",
+        "car_id": f"car-{i}",
+        "start_at": start_at.isoformat(),
+        "end_at": (start_at + timedelta(minutes=30)).isoformat(),
+        "zone_id": "zone-1",
+    }
+
+
+def trip_payload(i: int) -> tuple[str, dict]:
+    return "/api/trips/start", {
+        "booking_id": f"booking-{i}",
+        "user_id": f"user-{i % 1000}",
+        "car_id": f"car-{i}",
+    }
+
+
+PAYLOADS = {"booking": booking_payload, "trip": trip_payload}
+
+
+def run_worker(service: str, requests: int, concurrency: int) -> dict:
+    use_service(service)
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    client = TestClient(app)
+    make_payload = PAYLOADS[service]
+
+    def send(i: int) -> float:
+        path, payload = make_payload(i)
+        start = time.perf_counter()
+        r = client.post(path, json=payload)
+        assert r.status_code == 200, r.text
+        return time.perf_counter() - start
+
+    # прогрев: соединения пула, импорт, первый запрос
+    send(requests)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def run_profile(service: str, profile: str, requests: int, concurrency: int) -> dict:
+    db_path = os.path.join(tempfile.mkdtemp(), f"{service}.db")
+    env = {**os.environ, **PROFILES[profile], "DATABASE_URL": f"sqlite:///{db_path}"}
+    out = subprocess.run(
+        [sys.executable, __file__, "--worker", service,
+         "--requests", str(requests), "--concurrency", str(concurrency)],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--worker", choices=PAYLOADS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.requests, args.concurrency)))
+        return
+
+    for service, path in (("booking", "POST /api/bookings"), ("trip", "POST /api/trips/start")):
+        print(f"\n{path}: {args.requests} requests, concurrency {args.concurrency}")
+        results = {}
+        for profile in PROFILES:
+            results[profile] = run_profile(service, profile, args.requests, args.concurrency)
+            r = results[profile]
+            print(f"  {profile:8s} {r['rps']:8.0f} req/s  p50 {r['p50_ms']:7.2f} ms  p99 {r['p99_ms']:7.2f} ms")
+        print(f"  throughput x{results['tuned']['rps'] / results['default']['rps']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
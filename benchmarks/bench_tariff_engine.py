@@ -0,0 +1,102 @@
+"""
+Стоимость тарифного движка trip_service: расчёт одной поездки по
+таблице (зона, класс, суточный коэффициент), finish_values с промокодом
+(условия кода из кеша клиента, списание – запрос к подставному
+promo_service) и пакетный пересчёт завершённых поездок
+(crud.reprice_trips) на SQLite.
+
+    python benchmarks/bench_tariff_engine.py --rounds 200000 --trips 20000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+
+from _services import use_service
+
+use_service("trip")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'trips.db')}")
+
+from app import crud, database, migrations, models, promo_client, schemas, tariffs  # noqa: E402
+
+ZONES = [None, "center", "airport", "unknown"]
+CLASSES = [None, "economy", "comfort", "business"]
+
+
+def per_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        fn(i)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def fake_promo_service(request):
+    if request.url.path == "/api/promocodes/apply":
+        return httpx.Response(200, json={
+            "status": "applied", "promo_code": "BENCH", "discount_applied": 0.0,
+            "final_amount": 0.0, "usage_count": 1, "max_usages": 10**9,
+        })
+    return httpx.Response(200, json={
+        "code": "BENCH", "discount_percent": 15, "expires_at": "2099-01-01T00:00:00",
+        "min_order_amount": 0, "max_uses": 10**9, "used_count": 0,
+    })
+
+
+def seed_trips(count: int) -> None:
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        finished_at = now - timedelta(minutes=random.randrange(60 * 24 * 30))
+        rows.append(dict(
+            id=str(uuid.uuid4()), booking_id=f"b-{i}", user_id=f"u-{i % 500}", car_id=f"c-{i % 300}",
+            started_at=finished_at, finished_at=finished_at, created_at=finished_at,
+            distance_km=random.uniform(1, 40), duration_minutes=random.randrange(5, 120),
+            zone=random.choice(ZONES), car_class=random.choice(CLASSES),
+            parking_fines=0.0, discount_percent=random.choice([0.0, 10.0]),
+            base_amount=0.0, discount_amount=0.0, final_amount=0.0, tariff_version="old",
+            status=models.TripStatus.finished,
+        ))
+    with database.SessionLocal() as db:
+        db.execute(models.Trip.__table__.insert(), rows)
+        db.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200_000)
+    parser.add_argument("--trips", type=int, default=20_000)
+    args = parser.parse_args()
+
+    table = tariffs.store.current()
+    at = datetime.utcnow()
+    cases = [(random.uniform(1, 40), random.randrange(5, 120), random.choice(ZONES), random.choice(CLASSES))
+             for _ in range(1024)]
+
+    print("== Расчёт поездки, мкс на вызов")
+    print(f"ride_amount                  {per_call(lambda i: table.ride_amount(*cases[i % 1024][:2], at, *cases[i % 1024][2:]), args.rounds):7.2f}")
+
+    promo_client.client = promo_client.PromoClient(transport=httpx.MockTransport(fake_promo_service))
+    payload = schemas.TripFinish(distance_km=12.5, duration_minutes=30, zone="center",
+                                 car_class="business", promo_code="bench")
+    plain = schemas.TripFinish(distance_km=12.5, duration_minutes=30, zone="center", car_class="business")
+    trip = models.Trip(id="bench-trip", user_id="u-bench", started_at=at - timedelta(minutes=30))
+    print(f"finish_values без промокода  {per_call(lambda i: crud.finish_values(plain, trip), args.rounds // 4):7.2f}")
+    print(f"finish_values со списанием   {per_call(lambda i: crud.finish_values(payload, trip), args.rounds // 4):7.2f}")
+
+    migrations.upgrade(database.engine)
+    seed_trips(args.trips)
+    with database.SessionLocal() as db:
+        start = time.perf_counter()
+        result = crud.reprice_trips(db)
+        elapsed = time.perf_counter() - start
+    print(f"\n== Пересчёт {result['processed']} поездок ({result['changed']} изменено)")
+    print(f"{elapsed:.2f} с, {result['processed'] / elapsed:.0f} поездок/с")
+
+
+if __name__ == "__main__":
+    main()
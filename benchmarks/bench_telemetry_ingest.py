@@ -0,0 +1,132 @@
+"""
+Приём телеметрии trip_service: разбор пачки точек (NDJSON против
+бинарного '<f8'), полный путь запроса через ASGI, сброс буфера в
+append-only треки и длина трека – векторные гаверсинусы numpy против
+цикла на math.
+
+    python benchmarks/bench_telemetry_ingest.py --cars 2000 --points 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from _services import use_service
+
+use_service("trip")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'trips.db')}")
+os.environ.setdefault("TELEMETRY_DIR", os.path.join(tempfile.mkdtemp(), "telemetry"))
+
+from app import database, models, telemetry  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+def python_distance_km(points) -> float:
+    total = 0.0
+    for (_, lat1, lon1), (_, lat2, lon2) in zip(points, points[1:]):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+        total += 2 * telemetry.EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+    return total
+
+
+def make_batch(n: int, start: float) -> np.ndarray:
+    ts = start + np.arange(n) * 3.0
+    return np.column_stack([ts, 55.75 + np.cumsum(np.full(n, 1e-4)), 37.61 + np.cumsum(np.full(n, 1e-4))])
+
+
+async def post(path: str, body: bytes, content_type: str) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": b"", "headers": [(b"content-type", content_type.encode())],
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def seed_trips(count: int) -> None:
+    # телеметрию принимают только идущие поездки
+    with database.SessionLocal() as db:
+        db.execute(models.Trip.__table__.insert(), [
+            dict(id=f"trip-{i}", booking_id=f"b-{i}", user_id=f"u-{i}", car_id=f"c-{i}",
+                 status=models.TripStatus.in_progress)
+            for i in range(count)
+        ])
+        db.commit()
+
+
+def run_requests(bodies, content_type: str) -> float:
+    async def run():
+        start = time.perf_counter()
+        for i, body in enumerate(bodies):
+            assert await post(f"/api/trips/trip-{i}/telemetry", body, content_type) == 200
+        return time.perf_counter() - start
+
+    return asyncio.run(run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=2000, help="пачек (машин) за прогон")
+    parser.add_argument("--points", type=int, default=20, help="точек в пачке")
+    parser.add_argument("--track", type=int, default=100_000, help="точек в треке для расчёта пробега")
+    args = parser.parse_args()
+
+    batches = [make_batch(args.points, 1.7e9 + i) for i in range(args.cars)]
+    ndjson = [
+        "\n".join(json.dumps({"ts": t, "lat": lat, "lon": lon}) for t, lat, lon in batch).encode() for batch in batches
+    ]
+    binary = [batch.astype("<f8").tobytes() for batch in batches]
+    total = args.cars * args.points
+
+    print(f"== Разбор пачки из {args.points} точек, мкс")
+    for label, bodies, content_type in (("NDJSON", ndjson, "application/x-ndjson"),
+                                        ("binary", binary, "application/octet-stream")):
+        start = time.perf_counter()
+        for body in bodies:
+            telemetry.parse_points(body, content_type)
+        print(f"{label:<8} {(time.perf_counter() - start) / args.cars * 1e6:8.1f}")
+
+    seed_trips(args.cars)
+    print(f"\n== POST /api/trips/{{id}}/telemetry через ASGI, {args.cars} пачек")
+    for label, bodies, content_type in (("NDJSON", ndjson, "application/x-ndjson"),
+                                        ("binary", binary, "application/octet-stream")):
+        elapsed = run_requests(bodies, content_type)
+        print(f"{label:<8} {args.cars / elapsed:8.0f} запросов/с  {total / elapsed:10.0f} точек/с")
+
+    start = time.perf_counter()
+    flushed = telemetry.buffer.flush()
+    elapsed = time.perf_counter() - start
+    print(f"\n== Сброс буфера: {flushed} точек в {args.cars} треков за {elapsed * 1000:.1f} мс")
+
+    track = make_batch(args.track, 1.7e9)
+    start = time.perf_counter()
+    vectorised = telemetry.track_distance_km(track)
+    fast = time.perf_counter() - start
+    rows = track.tolist()
+    start = time.perf_counter()
+    looped = python_distance_km(rows)
+    slow = time.perf_counter() - start
+    print(f"\n== Пробег по треку из {args.track} точек")
+    print(f"numpy    {fast * 1000:8.2f} мс  ({vectorised:.3f} км)")
+    print(f"math     {slow * 1000:8.2f} мс  ({looped:.3f} км)")
+
+
+if __name__ == "__main__":
+    main()
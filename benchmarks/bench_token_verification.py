@@ -0,0 +1,88 @@
+"""
+Стоимость проверки токена доступа (common.tokens) на запрос:
+выпуск, проверка без кеша (HMAC + разбор JSON), проверка с попаданием
+в LRU и полный путь FastAPI-зависимости authenticate через ASGI.
+
+    python benchmarks/bench_token_verification.py --rounds 100000
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from fastapi import Depends, FastAPI
+
+import _services  # noqa: E402,F401 – корень репозитория (common) в sys.path
+from common import tokens  # noqa: E402
+
+
+def per_call(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+async def call(app, headers) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/ping", "raw_path": b"/ping",
+        "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def per_request(app, headers, rounds: int) -> float:
+    async def run():
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await call(app, headers)
+        return time.perf_counter() - start
+
+    return asyncio.run(run()) / rounds * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=100_000)
+    args = parser.parse_args()
+
+    token = tokens.issue_token("bench-user")
+    uncached = tokens._decode.__wrapped__
+
+    print("== Функции common.tokens, мкс на вызов")
+    print(f"issue_token            {per_call(lambda: tokens.issue_token('bench-user'), args.rounds):7.2f}")
+    print(f"проверка без кеша      {per_call(lambda: uncached(token), args.rounds):7.2f}")
+    tokens.verify_token(token)
+    print(f"проверка из LRU        {per_call(lambda: tokens.verify_token(token), args.rounds):7.2f}")
+
+    plain = FastAPI()
+    protected = FastAPI()
+
+    @plain.get("/ping")
+    async def ping_plain():
+        return {"ok": True}
+
+    @protected.get("/ping", dependencies=[Depends(tokens.authenticate)])
+    async def ping_protected():
+        return {"ok": True}
+
+    requests = max(args.rounds // 10, 1000)
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    print(f"\n== Запрос через ASGI, мкс на запрос ({requests} запросов)")
+    base = per_request(plain, headers, requests)
+    auth = per_request(protected, headers, requests)
+    print(f"без проверки           {base:7.1f}")
+    print(f"с authenticate         {auth:7.1f}  (+{auth - base:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Нагрузочный прогон сервисов: в процессе (ASGI напрямую) или через
+настоящий uvicorn, по сценарию горячего пути или по записанному трафику.
+
+Трафик – JSONL, запрос на строку (формат в traffic.py); такие файлы
+пишет common/capture.py на работающем сервисе. Replay подаёт их как
+можно быстрее, в темпе записи или ускоренно (--speed) и сравнивает
+латентности с записанными.
+
+Результат – пропускная способность и p50/p95/p99 по каждому endpoint,
+сохраняется в JSON вместе с коммитом, чтобы сравнивать прогоны между
+коммитами.
+
+    python -m benchmarks.loadtest run car_list --requests 5000 --concurrency 50
+    python -m benchmarks.loadtest run booking_create_list --mode uvicorn --workers 2
+    python -m benchmarks.loadtest replay trip traffic.jsonl --mode asgi
+    python -m benchmarks.loadtest replay promo capture/promo_service.jsonl* --speed original --concurrency 200
+    python -m benchmarks.loadtest compare base.json new.json --threshold 10
+
+Сценарии: python -m benchmarks.loadtest list.
+"""
@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import os
+import sys
+
+from . import __doc__ as package_doc
+from . import stats
+from .drivers import ROOT, SERVICES, AsgiDriver, UvicornDriver
+from .runner import run_records, run_timed
+from .scenarios import SCENARIOS
+from .traffic import iter_traffic, write_traffic
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+
+def make_driver(args):
+    if args.mode == "asgi":
+        return AsgiDriver(args.service)
+    return UvicornDriver(args.service, workers=args.workers, concurrency=args.concurrency, base_url=args.base_url)
+
+
+async def execute(args, build):
+    """build(driver) -> запросы; первые args.warmup из них в статистику не идут."""
+    async with make_driver(args) as driver:
+        records = await build(driver)
+        if args.save_traffic:
+            write_traffic(args.save_traffic, records)
+        warmup, measured = records[:args.warmup], records[args.warmup:]
+        if warmup:
+            await run_records(driver, warmup, args.concurrency)
+        samples, elapsed = await run_records(driver, measured, args.concurrency)
+    return stats.summarize(samples, elapsed), elapsed
+
+
+def report(args, label: str, summary, elapsed: float, **extra) -> None:
+    meta = stats.metadata(
+        service=args.service, workload=label, mode=args.mode,
+        workers=args.workers if args.mode == "uvicorn" else None,
+        concurrency=args.concurrency, warmup=args.warmup, elapsed_s=round(elapsed, 3),
+    )
+    result = {"meta": meta, **summary, **extra}
+    print(f"== {args.service} / {label}, {args.mode}, concurrency {args.concurrency}, {elapsed:.2f} с")
+    print(stats.format_table(result))
+    out = args.out or os.path.join(RESULTS_DIR, f"{args.service}-{label}-{args.mode}-{meta['commit']}.json")
+    stats.save(out, result)
+    print(f"\nрезультат: {os.path.relpath(out)}")
+
+
+def cmd_run(args) -> int:
+    spec = SCENARIOS[args.scenario]
+    args.service = spec["service"]
+    summary, elapsed = asyncio.run(execute(args, lambda driver: spec["build"](driver, args.requests + args.warmup)))
+    report(args, args.scenario, summary, elapsed)
+    return 0
+
+
+def parse_speed(value: str) -> float:
+    """'max' – как можно быстрее (0), 'original' – темп записи (1), число – ускорение."""
+    if value == "max":
+        return 0.0
+    if value == "original":
+        return 1.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive, 'original' or 'max'")
+    return speed
+
+
+def cmd_replay(args) -> int:
+    records = list(iter_traffic(args.traffic))
+    if args.speed:
+        if any("ts" not in record for record in records):
+            print("для воспроизведения в темпе записи у каждой строки нужен ts", file=sys.stderr)
+            return 2
+        # файлы после ротации идут в любом порядке – расписание строится по ts
+        records.sort(key=lambda record: record["ts"])
+    records = records[:args.limit]
+    timing = {}
+
+    async def replay():
+        async with make_driver(args) as driver:
+            if args.speed:
+                samples, elapsed, lags = await run_timed(driver, records, args.speed, args.concurrency)
+                timing["lag"] = stats.distribution(lags)
+            else:
+                samples, elapsed = await run_records(driver, records, args.concurrency)
+        return samples, elapsed
+
+    samples, elapsed = asyncio.run(replay())
+    versus = stats.versus_recording(records, samples)
+    label = os.path.splitext(os.path.basename(args.traffic[0]))[0]
+    speed = "max" if not args.speed else f"x{args.speed:g}"
+    report(args, label, stats.summarize(samples, elapsed), elapsed,
+           replay={"speed": speed, "files": args.traffic, **timing, "vs_recording": versus})
+    if "lag" in timing:
+        print(f"\nопоздание отправки от расписания: p50 {timing['lag']['p50_ms']:.2f} мс, "
+              f"p99 {timing['lag']['p99_ms']:.2f} мс, max {timing['lag']['max_ms']:.2f} мс")
+    if versus["endpoints"] or versus["status_mismatches"]:
+        print("\n== Против записи")
+        print(stats.format_versus(versus))
+    return 0
+
+
+def cmd_compare(args) -> int:
+    table, regressions = stats.compare(stats.load(args.base), stats.load(args.new), args.threshold)
+    print(table)
+    if regressions:
+        print(f"\nрегрессии больше {args.threshold}%:")
+        print("\n".join(f"  {line}" for line in regressions))
+        return 1
+    return 0
+
+
+def cmd_list(args) -> int:
+    for name, spec in SCENARIOS.items():
+        print(f"{name:<22} {spec['service']:<8} {spec['description']}")
+    return 0
+
+
+def add_load_options(parser) -> None:
+    parser.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn")
+    parser.add_argument("--base-url", help="уже запущенный сервис вместо своего uvicorn")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=200, help="запросов до начала замеров")
+    parser.add_argument("--out", help=f"файл результата (по умолчанию {os.path.relpath(RESULTS_DIR)}/...)")
+    parser.add_argument("--save-traffic", help="сохранить сгенерированные запросы в JSONL")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.loadtest", description=package_doc,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="сценарий горячего пути")
+    run.add_argument("scenario", choices=sorted(SCENARIOS))
+    run.add_argument("--requests", type=int, default=5000)
+    add_load_options(run)
+    run.set_defaults(handler=cmd_run)
+
+    replay = commands.add_parser("replay", help="записанный трафик (захват или --save-traffic)")
+    replay.add_argument("service", choices=SERVICES)
+    replay.add_argument("traffic", nargs="+", help="JSONL-файлы с запросами (в т.ч. после ротации: x.jsonl x.jsonl.1 ...)")
+    replay.add_argument("--speed", type=parse_speed, default=0.0,
+                        help="max (по умолчанию), original – темп записи, или ускорение, например 5")
+    replay.add_argument("--limit", type=int, help="первые N запросов")
+    add_load_options(replay)
+    replay.set_defaults(handler=cmd_replay, warmup=0)
+
+    compare = commands.add_parser("compare", help="сравнить два результата")
+    compare.add_argument("base")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=10.0, help="допустимое ухудшение, %%")
+    compare.set_defaults(handler=cmd_compare)
+
+    commands.add_parser("list", help="список сценариев").set_defaults(handler=cmd_list)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
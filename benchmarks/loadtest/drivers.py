@@ -0,0 +1,178 @@
+"""
+Как запросы доходят до сервиса.
+
+AsgiDriver   – вызов ASGI-приложения в этом же процессе, без сети и
+               HTTP-парсинга: чистая стоимость приложения и middleware.
+UvicornDriver – сервис поднимается отдельным процессом uvicorn
+               (--workers), запросы идут по HTTP через httpx с пулом
+               keep-alive соединений.
+
+Оба – async context manager с методом send(record) -> (status, body).
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+from .._services import ROOT, use_service
+from .traffic import encode_request
+
+SERVICES = ("booking", "car", "fines", "geo", "promo", "support", "trip", "user")
+
+
+def service_env(service: str, workdir: str, workers: int = 1) -> Dict[str, str]:
+    """Окружение сервиса для прогона: временные БД и каталоги, без трассировки."""
+    env = {
+        "SERVICE_NAME": f"{service}_service",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, f'{service}.db')}",
+        "TELEMETRY_DIR": os.path.join(workdir, "telemetry"),
+        "TRACING_EXPORTER": os.getenv("TRACING_EXPORTER", "none"),
+    }
+    if workers > 1 and "STORAGE_URL" not in os.environ:
+        # хранилище в памяти у каждого воркера своё: данные setup видел бы один из них
+        env["STORAGE_URL"] = f"sqlite:///{os.path.join(workdir, f'{service}-storage.db')}"
+    return env
+
+
+def load_app(service: str, workdir: str):
+    """Импортирует app.main сервиса; в процессе может быть только один сервис."""
+    if service not in SERVICES:
+        raise ValueError(f"Unknown service: {service}")
+    if "app" in sys.modules:
+        raise RuntimeError("Another service is already loaded in this process")
+    os.environ.update(service_env(service, workdir))
+    use_service(service)
+    from app.main import app
+
+    return app
+
+
+class AsgiDriver:
+    def __init__(self, service: str, workdir: Optional[str] = None):
+        self.service = service
+        self.workdir = workdir or tempfile.mkdtemp(prefix=f"loadtest-{service}-")
+        self.app = load_app(service, self.workdir)
+        self._lifespan = None
+
+    async def __aenter__(self):
+        # lifespan запускает фоновые задачи сервиса (сборщик промокодов, сброс телеметрии)
+        self._lifespan = self.app.router.lifespan_context(self.app)
+        await self._lifespan.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._lifespan.__aexit__(*exc)
+
+    async def send(self, record: Dict) -> Tuple[int, bytes]:
+        headers, body = encode_request(record)
+        path = record["path"]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": record["method"].upper(), "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": (record.get("query") or "").encode(), "headers": headers,
+            "client": ("127.0.0.1", 50000), "server": ("loadtest", 80),
+        }
+        status = 0
+        chunks = []
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                # тело уже отдано: дальше приложение ждёт только разрыва соединения
+                await asyncio.Event().wait()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class UvicornDriver:
+    def __init__(
+        self,
+        service: str,
+        workers: int = 1,
+        concurrency: int = 64,
+        workdir: Optional[str] = None,
+        base_url: Optional[str] = None,
+        startup_timeout: float = 30.0,
+    ):
+        """base_url – уже запущенный сервис; тогда свой uvicorn не поднимается."""
+        self.service = service
+        self.workers = workers
+        self.workdir = workdir or tempfile.mkdtemp(prefix=f"loadtest-{service}-")
+        self.base_url = base_url
+        self.startup_timeout = startup_timeout
+        self.concurrency = concurrency
+        self._process: Optional[subprocess.Popen] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _start_server(self) -> None:
+        port = free_port()
+        env = {**os.environ, **service_env(self.service, self.workdir, self.workers), "PYTHONPATH": ROOT}
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(self.workers), "--log-level", "warning", "--no-access-log"],
+            cwd=os.path.join(ROOT, f"{self.service}_service"),
+            env=env,
+        )
+        self.base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {self._process.returncode}")
+            try:
+                if httpx.get(f"{self.base_url}/metrics", timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        self._stop_server()
+        raise RuntimeError(f"{self.service} did not start in {self.startup_timeout} s")
+
+    def _stop_server(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            try:
+                self._process.wait(10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+
+    async def __aenter__(self):
+        if self.base_url is None:
+            self._start_server()
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        self._client = httpx.AsyncClient(base_url=self.base_url, limits=limits, timeout=30)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._client.aclose()
+        self._stop_server()
+
+    async def send(self, record: Dict) -> Tuple[int, bytes]:
+        headers, body = encode_request(record)
+        query = record.get("query")
+        url = f"{record['path']}?{query}" if query else record["path"]
+        response = await self._client.request(record["method"].upper(), url, headers=headers, content=body)
+        return response.status_code, response.content
@@ -0,0 +1,82 @@
+"""
+Два режима подачи нагрузки.
+
+run_records – закрытый цикл: concurrency исполнителей берут следующий
+запрос, как только получили ответ на предыдущий; так меряется предельная
+пропускная способность при заданном числе одновременных клиентов.
+
+run_timed – открытый цикл по записанным ts: запрос уходит в свой момент
+(со сдвигом от начала записи, делённым на speed), не дожидаясь ответов
+на предыдущие; concurrency ограничивает число запросов в полёте. Если
+сервис не успевает, запросы уходят позже расписания – это видно по lag.
+
+Образец (sample) – (endpoint, status, латентность мс, индекс записи).
+"""
+import asyncio
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from .traffic import endpoint_of
+
+Sample = Tuple[str, int, float, int]
+
+
+async def _timed_send(driver, record: Dict, index: int, samples: List[Sample]) -> None:
+    start = time.perf_counter()
+    try:
+        status, _ = await driver.send(record)
+    except Exception:  # noqa: BLE001 – сетевой сбой считается ошибкой запроса
+        status = 0
+    samples.append((endpoint_of(record), status, (time.perf_counter() - start) * 1000, index))
+
+
+async def run_records(driver, records: Sequence[Dict], concurrency: int) -> Tuple[List[Sample], float]:
+    """Все записи через driver как можно быстрее; возвращает образцы и длительность прогона."""
+    samples: List[Sample] = []
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(records):
+            index = position
+            position += 1
+            await _timed_send(driver, records[index], index, samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(records))))))
+    return samples, time.perf_counter() - start
+
+
+async def run_timed(
+    driver, records: Sequence[Dict], speed: float, concurrency: int
+) -> Tuple[List[Sample], float, List[float]]:
+    """
+    Записи (упорядоченные по ts) в темпе записи, ускоренном в speed раз.
+    Возвращает образцы, длительность и опоздания отправки от расписания (мс).
+    """
+    samples: List[Sample] = []
+    lags: List[float] = []
+    in_flight = asyncio.Semaphore(concurrency)
+    tasks = set()
+    origin = records[0]["ts"] if records else 0.0
+
+    async def send(index: int) -> None:
+        try:
+            await _timed_send(driver, records[index], index, samples)
+        finally:
+            in_flight.release()
+
+    start = time.perf_counter()
+    for index, record in enumerate(records):
+        due = (record["ts"] - origin) / speed
+        delay = due - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await in_flight.acquire()
+        lags.append(max(0.0, (time.perf_counter() - start - due) * 1000))
+        task = asyncio.create_task(send(index))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return samples, time.perf_counter() - start, lags
@@ -0,0 +1,104 @@
+"""
+Сценарии горячих путей. Каждый готовит данные через тот же driver
+(setup) и возвращает список запросов нужной длины; запросы – те же
+записи, что и в файлах трафика, поэтому сценарий можно сохранить
+(--save-traffic) и потом проиграть командой replay – против сервиса с
+теми же данными, иначе ссылки на id из setup дадут 404.
+
+Пишущие запросы не повторяются: каждое бронирование – на свою машину,
+каждое завершение – своей поездки, иначе мерились бы 409/404.
+"""
+import json
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+SCENARIOS: Dict[str, Dict] = {}
+
+
+def scenario(service: str, description: str):
+    def register(fn: Callable):
+        SCENARIOS[fn.__name__] = {"service": service, "description": description, "build": fn}
+        return fn
+
+    return register
+
+
+async def _call(driver, method: str, path: str, body=None, expect: int = 200):
+    record = {"method": method, "path": path}
+    if body is not None:
+        record["json"] = body
+    status, raw = await driver.send(record)
+    if status != expect:
+        raise RuntimeError(f"setup {method} {path} -> {status}: {raw[:200]!r}")
+    return json.loads(raw) if raw else None
+
+
+@scenario("car", "GET /api/cars (весь парк) и GET /api/cars/{car_id}, 1:4")
+async def car_list(driver, requests: int, cars: int = 500) -> List[Dict]:
+    batch = [
+        {"model": "Kia Rio", "plate_number": f"LT{i:06d}", "color": "white", "location": "Москва",
+         "lat": 55.7 + random.random() / 10, "lon": 37.5 + random.random() / 10}
+        for i in range(cars)
+    ]
+    ids = [car["id"] for car in await _call(driver, "POST", "/api/cars/batch", batch)]
+    records = []
+    for i in range(requests):
+        if i % 5 == 0:
+            records.append({"method": "GET", "path": "/api/cars", "endpoint": "/api/cars"})
+        else:
+            records.append({"method": "GET", "path": f"/api/cars/{random.choice(ids)}", "endpoint": "/api/cars/{car_id}"})
+    return records
+
+
+@scenario("promo", "POST /api/promocodes/apply по одному коду разными пользователями")
+async def promo_apply(driver, requests: int) -> List[Dict]:
+    code = f"LOAD{uuid.uuid4().hex[:8].upper()}"
+    await _call(driver, "POST", "/api/promocodes", {
+        "code": code, "discount_percent": 10, "max_uses": requests * 2, "max_uses_per_user": 1,
+    })
+    return [
+        {"method": "POST", "path": "/api/promocodes/apply", "endpoint": "/api/promocodes/apply",
+         "json": {"promo_code": code, "user_id": f"load-user-{i}", "order_amount": 500}}
+        for i in range(requests)
+    ]
+
+
+@scenario("booking", "POST /api/bookings и GET /api/bookings?user_id=..., 1:1")
+async def booking_create_list(driver, requests: int, users: int = 100) -> List[Dict]:
+    start_at = datetime.utcnow() + timedelta(days=1)
+    # у каждого пользователя уже есть история, чтобы список не был пустым
+    for i in range(users):
+        await _call(driver, "POST", "/api/bookings", _booking(f"load-user-{i}", start_at))
+    records = []
+    for i in range(requests):
+        user_id = f"load-user-{i % users}"
+        if i % 2 == 0:
+            records.append({"method": "POST", "path": "/api/bookings", "endpoint": "/api/bookings",
+                            "json": _booking(user_id, start_at)})
+        else:
+            records.append({"method": "GET", "path": "/api/bookings", "endpoint": "/api/bookings",
+                            "query": f"user_id={user_id}&limit=20"})
+    return records
+
+
+def _booking(user_id: str, start_at: datetime) -> Dict:
+    return {
+        "user_id": user_id, "car_id": str(uuid.uuid4()), "zone_id": "zone-load",
+        "start_at": start_at.isoformat(), "end_at": (start_at + timedelta(minutes=30)).isoformat(),
+    }
+
+
+@scenario("trip", "POST /api/trips/{trip_id}/finish для заранее начатых поездок")
+async def trip_finish(driver, requests: int) -> List[Dict]:
+    records = []
+    for i in range(requests):
+        trip = await _call(driver, "POST", "/api/trips/start", {
+            "booking_id": f"load-booking-{i}", "user_id": f"load-user-{i % 100}", "car_id": f"load-car-{i}",
+        })
+        records.append({
+            "method": "POST", "path": f"/api/trips/{trip['id']}/finish", "endpoint": "/api/trips/{trip_id}/finish",
+            "json": {"distance_km": round(random.uniform(1, 30), 1), "duration_minutes": random.randint(5, 90)},
+        })
+    return records
@@ -0,0 +1,177 @@
+"""
+Сводка прогона и сравнение двух прогонов.
+
+Латентности – по каждому endpoint: p50/p95/p99 методом ближайшего ранга
+(без интерполяции – значение, которое реально наблюдалось).
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from .drivers import ROOT
+
+PERCENTILES = (50, 95, 99)
+COMPARED = ("rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies_ms: List[float], statuses: Counter, elapsed: float) -> Dict:
+    values = sorted(latencies_ms)
+    count = len(values)
+    summary = {
+        "count": count,
+        "errors": sum(n for status, n in statuses.items() if status >= 500 or status == 0),
+        "client_errors": sum(n for status, n in statuses.items() if 400 <= status < 500),
+        "rps": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / count, 3) if count else 0.0,
+    }
+    for q in PERCENTILES:
+        summary[f"p{q}_ms"] = round(percentile(values, q), 3)
+    summary["max_ms"] = round(values[-1], 3) if values else 0.0
+    summary["status"] = {str(status): n for status, n in sorted(statuses.items())}
+    return summary
+
+
+def summarize(samples: List[Tuple], elapsed: float) -> Dict:
+    """samples – (endpoint, status, латентность в мс, ...)."""
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for endpoint, status, latency_ms, *_ in samples:
+        latencies[endpoint].append(latency_ms)
+        statuses[endpoint][status] += 1
+    return {
+        "total": summarize_latencies([s[2] for s in samples], Counter(s[1] for s in samples), elapsed),
+        "endpoints": {
+            endpoint: summarize_latencies(latencies[endpoint], statuses[endpoint], elapsed)
+            for endpoint in sorted(latencies)
+        },
+    }
+
+
+def distribution(values: List[float]) -> Dict:
+    values = sorted(values)
+    result = {f"p{q}_ms": round(percentile(values, q), 3) for q in PERCENTILES}
+    result["max_ms"] = round(values[-1], 3) if values else 0.0
+    return result
+
+
+def versus_recording(records: List[Dict], samples: List[Tuple]) -> Dict:
+    """
+    Латентности воспроизведения против записанных (duration_ms) по
+    endpoint и число запросов, ответивших другим статусом, чем при записи.
+    Записанное время – серверное (от middleware захвата), поэтому
+    сравнение честнее всего в режиме asgi.
+    """
+    recorded = defaultdict(list)
+    replayed = defaultdict(list)
+    mismatches = Counter()
+    for endpoint, status, latency_ms, index in samples:
+        record = records[index]
+        replayed[endpoint].append(latency_ms)
+        if "duration_ms" in record:
+            recorded[endpoint].append(record["duration_ms"])
+        if "status" in record and record["status"] != status:
+            mismatches[f"{endpoint}: {record['status']} -> {status}"] += 1
+
+    endpoints = {}
+    for endpoint in sorted(recorded):
+        before, after = distribution(recorded[endpoint]), distribution(replayed[endpoint])
+        endpoints[endpoint] = {
+            metric: {
+                "recorded": before[metric],
+                "replayed": after[metric],
+                "delta_ms": round(after[metric] - before[metric], 3),
+            }
+            for metric in before
+        }
+    return {"endpoints": endpoints, "status_mismatches": dict(mismatches)}
+
+
+def format_versus(versus: Dict) -> str:
+    rows = [f"{'endpoint':<44} {'':<7} {'запись':>9} {'повтор':>9} {'Δ мс':>9}"]
+    for endpoint, metrics in versus["endpoints"].items():
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            m = metrics[metric]
+            rows.append(
+                f"{endpoint[:44]:<44} {metric[:-3]:<7} {m['recorded']:>9.2f} {m['replayed']:>9.2f} {m['delta_ms']:>+9.2f}"
+            )
+    for mismatch, count in versus["status_mismatches"].items():
+        rows.append(f"другой статус  {mismatch}: {count}")
+    return "\n".join(rows)
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "diff", "--quiet", "HEAD"], cwd=ROOT).returncode != 0
+        return out + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def metadata(**fields) -> Dict:
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        **fields,
+    }
+
+
+def save(path: str, result: Dict) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def load(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_table(result: Dict) -> str:
+    rows = [f"{'endpoint':<44} {'count':>7} {'5xx':>5} {'4xx':>5} {'rps':>9} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}"]
+    for endpoint, s in [*result["endpoints"].items(), ("ИТОГО", result["total"])]:
+        rows.append(
+            f"{endpoint[:44]:<44} {s['count']:>7} {s['errors']:>5} {s['client_errors']:>5} {s['rps']:>9.1f} "
+            f"{s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+    return "\n".join(rows)
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> Tuple[str, List[str]]:
+    """
+    Таблица изменений по endpoint и список регрессий: рост p95/p99 или
+    падение rps больше чем на threshold процентов.
+    """
+    rows = [f"{'endpoint':<44} {'метрика':<8} {'было':>10} {'стало':>10} {'Δ %':>8}"]
+    regressions = []
+    endpoints = [("ИТОГО", base["total"], new["total"])] + [
+        (name, base["endpoints"][name], new["endpoints"][name])
+        for name in new["endpoints"] if name in base["endpoints"]
+    ]
+    for name, before, after in endpoints:
+        for metric in COMPARED:
+            old, cur = before[metric], after[metric]
+            delta = (cur - old) / old * 100 if old else 0.0
+            rows.append(f"{name[:44]:<44} {metric:<8} {old:>10.2f} {cur:>10.2f} {delta:>+8.1f}")
+            worse = -delta if metric == "rps" else delta
+            if metric != "p50_ms" and worse > threshold:
+                regressions.append(f"{name} {metric}: {old:.2f} -> {cur:.2f} ({delta:+.1f}%)")
+    return "\n".join(rows), regressions
@@ -0,0 +1,63 @@
+"""
+Формат записанного трафика – JSON-объект на строку:
+
+    {"method": "POST", "path": "/api/promocodes/apply",
+     "query": "",                       # строка запроса без '?', необязательно
+     "headers": {"x-request-id": "..."}, # необязательно
+     "json": {...},                      # тело-JSON, или
+     "body": "...",                      # тело как строка (не JSON), или
+     "body_b64": "...",                  # двоичное тело в base64
+     "endpoint": "/api/promocodes/apply",# шаблон маршрута для группировки
+     "ts": 1760000000.123,               # момент записи, epoch (для replay по времени)
+     "status": 200, "duration_ms": 3.2}  # ответ при записи (для сравнения)
+
+Такие строки пишет common/capture.py (там же response_json / response_body
+ответа). Обязательны только method и path. Без endpoint запросы группируются
+по "METHOD path".
+"""
+import base64
+import json
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+def endpoint_of(record: Dict) -> str:
+    return f"{record['method'].upper()} {record.get('endpoint') or record['path']}"
+
+
+# относятся к исходному соединению и телу; при воспроизведении их выставляет клиент
+CONNECTION_HEADERS = frozenset({"host", "content-length", "connection", "transfer-encoding", "keep-alive"})
+
+
+def encode_request(record: Dict) -> Tuple[List[Tuple[bytes, bytes]], bytes]:
+    """Заголовки (в нижнем регистре, как в ASGI) и тело запроса."""
+    headers = [
+        (k.lower().encode("latin-1"), str(v).encode("latin-1"))
+        for k, v in (record.get("headers") or {}).items()
+        if k.lower() not in CONNECTION_HEADERS
+    ]
+    if "json" in record:
+        body = json.dumps(record["json"], separators=(",", ":")).encode()
+        if not any(name == b"content-type" for name, _ in headers):
+            headers.append((b"content-type", b"application/json"))
+    elif "body_b64" in record:
+        body = base64.b64decode(record["body_b64"])
+    else:
+        body = (record.get("body") or "").encode()
+    return headers, body
+
+
+def iter_traffic(paths: Iterable[str]) -> Iterator[Dict]:
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def write_traffic(path: str, records: Iterable[Dict]) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+    return count
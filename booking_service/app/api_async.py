@@ -0,0 +1,93 @@
+"""
+Эндпоинты бронирований поверх AsyncSession – подключаются в main.py
+вместо sync-роутера, когда DB_ASYNC=1.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
+
+from . import crud, crud_async, database, schemas
+
+router = APIRouter()
+
+
+@router.post("/api/bookings", response_model=schemas.BookingOut)
+async def create_booking(
+    payload: schemas.BookingCreate,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    ensure_subject(claims, payload.user_id)
+    try:
+        booking = await crud_async.create_booking(db, payload)
+    except crud.BookingConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    return booking
+
+
+@router.post("/api/bookings/{booking_id}/cancel", response_model=schemas.BookingOut)
+async def cancel_booking(
+    booking_id: str,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    booking = await crud_async.cancel_booking(db, booking_id, token_owner(claims))
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return booking
+
+
+@router.post("/api/bookings/{booking_id}/extend", response_model=schemas.BookingOut)
+async def extend_booking(
+    booking_id: str,
+    payload: schemas.BookingExtend,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    try:
+        booking = await crud_async.extend_booking(db, booking_id, payload.new_end_at, token_owner(claims))
+    except crud.BookingConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return booking
+
+
+@router.get("/api/bookings/{booking_id}", response_model=schemas.BookingOut)
+async def get_booking(
+    booking_id: str,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    booking = await crud_async.get_booking(db, booking_id, token_owner(claims))
+    if not booking:
+        raise HTTPException(status_code=404, detail="Booking not found")
+    return booking
+
+
+@router.get("/api/bookings", response_model=schemas.BookingList)
+async def list_bookings(
+    user_id: Optional[str] = None,
+    status: Optional[schemas.BookingStatus] = None,
+    offset: int = 0,
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    user_id = ensure_subject(claims, user_id)
+    try:
+        total, items = await crud_async.list_bookings(db, user_id, status, offset, limit, cursor, with_total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    items_out = [schemas.BookingOut.model_validate(b) for b in items]
+    next_cursor = crud.encode_cursor(items[-1]) if len(items) == limit else None
+
+    return schemas.BookingList(total=total, items=items_out, next_cursor=next_cursor)
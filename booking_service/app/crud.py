@@ -1,61 +1,218 @@
-from sqlalchemy.orm import Session
+import base64
+import uuid
+from sqlalchemy import exists, insert, literal, select, text, tuple_, update
+from sqlalchemy.orm import Session, aliased
 from datetime import datetime
 
+from common import tracing
+
 from . import models, schemas
 
-def create_booking(db: Session, payload: schemas.BookingCreate) -> models.Booking:
-    booking = models.Booking(
-        user_id=payload.user_id,
-        car_id=payload.car_id,
-        start_at=payload.start_at,
-        end_at=payload.end_at,
-        zone_id=payload.zone_id,
-        status=models.BookingStatus.created,
+# бронирования в этих статусах занимают машину на [start_at, end_at)
+ACTIVE_STATUSES = (
+    models.BookingStatus.created,
+    models.BookingStatus.extended,
+    models.BookingStatus.active,
+)
+
+
+class BookingConflictError(Exception):
+    """Машина уже забронирована на пересекающийся интервал."""
+
+
+def uses_advisory_locks(db) -> bool:
+    # в Postgres при READ COMMITTED условие NOT EXISTS не видит чужих
+    # незакоммиченных вставок, поэтому операции по одной машине
+    # сериализуются advisory-lock до конца транзакции; в SQLite INSERT/UPDATE
+    # сразу берёт блокировку на запись и выполняется атомарно
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def lock_car_statement(car_id: str):
+    return text("SELECT pg_advisory_xact_lock(hashtext(:car_id))").bindparams(car_id=car_id)
+
+
+def overlap_exists(car_id, start_at, end_at, exclude_id=None):
+    """
+    EXISTS(активная бронь той же машины, пересекающая [start_at, end_at)).
+    Аргументы – значения или колонки bookings (для коррелированного UPDATE);
+    подзапрос идёт по индексу (car_id, status).
+    """
+    other = aliased(models.Booking)
+    condition = [
+        other.car_id == car_id,
+        other.status.in_(ACTIVE_STATUSES),
+        other.start_at < end_at,
+        other.end_at > start_at,
+    ]
+    if exclude_id is not None:
+        condition.append(other.id != exclude_id)
+    return exists().where(*condition)
+
+
+def insert_booking_statement(payload: schemas.BookingCreate):
+    """INSERT ... SELECT ... WHERE NOT EXISTS(пересечение) RETURNING – проверка и вставка одним запросом."""
+    values = {
+        "id": str(uuid.uuid4()),
+        "user_id": payload.user_id,
+        "car_id": payload.car_id,
+        "start_at": payload.start_at,
+        "end_at": payload.end_at,
+        "zone_id": payload.zone_id,
+        "status": models.BookingStatus.created,
+        "created_at": datetime.utcnow(),
+    }
+    columns = models.Booking.__table__.c
+    row = select(*[literal(value, columns[name].type) for name, value in values.items()]).where(
+        ~overlap_exists(payload.car_id, payload.start_at, payload.end_at)
+    )
+    return insert(models.Booking).from_select(list(values), row).returning(models.Booking)
+
+
+def by_id(booking_id: str, owner_id: str | None = None) -> list:
+    """Условия выборки бронирования по id; owner_id – только если оно этого пользователя."""
+    where = [models.Booking.id == booking_id]
+    if owner_id is not None:
+        where.append(models.Booking.user_id == owner_id)
+    return where
+
+
+def cancel_booking_statement(booking_id: str, owner_id: str | None = None):
+    return (
+        update(models.Booking)
+        .where(*by_id(booking_id, owner_id))
+        .values(status=models.BookingStatus.cancelled)
+        .returning(models.Booking)
     )
-    db.add(booking)
+
+
+def extend_booking_statement(booking_id: str, new_end_at: datetime, owner_id: str | None = None):
+    """UPDATE ... WHERE NOT EXISTS(пересечение с новым интервалом) RETURNING."""
+    return (
+        update(models.Booking)
+        .where(
+            *by_id(booking_id, owner_id),
+            models.Booking.start_at < new_end_at,
+            ~overlap_exists(models.Booking.car_id, models.Booking.start_at, new_end_at, models.Booking.id),
+        )
+        .values(end_at=new_end_at, status=models.BookingStatus.extended)
+        .returning(models.Booking)
+    )
+
+
+@tracing.traced
+def create_booking(db: Session, payload: schemas.BookingCreate) -> models.Booking:
+    if uses_advisory_locks(db):
+        db.execute(lock_car_statement(payload.car_id))
+    booking = db.scalars(insert_booking_statement(payload)).first()
+    if booking is None:
+        db.rollback()
+        raise BookingConflictError("Car is already booked for this period")
     db.commit()
-    db.refresh(booking)
     return booking
 
 
-def cancel_booking(db: Session, booking_id: str):
-    booking = db.query(models.Booking).filter(models.Booking.id == booking_id).first()
-    if not booking:
-        return None
-    booking.status = models.BookingStatus.cancelled
+@tracing.traced
+def cancel_booking(db: Session, booking_id: str, owner_id: str | None = None):
+    booking = db.scalars(cancel_booking_statement(booking_id, owner_id)).one_or_none()
     db.commit()
-    db.refresh(booking)
     return booking
 
 
-def extend_booking(db: Session, booking_id: str, new_end_at: datetime):
-    booking = db.query(models.Booking).filter(models.Booking.id == booking_id).first()
-    if not booking:
+@tracing.traced
+def extend_booking(db: Session, booking_id: str, new_end_at: datetime, owner_id: str | None = None):
+    new_end_at = schemas.as_utc_naive(new_end_at)
+    if uses_advisory_locks(db):
+        car_id = db.scalar(select(models.Booking.car_id).where(*by_id(booking_id, owner_id)))
+        if car_id is None:
+            return None
+        db.execute(lock_car_statement(car_id))
+
+    booking = db.scalars(extend_booking_statement(booking_id, new_end_at, owner_id)).one_or_none()
+    if booking is not None:
+        db.commit()
+        return booking
+
+    # UPDATE ничего не изменил – выясняем почему (только на пути ошибки)
+    db.rollback()
+    existing = get_booking(db, booking_id, owner_id)
+    if not existing:
         return None
-    booking.end_at = new_end_at
-    booking.status = models.BookingStatus.extended
-    db.commit()
-    db.refresh(booking)
-    return booking
+    # из Postgres start_at приходит со смещением, из SQLite – без
+    if new_end_at <= schemas.as_utc_naive(existing.start_at):
+        raise ValueError("new_end_at must be after start_at")
+    raise BookingConflictError("Car is already booked for this period")
 
 
-def get_booking(db: Session, booking_id: str):
-    return db.query(models.Booking).filter(models.Booking.id == booking_id).first()
+@tracing.traced
+def get_booking(db: Session, booking_id: str, owner_id: str | None = None):
+    return db.query(models.Booking).filter(*by_id(booking_id, owner_id)).first()
 
 
+def encode_cursor(booking: models.Booking) -> str:
+    raw = f"{booking.created_at.isoformat()}|{booking.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Разбирает курсор из encode_cursor, при мусоре на входе бросает ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, booking_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), booking_id
+    except (UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+@tracing.traced
 def list_bookings(
     db: Session,
     user_id: str | None = None,
     status: schemas.BookingStatus | None = None,
     offset: int = 0,
     limit: int = 20,
+    cursor: str | None = None,
+    with_total: bool = True,
 ):
+    """
+    Страница бронирований в порядке (created_at, id).
+    Если передан cursor, offset игнорируется и страница начинается сразу
+    после указанной записи (keyset-пагинация). with_total=False пропускает COUNT.
+    """
     query = db.query(models.Booking)
     if user_id:
         query = query.filter(models.Booking.user_id == user_id)
     if status:
         query = query.filter(models.Booking.status == status)
 
-    total = query.count()
-    items = query.offset(offset).limit(limit).all()
+    total = query.count() if with_total else None
+
+    query = query.order_by(models.Booking.created_at, models.Booking.id)
+    if cursor:
+        created_at, booking_id = decode_cursor(cursor)
+        query = query.filter(
+            tuple_(models.Booking.created_at, models.Booking.id) > tuple_(created_at, booking_id)
+        )
+    else:
+        query = query.offset(offset)
+
+    items = query.limit(limit).all()
     return total, items
+
+
+def iter_bookings(
+    db: Session,
+    user_id: str | None = None,
+    status: schemas.BookingStatus | None = None,
+    chunk_size: int = 1000,
+):
+    """Отдаёт бронирования пачками по chunk_size строк потоковым чтением, без .all()."""
+    stmt = select(models.Booking).order_by(models.Booking.created_at, models.Booking.id)
+    if user_id:
+        stmt = stmt.where(models.Booking.user_id == user_id)
+    if status:
+        stmt = stmt.where(models.Booking.status == status)
+
+    result = db.execute(stmt.execution_options(yield_per=chunk_size))
+    for chunk in result.scalars().partitions():
+        yield chunk
@@ -0,0 +1,103 @@
+"""
+Асинхронные версии функций из crud.py поверх AsyncSession (режим DB_ASYNC=1).
+Семантика, ошибки и курсоры те же, что в crud.py.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common import tracing
+
+from . import models, schemas
+from .crud import (
+    BookingConflictError,
+    by_id,
+    cancel_booking_statement,
+    decode_cursor,
+    extend_booking_statement,
+    insert_booking_statement,
+    lock_car_statement,
+    uses_advisory_locks,
+)
+
+
+@tracing.traced
+async def create_booking(db: AsyncSession, payload: schemas.BookingCreate) -> models.Booking:
+    if uses_advisory_locks(db):
+        await db.execute(lock_car_statement(payload.car_id))
+    booking = (await db.scalars(insert_booking_statement(payload))).first()
+    if booking is None:
+        await db.rollback()
+        raise BookingConflictError("Car is already booked for this period")
+    await db.commit()
+    return booking
+
+
+@tracing.traced
+async def get_booking(db: AsyncSession, booking_id: str, owner_id: str | None = None):
+    if owner_id is None:
+        return await db.get(models.Booking, booking_id)
+    return await db.scalar(select(models.Booking).where(*by_id(booking_id, owner_id)))
+
+
+@tracing.traced
+async def cancel_booking(db: AsyncSession, booking_id: str, owner_id: str | None = None):
+    booking = (await db.scalars(cancel_booking_statement(booking_id, owner_id))).one_or_none()
+    await db.commit()
+    return booking
+
+
+@tracing.traced
+async def extend_booking(db: AsyncSession, booking_id: str, new_end_at: datetime, owner_id: str | None = None):
+    new_end_at = schemas.as_utc_naive(new_end_at)
+    if uses_advisory_locks(db):
+        car_id = await db.scalar(select(models.Booking.car_id).where(*by_id(booking_id, owner_id)))
+        if car_id is None:
+            return None
+        await db.execute(lock_car_statement(car_id))
+
+    booking = (await db.scalars(extend_booking_statement(booking_id, new_end_at, owner_id))).one_or_none()
+    if booking is not None:
+        await db.commit()
+        return booking
+
+    await db.rollback()
+    existing = await get_booking(db, booking_id, owner_id)
+    if not existing:
+        return None
+    # из Postgres start_at приходит со смещением, из SQLite – без
+    if new_end_at <= schemas.as_utc_naive(existing.start_at):
+        raise ValueError("new_end_at must be after start_at")
+    raise BookingConflictError("Car is already booked for this period")
+
+
+@tracing.traced
+async def list_bookings(
+    db: AsyncSession,
+    user_id: str | None = None,
+    status: schemas.BookingStatus | None = None,
+    offset: int = 0,
+    limit: int = 20,
+    cursor: str | None = None,
+    with_total: bool = True,
+):
+    stmt = select(models.Booking)
+    if user_id:
+        stmt = stmt.where(models.Booking.user_id == user_id)
+    if status:
+        stmt = stmt.where(models.Booking.status == status)
+
+    total = None
+    if with_total:
+        total = await db.scalar(select(func.count()).select_from(stmt.subquery()))
+
+    stmt = stmt.order_by(models.Booking.created_at, models.Booking.id)
+    if cursor:
+        created_at, booking_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(models.Booking.created_at, models.Booking.id) > tuple_(created_at, booking_id))
+    else:
+        stmt = stmt.offset(offset)
+
+    items = (await db.scalars(stmt.limit(limit))).all()
+    return total, items
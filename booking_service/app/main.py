@@ -1,114 +1,142 @@
-import time
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import Response
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import Optional
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
 
-from . import database, models, schemas, crud
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
+from . import database, schemas, crud, migrations
 
-# создаём таблицы при старте
-models.Base.metadata.create_all(bind=database.engine)
+# создаём или обновляем схему при старте
+migrations.upgrade(database.engine)
 
 app = FastAPI(title="Booking Service")
 
 # ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
-
 SERVICE_NAME = "booking_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME, engines=[database.engine, database.async_engine])
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
+
+
+@app.get("/api/bookings/export")
+def export_bookings(
+    user_id: Optional[str] = None,
+    status: Optional[schemas.BookingStatus] = None,
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    """
+    Выгрузка всех бронирований в NDJSON (одна запись на строку) потоком.
+    Сессия открывается внутри генератора и живёт, пока отдаётся ответ.
+    """
+    user_id = ensure_subject(claims, user_id)
+    def generate():
+        db = database.SessionLocal()
+        try:
+            for chunk in crud.iter_bookings(db, user_id, status):
+                yield "".join(
+                    schemas.BookingOut.model_validate(b).model_dump_json() + "\n" for b in chunk
+                )
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
 
-@app.post("/api/bookings", response_model=schemas.BookingOut)
+# CRUD-эндпоинты на sync Session; при DB_ASYNC=1 вместо них подключается api_async.router
+router = APIRouter()
+
+
+@router.post("/api/bookings", response_model=schemas.BookingOut)
 def create_booking(
     payload: schemas.BookingCreate,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    booking = crud.create_booking(db, payload)
+    ensure_subject(claims, payload.user_id)
+    try:
+        booking = crud.create_booking(db, payload)
+    except crud.BookingConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
     return booking
 
 
-@app.post("/api/bookings/{booking_id}/cancel", response_model=schemas.BookingOut)
+@router.post("/api/bookings/{booking_id}/cancel", response_model=schemas.BookingOut)
 def cancel_booking(
     booking_id: str,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    booking = crud.cancel_booking(db, booking_id)
+    booking = crud.cancel_booking(db, booking_id, token_owner(claims))
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     return booking
 
 
-@app.post("/api/bookings/{booking_id}/extend", response_model=schemas.BookingOut)
+@router.post("/api/bookings/{booking_id}/extend", response_model=schemas.BookingOut)
 def extend_booking(
     booking_id: str,
     payload: schemas.BookingExtend,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    booking = crud.extend_booking(db, booking_id, payload.new_end_at)
+    try:
+        booking = crud.extend_booking(db, booking_id, payload.new_end_at, token_owner(claims))
+    except crud.BookingConflictError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     return booking
 
 
-@app.get("/api/bookings/{booking_id}", response_model=schemas.BookingOut)
+@router.get("/api/bookings/{booking_id}", response_model=schemas.BookingOut)
 def get_booking(
     booking_id: str,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    booking = crud.get_booking(db, booking_id)
+    booking = crud.get_booking(db, booking_id, token_owner(claims))
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     return booking
 
 
-@app.get("/api/bookings", response_model=schemas.BookingList)
+@router.get("/api/bookings", response_model=schemas.BookingList)
 def list_bookings(
     user_id: Optional[str] = None,
     status: Optional[schemas.BookingStatus] = None,
     offset: int = 0,
-    limit: int = 20,
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = True,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    total, items = crud.list_bookings(db, user_id, status, offset, limit)
+    user_id = ensure_subject(claims, user_id)
+    try:
+        total, items = crud.list_bookings(db, user_id, status, offset, limit, cursor, with_total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
     # 👇 явное преобразование ORM → BookingOut
     items_out = [schemas.BookingOut.model_validate(b) for b in items]
+    next_cursor = crud.encode_cursor(items[-1]) if len(items) == limit else None
+
+    return schemas.BookingList(total=total, items=items_out, next_cursor=next_cursor)
+
+
+# Bearer-токен из user_service проверяется локально (common.tokens)
+if database.DB_ASYNC:
+    from . import api_async
 
-    return schemas.BookingList(total=total, items=items_out)
+    app.include_router(api_async.router, dependencies=[Depends(authenticate)])
+else:
+    app.include_router(router, dependencies=[Depends(authenticate)])
@@ -0,0 +1,34 @@
+"""
+Шаги миграций схемы booking_service; запускает их common.migrations.SchemaMigrator,
+версия – в таблице booking_schema_version. Шаги должны быть идемпотентными.
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from common.migrations import SchemaMigrator
+
+from . import models
+
+
+def _add_query_indexes(conn: Connection) -> None:
+    for index in models.Booking.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    if conn.dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP пишет время без микросекунд, а ORM – с ними;
+        # приводим старые строки к одному формату для keyset-пагинации
+        conn.execute(text(
+            "UPDATE bookings SET created_at = created_at || '.000000' "
+            "WHERE length(created_at) = 19"
+        ))
+
+
+# (версия, функция) – версия, до которой функция поднимает схему
+MIGRATIONS = [
+    (2, _add_query_indexes),
+]
+
+migrator = SchemaMigrator("booking", models.Base.metadata, models.Booking.__tablename__, MIGRATIONS)
+
+HEAD_VERSION = migrator.head_version
+current_version = migrator.current_version
+upgrade = migrator.upgrade
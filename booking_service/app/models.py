@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, DateTime, Enum
+from sqlalchemy import Column, String, DateTime, Enum, Index
 from sqlalchemy.sql import func
 import uuid
 import enum
+from datetime import datetime
 
 from .database import Base
 
@@ -15,6 +16,13 @@ class BookingStatus(str, enum.Enum):
 
 class Booking(Base):
     __tablename__ = "bookings"
+    # индексы под реальные фильтры списков и проверки по машине;
+    # при изменении набора индексов нужна новая миграция в migrations.py
+    __table_args__ = (
+        Index("ix_bookings_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_bookings_car_status", "car_id", "status"),
+        Index("ix_bookings_created_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, nullable=False)
@@ -23,5 +31,7 @@ class Booking(Base):
     end_at = Column(DateTime(timezone=True), nullable=False)
     zone_id = Column(String, nullable=False)
     status = Column(Enum(BookingStatus), nullable=False, default=BookingStatus.created)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # значение проставляет ORM (с микросекундами), чтобы keyset-пагинация по
+    # (created_at, id) сравнивала значения в одном формате
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
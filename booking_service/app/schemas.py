@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, field_validator, model_validator
+from datetime import datetime, timezone
 from typing import Optional, List
 from enum import Enum
 
@@ -11,6 +11,13 @@ class BookingStatus(str, Enum):
     expired = "expired"
 
 
+def as_utc_naive(value: datetime) -> datetime:
+    """Время со смещением – в UTC без tzinfo, как хранятся брони (SQLite tzinfo не сохраняет)."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 class BookingCreate(BaseModel):
     user_id: str
     car_id: str
@@ -18,10 +25,20 @@ class BookingCreate(BaseModel):
     end_at: datetime
     zone_id: str
 
+    _utc_naive = field_validator("start_at", "end_at")(as_utc_naive)
+
+    @model_validator(mode="after")
+    def check_interval(self):
+        if self.end_at <= self.start_at:
+            raise ValueError("end_at must be after start_at")
+        return self
+
 
 class BookingExtend(BaseModel):
     new_end_at: datetime
 
+    _utc_naive = field_validator("new_end_at")(as_utc_naive)
+
 
 class BookingOut(BaseModel):
     id: str
@@ -36,5 +53,8 @@ class BookingOut(BaseModel):
 
 
 class BookingList(BaseModel):
-    total: int
+    # None, если список запрошен с with_total=false
+    total: Optional[int] = None
     items: list[BookingOut]
+    # курсор следующей страницы, None – если страница последняя
+    next_cursor: Optional[str] = None
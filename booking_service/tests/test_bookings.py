@@ -5,6 +5,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from fastapi.testclient import TestClient
 from app.main import app
 from datetime import datetime, timedelta
+import json
+import pytest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 client = TestClient(app)
 
@@ -70,3 +74,323 @@ def test_extend_and_list_bookings():
     data3 = r3.json()
     assert data3["total"] >= 1
     assert any(item["id"] == booking_id for item in data3["items"])
+
+
+def test_keyset_pagination_and_export():
+    user_id = "user-test-keyset"
+    start_at = datetime.utcnow()
+    created_ids = []
+    for i in range(5):
+        payload = {
+            "user_id": user_id,
+            "car_id": f"car-keyset-{i}",
+            "start_at": (start_at + timedelta(hours=i)).isoformat(),
+            "end_at": (start_at + timedelta(hours=i, minutes=30)).isoformat(),
+            "zone_id": "zone-keyset",
+        }
+        r = client.post("/api/bookings", json=payload)
+        assert r.status_code == 200
+        created_ids.append(r.json()["id"])
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"user_id": user_id, "limit": 2, "with_total": False}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/bookings", params=params)
+        assert r.status_code == 200
+        page = r.json()
+        assert page["total"] is None
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == created_ids
+
+    assert client.get("/api/bookings", params={"cursor": "not-a-cursor"}).status_code == 400
+
+    r = client.get("/api/bookings/export", params={"user_id": user_id})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert [item["id"] for item in lines] == created_ids
+
+
+def test_migrations_upgrade_legacy_database(tmp_path):
+    from sqlalchemy import create_engine, inspect, text
+    from app import migrations
+
+    # схема bookings.db в том виде, в каком её создавал create_all до миграций
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE bookings (id VARCHAR NOT NULL, user_id VARCHAR NOT NULL, "
+            "car_id VARCHAR NOT NULL, start_at DATETIME NOT NULL, end_at DATETIME NOT NULL, "
+            "zone_id VARCHAR NOT NULL, status VARCHAR(9) NOT NULL, "
+            "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME, PRIMARY KEY (id))"
+        ))
+        conn.execute(text(
+            "INSERT INTO bookings (id, user_id, car_id, start_at, end_at, zone_id, status) "
+            "VALUES ('b1', 'u1', 'c1', '2025-01-01 10:00:00', '2025-01-01 11:00:00', 'z1', 'created')"
+        ))
+
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+    # повторный запуск ничего не делает
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+
+    index_names = {ix["name"] for ix in inspect(engine).get_indexes("bookings")}
+    assert {"ix_bookings_user_status_created", "ix_bookings_car_status"} <= index_names
+    with engine.connect() as conn:
+        created_at = conn.execute(text("SELECT created_at FROM bookings")).scalar()
+    assert len(created_at) == 26
+
+
+def _booking_payload(car_id, start_at, minutes, user_id="user-overlap"):
+    return {
+        "user_id": user_id,
+        "car_id": car_id,
+        "start_at": start_at.isoformat(),
+        "end_at": (start_at + timedelta(minutes=minutes)).isoformat(),
+        "zone_id": "zone-overlap",
+    }
+
+
+def test_overlapping_bookings_are_rejected():
+    car_id = f"car-overlap-{uuid.uuid4()}"
+    start_at = datetime(2030, 1, 1, 10, 0)
+
+    first = client.post("/api/bookings", json=_booking_payload(car_id, start_at, 60))
+    assert first.status_code == 200
+
+    r = client.post("/api/bookings", json=_booking_payload(car_id, start_at + timedelta(minutes=30), 60))
+    assert r.status_code == 409
+
+    # стык интервалов пересечением не считается
+    second = client.post("/api/bookings", json=_booking_payload(car_id, start_at + timedelta(minutes=60), 60))
+    assert second.status_code == 200
+
+    # продлить первую бронь поверх второй нельзя
+    r = client.post(
+        f"/api/bookings/{first.json()['id']}/extend",
+        json={"new_end_at": (start_at + timedelta(minutes=90)).isoformat()},
+    )
+    assert r.status_code == 409
+
+    # после отмены интервал снова свободен
+    client.post(f"/api/bookings/{second.json()['id']}/cancel")
+    r = client.post(
+        f"/api/bookings/{first.json()['id']}/extend",
+        json={"new_end_at": (start_at + timedelta(minutes=90)).isoformat()},
+    )
+    assert r.status_code == 200
+
+    r = client.post("/api/bookings", json=_booking_payload(car_id, start_at, -10))
+    assert r.status_code == 422
+
+
+def test_extend_accepts_timestamps_with_offset():
+    car_id = f"car-tz-{uuid.uuid4()}"
+    start_at = datetime(2031, 3, 1, 10, 0)
+    booking = client.post("/api/bookings", json=_booking_payload(car_id, start_at, 60)).json()
+    assert booking["start_at"].startswith("2031-03-01T10:00")
+
+    # 14:00+03:00 – это 11:00 UTC
+    r = client.post(f"/api/bookings/{booking['id']}/extend", json={"new_end_at": "2031-03-01T14:00:00+03:00"})
+    assert r.status_code == 200
+    assert r.json()["end_at"].startswith("2031-03-01T11:00")
+
+    # 12:00+03:00 = 09:00 UTC – раньше начала брони
+    r = client.post(f"/api/bookings/{booking['id']}/extend", json={"new_end_at": "2031-03-01T12:00:00+03:00"})
+    assert r.status_code == 400
+
+    # crud без схемы: сравнение со временем из SQLite не падает TypeError
+    from datetime import timezone
+    from app import crud, database
+
+    with database.SessionLocal() as db:
+        with pytest.raises(ValueError):
+            crud.extend_booking(db, booking["id"], datetime(2031, 3, 1, 9, 0, tzinfo=timezone.utc))
+
+
+def test_parallel_bookings_for_same_car_only_one_wins():
+    car_id = f"car-race-{uuid.uuid4()}"
+    start_at = datetime(2030, 2, 1, 10, 0)
+
+    def book(i):
+        payload = _booking_payload(car_id, start_at + timedelta(minutes=i % 5), 30, user_id=f"user-race-{i}")
+        return client.post("/api/bookings", json=payload).status_code
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        codes = list(pool.map(book, range(32)))
+
+    assert codes.count(200) == 1
+    assert codes.count(409) == 31
+
+
+def test_sqlite_connections_use_wal_and_tuned_pragmas():
+    from sqlalchemy import text
+    from app import database
+
+    with database.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # 1 == NORMAL
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert conn.execute(text("PRAGMA cache_size")).scalar() == int(database.SQLITE_PRAGMAS["cache_size"])
+
+
+def test_async_router_mirrors_sync_endpoints(tmp_path):
+    from fastapi import FastAPI
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app import api_async, database, models
+
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    models.Base.metadata.create_all(bind=database.make_engine(url))
+    async_session = async_sessionmaker(database.make_async_engine(url), expire_on_commit=False)
+
+    async def get_async_db():
+        async with async_session() as db:
+            yield db
+
+    async_app = FastAPI()
+    async_app.include_router(api_async.router)
+    async_app.dependency_overrides[database.get_async_db] = get_async_db
+
+    with TestClient(async_app) as async_client:
+        car_id = f"car-async-{uuid.uuid4()}"
+        start_at = datetime(2030, 3, 1, 10, 0)
+        r = async_client.post("/api/bookings", json=_booking_payload(car_id, start_at, 60, user_id="user-async"))
+        assert r.status_code == 200
+        booking_id = r.json()["id"]
+
+        r2 = async_client.post("/api/bookings", json=_booking_payload(car_id, start_at, 30, user_id="user-async"))
+        assert r2.status_code == 409
+
+        r3 = async_client.post(
+            f"/api/bookings/{booking_id}/extend",
+            json={"new_end_at": (start_at + timedelta(minutes=90)).isoformat()},
+        )
+        assert r3.json()["status"] == "extended"
+
+        r4 = async_client.get("/api/bookings", params={"user_id": "user-async"})
+        assert r4.json()["total"] == 1
+        assert r4.json()["items"][0]["id"] == booking_id
+
+        assert async_client.post(f"/api/bookings/{booking_id}/cancel").json()["status"] == "cancelled"
+        assert async_client.get("/api/bookings/missing").status_code == 404
+
+
+def test_writes_cost_one_statement_each():
+    from sqlalchemy import event
+    from app import crud, database, schemas
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    car_id = f"car-stmt-{uuid.uuid4()}"
+    payload = schemas.BookingCreate(**_booking_payload(car_id, datetime(2030, 4, 1, 10, 0), 30))
+    event.listen(database.engine, "before_cursor_execute", count)
+    try:
+        with database.SessionLocal() as db:
+            booking = crud.create_booking(db, payload)
+            created = len(statements)
+            crud.extend_booking(db, booking.id, datetime(2030, 4, 1, 11, 0))
+            extended = len(statements) - created
+            cancelled_booking = crud.cancel_booking(db, booking.id)
+            cancelled = len(statements) - created - extended
+    finally:
+        event.remove(database.engine, "before_cursor_execute", count)
+
+    assert (created, extended, cancelled) == (1, 1, 1)
+    assert cancelled_booking.status == "cancelled"
+    assert cancelled_booking.end_at == datetime(2030, 4, 1, 11, 0)
+
+
+def test_bearer_token_is_verified_locally(monkeypatch):
+    from common import tokens
+
+    monkeypatch.setattr(tokens, "AUTH_REQUIRED", True)
+
+    r = client.get("/api/bookings")
+    assert r.status_code == 401
+
+    token = tokens.issue_token("user-auth-1")
+    r = client.get("/api/bookings", headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 200
+
+    # подпись не сходится
+    r = client.get("/api/bookings", headers={"Authorization": f"Bearer {token[:-2]}xx"})
+    assert r.status_code == 401
+
+    expired = tokens.issue_token("user-auth-1", ttl=60, now=0)
+    r = client.get("/api/bookings/export", headers={"Authorization": f"Bearer {expired}"})
+    assert r.status_code == 401
+    assert r.json()["detail"] == "Token expired"
+
+    # чужой user_id – 403, свой – как обычно
+    auth = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/bookings", params={"user_id": "user-auth-2"}, headers=auth).status_code == 403
+    assert client.get("/api/bookings", params={"user_id": "user-auth-1"}, headers=auth).status_code == 200
+    assert client.get("/api/bookings/export", params={"user_id": "user-auth-2"}, headers=auth).status_code == 403
+    payload = _booking_payload(f"car-auth-{uuid.uuid4()}", datetime(2032, 1, 1, 10, 0), 30, user_id="user-auth-2")
+    assert client.post("/api/bookings", json=payload, headers=auth).status_code == 403
+
+    # без user_id токен видит только свои записи, чужие по id – 404
+    other = {"Authorization": f"Bearer {tokens.issue_token('user-auth-2')}"}
+    start_at = datetime(2032, 1, 1, 10, 0)
+    booking_id = client.post("/api/bookings", json=payload, headers=other).json()["id"]
+    listed = client.get("/api/bookings", params={"limit": 1000}, headers=auth).json()["items"]
+    assert all(b["user_id"] == "user-auth-1" for b in listed)
+    exported = client.get("/api/bookings/export", headers=auth).text.splitlines()
+    assert all(json.loads(line)["user_id"] == "user-auth-1" for line in exported)
+    assert client.get(f"/api/bookings/{booking_id}", headers=auth).status_code == 404
+    new_end = {"new_end_at": (start_at + timedelta(hours=5)).isoformat()}
+    assert client.post(f"/api/bookings/{booking_id}/extend", json=new_end, headers=auth).status_code == 404
+    assert client.post(f"/api/bookings/{booking_id}/cancel", headers=auth).status_code == 404
+    assert client.get(f"/api/bookings/{booking_id}", headers=other).json()["status"] == "created"
+    assert client.post(f"/api/bookings/{booking_id}/cancel", headers=other).status_code == 200
+
+    # /metrics остаётся открытым для Prometheus
+    assert client.get("/metrics").status_code == 200
+
+
+def test_auth_required_refuses_to_start_without_secret():
+    import subprocess
+
+    env = {k: v for k, v in os.environ.items() if k != "AUTH_TOKEN_SECRET"}
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run(
+        [sys.executable, "-c", "import common.tokens"],
+        cwd=root, env={**env, "AUTH_REQUIRED": "1"}, capture_output=True, text=True,
+    )
+    assert result.returncode != 0
+    assert "AUTH_TOKEN_SECRET must be set" in result.stderr
+
+
+def test_booking_spans_follow_upstream_sampling_decision():
+    from common import tracing
+
+    start_at = datetime.utcnow() + timedelta(days=30)
+    tracing.provider.force_flush()
+    tracing.memory_exporter.clear()
+
+    sampled = "00-11111111111111111111111111111111-2222222222222222-01"
+    r = client.post("/api/bookings", json=_booking_payload(str(uuid.uuid4()), start_at, 30), headers={"traceparent": sampled})
+    assert r.status_code == 200
+    tracing.provider.force_flush()
+    spans = tracing.memory_exporter.get_finished_spans()
+    create = next(span for span in spans if span.name == "crud.create_booking")
+    insert = next(span for span in spans if span.name == "INSERT")
+    assert insert.parent.span_id == create.context.span_id
+    assert insert.attributes["db.system"] == "sqlite"
+    assert insert.attributes["db.statement"].startswith("INSERT INTO bookings")
+
+    # вызывающий сервис не сэмплировал трассу – здесь она тоже не пишется
+    tracing.memory_exporter.clear()
+    not_sampled = "00-33333333333333333333333333333333-4444444444444444-00"
+    r = client.post("/api/bookings", json=_booking_payload(str(uuid.uuid4()), start_at, 30), headers={"traceparent": not_sampled})
+    assert r.status_code == 200
+    tracing.provider.force_flush()
+    assert tracing.memory_exporter.get_finished_spans() == ()
@@ -0,0 +1,166 @@
+"""
+Лента изменений парка: события "машина создана / сменился статус /
+сменилось положение" с порядковыми номерами.
+
+События лежат в кольцевом буфере на FEED_CAPACITY записей. Клиент
+продолжает с номера последнего полученного события (since); если
+нужные события уже вытеснены, он получает reset и должен заново
+прочитать GET /api/cars. Номера начинаются заново при рестарте
+процесса, поэтому к ним прилагается epoch ленты: при чужом epoch
+клиент тоже получает reset. Публикация идёт из потоков threadpool, а
+подписчики ждут на event loop – их будит call_soon_threadsafe.
+
+Порядок событий задаёт reserve(): номер очереди берётся под замком
+записи в хранилище, а publish(..., ticket=...) – уже после успешной
+записи. Событие (и его apply) выходит в ленту, только когда все более
+ранние номера опубликованы или отменены через cancel(), так что лента
+не показывает откатившихся изменений и не меняет их порядок.
+
+Лента своя у каждого процесса: изменения, сделанные другим воркером,
+в неё не попадают.
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+FEED_CAPACITY = int(os.getenv("CAR_FEED_CAPACITY", "100000"))
+HEARTBEAT_SECONDS = float(os.getenv("CAR_FEED_HEARTBEAT_SECONDS", "15"))
+
+
+def _wake(wakeups) -> None:
+    for wakeup in wakeups:
+        wakeup.set()
+
+
+class ChangeFeed:
+    def __init__(self, capacity: int = FEED_CAPACITY):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._events: deque = deque(maxlen=capacity)
+        self._seq = 0
+        # номера очереди: выданные reserve() и готовые к выходу в ленту
+        # (None – отменённые); выходят строго по возрастанию
+        self._tickets = 0
+        self._released = 0
+        self._ready: Dict[int, Optional[Tuple]] = {}
+        self._lock = threading.Lock()
+        # event loop -> события ожидания подписчиков в нём: одного
+        # call_soon_threadsafe на loop достаточно, чтобы разбудить всех
+        self._waiters: Dict[asyncio.AbstractEventLoop, Set[asyncio.Event]] = {}
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def reserve(self) -> int:
+        """Номер очереди для события, которое будет опубликовано позже."""
+        with self._lock:
+            self._tickets += 1
+            return self._tickets
+
+    def cancel(self, ticket: int) -> None:
+        """Отказ от номера: изменение не записалось, события не будет."""
+        self._resolve(ticket, None)
+
+    def publish(
+        self,
+        car_id: str,
+        kind: str,
+        changes: Dict,
+        ticket: Optional[int] = None,
+        apply: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Событие в ленту в порядке ticket (без него – в конец очереди);
+        apply вызывается в том же порядке перед выходом события.
+        """
+        if ticket is None:
+            ticket = self.reserve()
+        self._resolve(ticket, (car_id, kind, changes, apply))
+
+    def _resolve(self, ticket: int, item: Optional[Tuple]) -> None:
+        with self._lock:
+            self._ready[ticket] = item
+            released = False
+            while self._released + 1 in self._ready:
+                self._released += 1
+                item = self._ready.pop(self._released)
+                if item is None:
+                    continue
+                car_id, kind, changes, apply = item
+                if apply is not None:
+                    apply()
+                self._seq += 1
+                self._events.append(
+                    {"seq": self._seq, "ts": time.time(), "type": kind, "car_id": car_id, "changes": changes}
+                )
+                released = True
+            if not released:
+                return
+            waiters = [(loop, tuple(wakeups)) for loop, wakeups in self._waiters.items()]
+        for loop, wakeups in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, wakeups)
+            except RuntimeError:
+                # event loop подписчика уже закрыт
+                pass
+
+    def since(self, seq: int) -> Optional[List[Dict]]:
+        """События с номером больше seq; None – часть из них уже вытеснена."""
+        with self._lock:
+            if seq > self._seq:
+                return None
+            if seq == self._seq:
+                return []
+            first = self._events[0]["seq"] if self._events else self._seq + 1
+            if seq < first - 1:
+                return None
+            # номера идут подряд, так что позиция в буфере вычисляется
+            return list(islice(self._events, seq - first + 1, None))
+
+    def position(self, since: Optional[int], epoch: Optional[str] = None) -> int:
+        """Откуда продолжать: None – с текущего места, чужой epoch – с reset."""
+        if epoch is not None and epoch != self.epoch:
+            return -1
+        return self.last_seq if since is None else since
+
+    async def subscribe(
+        self, since: Optional[int] = None, epoch: Optional[str] = None, heartbeat: float = HEARTBEAT_SECONDS
+    ) -> AsyncIterator[Optional[Dict]]:
+        """
+        События после since (None – только новые), затем новые по мере
+        появления. Если буфер уже не содержит продолжения, отдаётся
+        {"type": "reset", "seq": ...}. None – пульс раз в heartbeat секунд
+        простоя, чтобы транспорт заметил отключившегося клиента.
+        """
+        position = self.position(since, epoch)
+        loop, wakeup = asyncio.get_running_loop(), asyncio.Event()
+        with self._lock:
+            self._waiters.setdefault(loop, set()).add(wakeup)
+        try:
+            while True:
+                wakeup.clear()
+                events = self.since(position)
+                if events is None:
+                    position = self.last_seq
+                    yield {"type": "reset", "seq": position, "epoch": self.epoch}
+                    continue
+                for event in events:
+                    position = event["seq"]
+                    yield event
+                if not events:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        yield None
+        finally:
+            with self._lock:
+                wakeups = self._waiters.get(loop)
+                if wakeups is not None:
+                    wakeups.discard(wakeup)
+                    if not wakeups:
+                        del self._waiters[loop]
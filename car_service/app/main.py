@@ -1,54 +1,31 @@
-import time
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
-from pydantic import BaseModel
-from typing import Dict, Optional, List
+import json
+from functools import partial
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Callable, Dict, Optional, List, Set
 from uuid import uuid4
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import ChangeFollower, DuplicateKeyError, make_repository
+from common.response_cache import ResponseCache
+from .feed import ChangeFeed
+from .spatial import GridIndex
 
 app = FastAPI(title="Car Service")
 
 # ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
-
 SERVICE_NAME = "car_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 # ====== Модели ======
 
@@ -59,16 +36,41 @@ class CarStatus(str):
     UNAVAILABLE = "unavailable"
 
 
+# допустимые переходы статусов; повторная установка того же статуса – без изменений
+TRANSITIONS = {
+    CarStatus.AVAILABLE: {CarStatus.RESERVED, CarStatus.IN_TRIP, CarStatus.UNAVAILABLE},
+    CarStatus.RESERVED: {CarStatus.AVAILABLE, CarStatus.IN_TRIP, CarStatus.UNAVAILABLE},
+    CarStatus.IN_TRIP: {CarStatus.AVAILABLE, CarStatus.UNAVAILABLE},
+    CarStatus.UNAVAILABLE: {CarStatus.AVAILABLE},
+}
+
+
 class CarCreate(BaseModel):
     model: str
     plate_number: str
     color: str
     location: str
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
     status: str = CarStatus.AVAILABLE
 
 
 class CarUpdateStatus(BaseModel):
     status: str
+    # compare-and-set: изменить, только если версия статуса всё ещё такая
+    expected_version: Optional[int] = None
+
+
+class CarTransition(BaseModel):
+    expected_version: Optional[int] = None
+    # бронь, за которой закреплена машина; start/release с чужой бронью – 409
+    booking_id: Optional[str] = None
+
+
+class CarUpdateLocation(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    location: Optional[str] = None
 
 
 class CarOut(BaseModel):
@@ -77,57 +79,407 @@ class CarOut(BaseModel):
     plate_number: str
     color: str
     location: str
+    lat: Optional[float] = None
+    lon: Optional[float] = None
     status: str
+    # растёт при каждой смене статуса
+    version: int = 0
+    reserved_by: Optional[str] = None
 
 
-# ====== "База" в памяти ======
+class CarNearbyOut(CarOut):
+    distance_km: float
 
-cars: Dict[str, Dict] = {}
 
+class CarChange(BaseModel):
+    seq: int
+    ts: float
+    type: str  # created / status / location
+    car_id: str
+    changes: Dict[str, Any]
 
-# ====== Эндпоинты ======
 
-@app.post("/api/cars", response_model=CarOut)
-def create_car(payload: CarCreate):
-    car_id = str(uuid4())
-    # проверить, чтобы не дублировались номера
-    for c in cars.values():
-        if c["plate_number"] == payload.plate_number:
-            raise HTTPException(status_code=400, detail="Car with this plate already exists")
-
-    car = {
-        "id": car_id,
+class CarChanges(BaseModel):
+    epoch: str
+    # номер последнего отданного события – since для следующего запроса
+    last_seq: int
+    # True – события после since уже вытеснены, нужно перечитать GET /api/cars
+    reset: bool
+    events: List[CarChange]
+    # True – события обрезаны по limit, за остальными – запрос с since=last_seq
+    has_more: bool = False
+
+
+# ====== Хранилище ======
+
+# машины по id; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти).
+# Номер уникален, по статусу есть индекс
+cars = make_repository("cars", indexed=("status",), unique=("plate_number",))
+
+# индекс координат только свободных машин – по нему работает поиск "рядом";
+# он свой в каждом процессе
+available_index = GridIndex()
+# журнал изменений общего хранилища (None – хранилище в памяти процесса)
+_cars_follower: Optional[ChangeFollower] = None
+
+
+def _sync_cars() -> None:
+    """
+    В общем хранилище машины меняют и другие воркеры: их изменения из
+    журнала применяются к индексу и кешу этого процесса по одной машине.
+    """
+    global _cars_follower
+    if not cars.shared:
+        return
+    if _cars_follower is None or _cars_follower.repo is not cars:
+        _cars_follower = cars.follow(_apply_car_changes, _rebuild_cars)
+    _cars_follower.sync()
+
+
+# готовые ответы GET /api/cars/{car_id}; сбрасываются в _update_car
+car_cache = ResponseCache("cars", sync=_sync_cars)
+
+# изменения парка для подписчиков вместо опроса GET /api/cars
+feed = ChangeFeed()
+
+
+def _reindex(car: Dict) -> None:
+    if car["status"] == CarStatus.AVAILABLE and car["lat"] is not None and car["lon"] is not None:
+        available_index.upsert(car["id"], car["lat"], car["lon"])
+    else:
+        available_index.remove(car["id"])
+
+
+def _apply_car_changes(car_ids: List[str]) -> None:
+    found = {car["id"]: car for car in cars.get_many(car_ids)}
+    for car_id in car_ids:
+        car = found.get(car_id)
+        if car is not None:
+            _reindex(car)
+        else:
+            available_index.remove(car_id)
+        car_cache.invalidate(car_id)
+
+
+def _rebuild_cars() -> None:
+    global available_index
+    index = GridIndex()
+    for car in cars.find(status=CarStatus.AVAILABLE):
+        if car["lat"] is not None and car["lon"] is not None:
+            index.upsert(car["id"], car["lat"], car["lon"])
+    available_index = index
+    car_cache.clear()
+
+
+def _current_available_index() -> GridIndex:
+    _sync_cars()
+    return available_index
+
+
+def _new_car(payload: CarCreate) -> Dict:
+    return {
+        "id": str(uuid4()),
         "model": payload.model,
         "plate_number": payload.plate_number,
         "color": payload.color,
         "location": payload.location,
+        "lat": payload.lat,
+        "lon": payload.lon,
         "status": payload.status,
+        "version": 1,
+        "reserved_by": None,
     }
-    cars[car_id] = car
-    return CarOut(**car)
+
+
+def _conflict(message: str, car: Dict) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={"message": message, "status": car["status"], "version": car.get("version", 0)},
+    )
+
+
+def _update_car(car_id: str, check: Optional[Callable[[Dict], None]] = None, **changes) -> Optional[Dict]:
+    """
+    Атомарное изменение машины: check(текущая запись) может отклонить его
+    исключением, смена статуса увеличивает version. Всё выполняется под
+    замком записи в хранилище, так что из параллельных запросов к одной
+    машине проверку проходит только первый.
+    """
+    ticket: Optional[int] = None
+    delta: Dict = {}
+
+    def change(car: Dict) -> Dict:
+        nonlocal ticket, delta
+        if check is not None:
+            check(car)
+        delta = {field: value for field, value in changes.items() if car.get(field) != value}
+        if not delta:
+            return {}
+        if "status" in delta:
+            delta["version"] = car.get("version", 0) + 1
+        # номер в ленте – под замком записи, в том же порядке, что и хранилище;
+        # индекс и лента меняются только после успешной записи
+        ticket = feed.reserve()
+        return delta
+
+    try:
+        car = cars.modify(car_id, change)
+    except BaseException:
+        if ticket is not None:
+            feed.cancel(ticket)
+        raise
+    if ticket is not None:
+        feed.publish(
+            car_id, "status" if "status" in delta else "location", delta,
+            ticket=ticket, apply=lambda: _reindex(car),
+        )
+        # после записи в хранилище: раньше кеш мог бы снова взять старую версию
+        car_cache.invalidate(car_id)
+    return car
+
+
+def _transition(
+    car_id: str,
+    allowed_from: Set[str],
+    target: str,
+    payload: Optional[CarTransition],
+    **changes,
+) -> Dict:
+    expected_version = payload.expected_version if payload else None
+    booking_id = payload.booking_id if payload else None
+
+    def check(car: Dict) -> None:
+        if expected_version is not None and car.get("version", 0) != expected_version:
+            raise _conflict("Car version mismatch", car)
+        if car["status"] not in allowed_from:
+            raise _conflict(f"Car is {car['status']}, expected one of {sorted(allowed_from)}", car)
+        if booking_id and car.get("reserved_by") and car["reserved_by"] != booking_id:
+            raise _conflict("Car is reserved by another booking", car)
+
+    car = _update_car(car_id, check, status=target, **changes)
+    if not car:
+        raise HTTPException(status_code=404, detail="Car not found")
+    return car
+
+
+# ====== Эндпоинты ======
+
+@app.post("/api/cars", response_model=CarOut)
+def create_car(payload: CarCreate):
+    if payload.status not in TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Unknown car status")
+    car = _new_car(payload)
+    # номер в ленте берётся до записи: изменения машины, видимые только
+    # после неё, получат номера позже и не обгонят "created" ни в ленте, ни в индексе
+    ticket = feed.reserve()
+    # уникальность номера проверяет хранилище
+    try:
+        cars.add(car)
+    except DuplicateKeyError:
+        feed.cancel(ticket)
+        raise HTTPException(status_code=400, detail="Car with this plate already exists")
+    except BaseException:
+        feed.cancel(ticket)
+        raise
+    out = CarOut(**car)
+    feed.publish(car["id"], "created", out.model_dump(), ticket=ticket, apply=lambda: _reindex(car))
+    return out
+
+
+@app.post("/api/cars/batch", response_model=List[CarOut])
+def create_cars_batch(payload: List[CarCreate]):
+    """
+    Массовый импорт парка: либо добавляются все машины, либо ни одной.
+    """
+    if any(item.status not in TRANSITIONS for item in payload):
+        raise HTTPException(status_code=400, detail="Unknown car status")
+    new_cars = [_new_car(item) for item in payload]
+    # как в create_car: номера в ленте – до записи
+    tickets = [feed.reserve() for _ in new_cars]
+    try:
+        cars.add_many(new_cars)
+    except DuplicateKeyError as exc:
+        for ticket in tickets:
+            feed.cancel(ticket)
+        raise HTTPException(
+            status_code=400,
+            detail={"message": "Cars with these plates already exist", "plates": exc.values},
+        )
+    except BaseException:
+        for ticket in tickets:
+            feed.cancel(ticket)
+        raise
+    created = [CarOut(**car) for car in new_cars]
+    for car, out, ticket in zip(new_cars, created, tickets):
+        feed.publish(car["id"], "created", out.model_dump(), ticket=ticket, apply=partial(_reindex, car))
+    return created
 
 
 @app.get("/api/cars", response_model=List[CarOut])
-def list_cars(status: Optional[str] = None):
-    result = list(cars.values())
-    if status:
-        result = [c for c in result if c["status"] == status]
+def list_cars(response: Response, status: Optional[str] = None):
+    """
+    Заголовки X-Feed-Epoch и X-Feed-Seq – место в ленте изменений, с которого
+    продолжать после этого списка (номер берётся до чтения, так что
+    изменения не теряются, а в худшем случае приходят повторно).
+    """
+    response.headers["X-Feed-Epoch"] = feed.epoch
+    response.headers["X-Feed-Seq"] = str(feed.last_seq)
+    result = cars.find(status=status) if status else cars.all()
     return [CarOut(**c) for c in result]
 
 
-@app.get("/api/cars/{car_id}", response_model=CarOut)
-def get_car(car_id: str):
+# ====== Лента изменений ======
+
+@app.get("/api/cars/changes", response_model=CarChanges)
+def list_car_changes(
+    since: int = Query(..., ge=0),
+    epoch: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """
+    Изменения после since одним ответом – для клиентов без SSE/WebSocket.
+    last_seq – номер последнего события в ответе (или since, если событий
+    нет), а не всей ленты: события, не вошедшие в limit или появившиеся
+    после чтения, придут в следующем ответе.
+    """
+    position = feed.position(since, epoch)
+    events = feed.since(position)
+    if events is None:
+        return CarChanges(epoch=feed.epoch, last_seq=feed.last_seq, reset=True, events=[])
+    page = events[:limit]
+    return CarChanges(
+        epoch=feed.epoch,
+        last_seq=page[-1]["seq"] if page else position,
+        reset=False,
+        events=page,
+        has_more=len(events) > limit,
+    )
+
+
+def _sse(event: Optional[Dict], epoch: str) -> str:
+    if event is None:
+        return ": ping\n\n"
+    if event["type"] == "reset":
+        return f"id: {epoch}:{event['seq']}\nevent: reset\ndata: {json.dumps(event)}\n\n"
+    return f"id: {epoch}:{event['seq']}\nevent: change\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/api/cars/stream")
+async def stream_car_changes(
+    since: Optional[int] = Query(None, ge=0),
+    epoch: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Server-Sent Events: событие change на каждое изменение, reset – если
+    продолжение потеряно. Переподключение браузера с Last-Event-ID
+    ("epoch:seq") продолжает с того же места.
+    """
+    if last_event_id and since is None:
+        epoch, _, seq = last_event_id.partition(":")
+        since = int(seq) if seq.isdigit() else -1
+
+    async def generate():
+        async for event in feed.subscribe(since, epoch):
+            yield _sse(event, feed.epoch)
+
+    return StreamingResponse(
+        generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/api/cars/ws")
+async def car_changes_ws(websocket: WebSocket, since: Optional[int] = None, epoch: Optional[str] = None):
+    """
+    Те же события, что в /api/cars/stream, JSON-сообщениями. Первое сообщение –
+    hello с epoch ленты, пульс простоя – {"type": "heartbeat"}.
+    """
+    await websocket.accept()
+    try:
+        await websocket.send_json({"type": "hello", "epoch": feed.epoch, "last_seq": feed.last_seq})
+        async for event in feed.subscribe(since, epoch):
+            await websocket.send_json(event if event is not None else {"type": "heartbeat"})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/cars/nearby", response_model=List[CarNearbyOut])
+def list_nearby_cars(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(1.0, gt=0, le=50, description="Радиус поиска, км"),
+    limit: int = Query(20, ge=1, le=100),
+):
+    found = _current_available_index().nearby(lat, lon, radius, limit)
+    # в ответ конвертируем только найденные машины, а не весь парк
+    by_id = {car["id"]: car for car in cars.get_many(car_id for _, car_id in found)}
+    return [
+        CarNearbyOut(**by_id[car_id], distance_km=round(distance, 3))
+        for distance, car_id in found
+        if car_id in by_id
+    ]
+
+
+def _car_json(car_id: str) -> bytes:
     car = cars.get(car_id)
     if not car:
         raise HTTPException(status_code=404, detail="Car not found")
-    return CarOut(**car)
+    return CarOut(**car).model_dump_json().encode()
+
+
+@app.get("/api/cars/{car_id}", response_model=CarOut)
+def get_car(car_id: str, request: Request):
+    return car_cache.response(request, car_id, lambda: _car_json(car_id))
 
 
 @app.patch("/api/cars/{car_id}/status", response_model=CarOut)
 def update_car_status(car_id: str, payload: CarUpdateStatus):
-    car = cars.get(car_id)
+    """Смена статуса по TRANSITIONS; при expected_version – только если версия совпала."""
+    if payload.status not in TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Unknown car status")
+
+    def check(car: Dict) -> None:
+        if payload.expected_version is not None and car.get("version", 0) != payload.expected_version:
+            raise _conflict("Car version mismatch", car)
+        if payload.status != car["status"] and payload.status not in TRANSITIONS.get(car["status"], ()):
+            raise _conflict(f"Transition {car['status']} -> {payload.status} is not allowed", car)
+
+    changes = {"status": payload.status}
+    if payload.status in (CarStatus.AVAILABLE, CarStatus.UNAVAILABLE):
+        changes["reserved_by"] = None
+    car = _update_car(car_id, check, **changes)
     if not car:
         raise HTTPException(status_code=404, detail="Car not found")
+    return CarOut(**car)
+
+
+@app.post("/api/cars/{car_id}/reserve", response_model=CarOut)
+def reserve_car(car_id: str, payload: Optional[CarTransition] = None):
+    """Бронь: только из available; из параллельных попыток выигрывает одна, остальные – 409."""
+    booking_id = payload.booking_id if payload else None
+    return CarOut(**_transition(car_id, {CarStatus.AVAILABLE}, CarStatus.RESERVED, payload, reserved_by=booking_id))
+
+
+@app.post("/api/cars/{car_id}/start-trip", response_model=CarOut)
+def start_car_trip(car_id: str, payload: Optional[CarTransition] = None):
+    """Начало поездки: только из reserved (той же брони, если booking_id задан)."""
+    return CarOut(**_transition(car_id, {CarStatus.RESERVED}, CarStatus.IN_TRIP, payload))
 
-    car["status"] = payload.status
+
+@app.post("/api/cars/{car_id}/release", response_model=CarOut)
+def release_car(car_id: str, payload: Optional[CarTransition] = None):
+    """Освобождение после брони или поездки."""
+    return CarOut(**_transition(
+        car_id, {CarStatus.RESERVED, CarStatus.IN_TRIP}, CarStatus.AVAILABLE, payload, reserved_by=None
+    ))
+
+
+@app.patch("/api/cars/{car_id}/location", response_model=CarOut)
+def update_car_location(car_id: str, payload: CarUpdateLocation):
+    changes = {"lat": payload.lat, "lon": payload.lon}
+    if payload.location is not None:
+        changes["location"] = payload.location
+    car = _update_car(car_id, **changes)
+    if not car:
+        raise HTTPException(status_code=404, detail="Car not found")
     return CarOut(**car)
@@ -0,0 +1,110 @@
+import heapq
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Сеточный пространственный индекс: точки раскладываются по ячейкам
+    cell_deg x cell_deg градусов, поиск просматривает только ячейки,
+    которые пересекает bbox окружности запроса.
+    Обновляется инкрементально через upsert/remove.
+
+    Долгота сворачивается в [-180, 180): столбцы по обе стороны
+    антимеридиана соседние. У полюса bbox охватывает все долготы –
+    тогда просматриваются все столбцы, а если ячеек в bbox больше, чем
+    занятых, перебираются только занятые.
+    """
+
+    def __init__(self, cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        # столбцы, покрывающие 360° долготы, начиная с -180
+        self._first_col = math.floor(-180 / cell_deg)
+        self._cols = math.ceil(360 / cell_deg)
+        self._cells: Dict[Tuple[int, int], Dict[str, Tuple[float, float]]] = {}
+        self._points: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _wrap_col(self, col: int) -> int:
+        return (col - self._first_col) % self._cols + self._first_col
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), self._wrap_col(math.floor(lon / self.cell_deg))
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._points
+
+    def upsert(self, item_id: str, lat: float, lon: float) -> None:
+        cell = self._cell(lat, lon)
+        with self._lock:
+            old_cell = self._points.get(item_id)
+            if old_cell is not None and old_cell != cell:
+                self._discard(item_id, old_cell)
+            self._cells.setdefault(cell, {})[item_id] = (lat, lon)
+            self._points[item_id] = cell
+
+    def remove(self, item_id: str) -> None:
+        with self._lock:
+            cell = self._points.pop(item_id, None)
+            if cell is not None:
+                self._discard(item_id, cell)
+
+    def _discard(self, item_id: str, cell: Tuple[int, int]) -> None:
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            return
+        bucket.pop(item_id, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def nearby(self, lat: float, lon: float, radius_km: float, limit: int) -> List[Tuple[float, str]]:
+        """Возвращает до limit пар (расстояние_км, id), отсортированных по расстоянию."""
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        min_row = math.floor(max(lat - dlat, -90.0) / self.cell_deg)
+        max_row = math.floor(min(lat + dlat, 90.0) / self.cell_deg)
+
+        cos_lat = math.cos(math.radians(lat))
+        dlon = radius_km / (KM_PER_DEGREE_LAT * cos_lat) if cos_lat > 0 else math.inf
+        cols: Optional[Set[int]] = None  # None – все столбцы
+        if lat - dlat > -90.0 and lat + dlat < 90.0 and dlon < 180.0:
+            first = math.floor((lon - dlon) / self.cell_deg)
+            last = math.floor((lon + dlon) / self.cell_deg)
+            if last - first + 1 < self._cols:
+                cols = {self._wrap_col(col) for col in range(first, last + 1)}
+
+        rows = max_row - min_row + 1
+        with self._lock:
+            candidates = []
+            if rows * (self._cols if cols is None else len(cols)) > len(self._cells):
+                for (row, col), bucket in self._cells.items():
+                    if min_row <= row <= max_row and (cols is None or col in cols):
+                        candidates.extend(bucket.items())
+            else:
+                for row in range(min_row, max_row + 1):
+                    for col in (range(self._first_col, self._first_col + self._cols) if cols is None else cols):
+                        bucket = self._cells.get((row, col))
+                        if bucket:
+                            candidates.extend(bucket.items())
+
+        found = []
+        for item_id, (item_lat, item_lon) in candidates:
+            distance = haversine_km(lat, lon, item_lat, item_lon)
+            if distance <= radius_km:
+                found.append((distance, item_id))
+        return heapq.nsmallest(limit, found)
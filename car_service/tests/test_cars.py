@@ -4,7 +4,17 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # car_service/tests/test_cars.py
 from fastapi.testclient import TestClient
+import re
+import time
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app import main
 from app.main import app
+from common.repository import DuplicateKeyError, make_repository
 
 client = TestClient(app)
 
@@ -43,3 +53,364 @@ def test_create_get_and_update_car():
     assert r4.status_code == 200
     data4 = r4.json()
     assert any(c["id"] == car_id for c in data4)
+
+
+def test_nearby_returns_only_available_cars_sorted_by_distance():
+    base = {"model": "Skoda Octavia", "color": "black", "location": "Москва"}
+    near = client.post("/api/cars", json={**base, "plate_number": "N001AA777", "lat": 55.7520, "lon": 37.6175}).json()
+    far = client.post("/api/cars", json={**base, "plate_number": "N002AA777", "lat": 55.7600, "lon": 37.6400}).json()
+    busy = client.post("/api/cars", json={**base, "plate_number": "N003AA777", "lat": 55.7521, "lon": 37.6176}).json()
+    client.patch(f"/api/cars/{busy['id']}/status", json={"status": "reserved"})
+
+    r = client.get("/api/cars/nearby", params={"lat": 55.7519, "lon": 37.6174, "radius": 3})
+    assert r.status_code == 200
+    ids = [c["id"] for c in r.json()]
+    assert ids.index(near["id"]) < ids.index(far["id"])
+    assert busy["id"] not in ids
+
+    # машину перегнали далеко – в радиус она больше не попадает
+    r2 = client.patch(f"/api/cars/{near['id']}/location", json={"lat": 59.9386, "lon": 30.3141})
+    assert r2.status_code == 200
+    r3 = client.get("/api/cars/nearby", params={"lat": 55.7519, "lon": 37.6174, "radius": 3})
+    assert near["id"] not in [c["id"] for c in r3.json()]
+
+
+def test_nearby_at_the_pole_and_across_the_antimeridian():
+    base = {"model": "Lada Niva", "color": "white", "location": "Арктика"}
+    polar = client.post("/api/cars", json={**base, "plate_number": "P001PP777", "lat": 89.95, "lon": 120.0}).json()
+    east = client.post("/api/cars", json={**base, "plate_number": "P002PP777", "lat": 65.0, "lon": 179.999}).json()
+    west = client.post("/api/cars", json={**base, "plate_number": "P003PP777", "lat": 65.0, "lon": -179.999}).json()
+
+    # у полюса bbox охватывает все долготы – ответ всё равно сразу
+    start = time.perf_counter()
+    r = client.get("/api/cars/nearby", params={"lat": 90, "lon": 0, "radius": 50})
+    assert r.status_code == 200
+    assert time.perf_counter() - start < 1
+    assert [c["id"] for c in r.json()] == [polar["id"]]
+
+    r2 = client.get("/api/cars/nearby", params={"lat": 65.0, "lon": -180, "radius": 1})
+    assert {c["id"] for c in r2.json()} == {east["id"], west["id"]}
+    r3 = client.get("/api/cars/nearby", params={"lat": 65.0, "lon": 179.99, "radius": 1})
+    assert {c["id"] for c in r3.json()} == {east["id"], west["id"]}
+
+
+def test_batch_import_and_status_index():
+    batch = [
+        {"model": "Hyundai Solaris", "plate_number": f"B{i:03d}BB777", "color": "grey", "location": "Москва"}
+        for i in range(5)
+    ]
+    r = client.post("/api/cars/batch", json=batch)
+    assert r.status_code == 200
+    created = r.json()
+    assert len(created) == 5
+
+    # повтор номера из уже импортированной пачки – вся пачка отклоняется
+    r2 = client.post(
+        "/api/cars/batch",
+        json=[
+            {"model": "Lada Vesta", "plate_number": "B900BB777", "color": "red", "location": "Москва"},
+            {"model": "Lada Vesta", "plate_number": "B000BB777", "color": "red", "location": "Москва"},
+        ],
+    )
+    assert r2.status_code == 400
+    assert r2.json()["detail"]["plates"] == ["B000BB777"]
+    assert client.post("/api/cars", json={**batch[0], "plate_number": "B900BB777"}).status_code == 200
+
+    car_id = created[0]["id"]
+    client.patch(f"/api/cars/{car_id}/status", json={"status": "unavailable"})
+    unavailable = {c["id"] for c in client.get("/api/cars", params={"status": "unavailable"}).json()}
+    available = {c["id"] for c in client.get("/api/cars", params={"status": "available"}).json()}
+    assert car_id in unavailable
+    assert car_id not in available
+    assert created[1]["id"] in available
+
+
+def test_metrics_are_labelled_by_route_template():
+    for _ in range(3):
+        client.get(f"/api/cars/{uuid4()}")
+    client.get("/no/such/path")
+
+    text = client.get("/metrics").text
+    assert 'endpoint="/api/cars/{car_id}",method="GET",service="car_service",status_code="404"' in text
+    assert 'endpoint="<unmatched>"' in text
+    assert "/no/such/path" not in text
+    # ни один конкретный id не попал в метки
+    assert not re.search(r'endpoint="/api/cars/[0-9a-f]{8}-', text)
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_repository_backends_behave_the_same(backend, tmp_path):
+    url = "memory://" if backend == "memory" else f"sqlite:///{tmp_path / 'cars.db'}"
+    repo = make_repository("cars", indexed=("status",), unique=("plate_number",), url=url)
+
+    repo.add({"id": "1", "plate_number": "A001AA", "status": "available", "seen_at": datetime(2024, 1, 1)})
+    repo.add_many([
+        {"id": "2", "plate_number": "A002AA", "status": "available"},
+        {"id": "3", "plate_number": "A003AA", "status": "in_trip"},
+    ])
+    assert len(repo) == 3
+    assert repo.get("1")["seen_at"] == datetime(2024, 1, 1)
+    assert [c["id"] for c in repo.find(status="available")] == ["1", "2"]
+    assert repo.find_one(plate_number="A003AA")["id"] == "3"
+
+    # пачка с занятым номером не добавляется целиком
+    with pytest.raises(DuplicateKeyError) as exc:
+        repo.add_many([{"id": "4", "plate_number": "A004AA"}, {"id": "5", "plate_number": "A001AA"}])
+    assert exc.value.values == ["A001AA"]
+    assert repo.get("4") is None
+
+    revision = repo.revision()
+    assert repo.update("2", status="in_trip")["status"] == "in_trip"
+    assert repo.revision() > revision
+    assert sorted(c["id"] for c in repo.find(status="in_trip")) == ["2", "3"]
+    with pytest.raises(DuplicateKeyError):
+        repo.update("3", plate_number="A001AA")
+
+    # исключение внутри modify не оставляет изменений
+    with pytest.raises(RuntimeError):
+        repo.modify("1", lambda car: (_ for _ in ()).throw(RuntimeError()))
+    assert repo.get("1")["status"] == "available"
+
+    assert repo.existing("plate_number", ["A001AA", "X999XX"]) == {"A001AA"}
+    assert repo.delete("1") and repo.get("1") is None
+    assert repo.update("missing", status="x") is None
+
+
+def test_nearby_sees_cars_written_by_other_workers(monkeypatch, tmp_path):
+    shared = make_repository("cars", indexed=("status",), unique=("plate_number",), url=f"sqlite:///{tmp_path / 'cars.db'}")
+    monkeypatch.setattr(main, "cars", shared)
+
+    r = client.get("/api/cars/nearby", params={"lat": 10.0, "lon": 10.0})
+    assert r.json() == []
+
+    # запись напрямую в хранилище – как будто машину добавил другой воркер
+    shared.add({
+        "id": "other-worker-car", "model": "Kia Rio", "plate_number": "O001OO", "color": "red",
+        "location": "", "lat": 10.001, "lon": 10.001, "status": "available",
+    })
+    r = client.get("/api/cars/nearby", params={"lat": 10.0, "lon": 10.0})
+    assert [c["id"] for c in r.json()] == ["other-worker-car"]
+
+    # дальше изменения применяются по одной машине, без перестроения индекса
+    rebuilds = []
+    monkeypatch.setattr(main._cars_follower, "on_reset", lambda: rebuilds.append(1))
+    neighbour = {**shared.get("other-worker-car"), "id": "neighbour-car", "plate_number": "O002OO"}
+    shared.add(neighbour)
+    assert client.get("/api/cars/neighbour-car").status_code == 200
+    etag = client.get("/api/cars/other-worker-car").headers["etag"]
+
+    shared.update("neighbour-car", status="reserved")
+    r = client.get("/api/cars/nearby", params={"lat": 10.0, "lon": 10.0})
+    assert [c["id"] for c in r.json()] == ["other-worker-car"]
+    assert client.get("/api/cars/neighbour-car").json()["status"] == "reserved"
+    # ответ по другой машине остался в кеше
+    hits = REGISTRY.get_sample_value("response_cache_hits_total", {"cache": "cars"})
+    assert client.get("/api/cars/other-worker-car").headers["etag"] == etag
+    assert REGISTRY.get_sample_value("response_cache_hits_total", {"cache": "cars"}) == hits + 1
+    assert rebuilds == []
+
+
+def test_change_follower_applies_only_changed_keys(tmp_path):
+    repo = make_repository("cars", indexed=("status",), url=f"sqlite:///{tmp_path / 'log.db'}")
+    seen, resets = [], []
+    follower = repo.follow(seen.append, lambda: resets.append(1))
+    follower.sync()
+    assert resets == [1] and seen == []
+
+    repo.add_many([{"id": "a", "status": "available"}, {"id": "b", "status": "available"}])
+    repo.update("a", status="reserved")
+    repo.delete("b")
+    follower.sync()
+    assert seen == [["a", "b"]]
+    follower.sync()
+    assert seen == [["a", "b"]]
+    assert resets == [1]
+
+
+def _new_car(plate: str) -> str:
+    r = client.post("/api/cars", json={
+        "model": "Skoda Octavia", "plate_number": plate, "color": "grey", "location": "Москва",
+        "lat": 55.75, "lon": 37.61,
+    })
+    return r.json()["id"]
+
+
+def test_change_feed_polling_and_websocket_resume():
+    r = client.get("/api/cars")
+    epoch, seq = r.headers["X-Feed-Epoch"], int(r.headers["X-Feed-Seq"])
+
+    car_id = _new_car("F001EE77")
+    client.patch(f"/api/cars/{car_id}/status", json={"status": "reserved"})
+    client.patch(f"/api/cars/{car_id}/status", json={"status": "reserved"})  # без изменений – без события
+    client.patch(f"/api/cars/{car_id}/location", json={"lat": 55.76, "lon": 37.62})
+
+    changes = client.get("/api/cars/changes", params={"since": seq, "epoch": epoch}).json()
+    assert changes["reset"] is False
+    events = changes["events"]
+    assert [(e["type"], e["car_id"]) for e in events] == [("created", car_id), ("status", car_id), ("location", car_id)]
+    assert [e["seq"] for e in events] == list(range(seq + 1, seq + 4))
+    assert events[1]["changes"] == {"status": "reserved", "version": 2}
+    assert events[2]["changes"] == {"lat": 55.76, "lon": 37.62}
+    assert (changes["last_seq"], changes["has_more"]) == (seq + 3, False)
+
+    # постранично по limit=2: last_seq – последнее событие страницы, ничего не пропущено
+    paged, cursor = [], seq
+    while True:
+        page = client.get("/api/cars/changes", params={"since": cursor, "epoch": epoch, "limit": 2}).json()
+        assert page["last_seq"] == (page["events"][-1]["seq"] if page["events"] else cursor)
+        paged += page["events"]
+        cursor = page["last_seq"]
+        if not page["has_more"]:
+            break
+    assert paged == events
+    assert cursor == seq + 3
+
+    # номера из другого процесса (epoch) – продолжения нет
+    assert client.get("/api/cars/changes", params={"since": seq, "epoch": "other"}).json()["reset"] is True
+
+    with client.websocket_connect(f"/api/cars/ws?since={seq + 1}&epoch={epoch}") as ws:
+        assert ws.receive_json()["epoch"] == epoch
+        assert [ws.receive_json()["type"] for _ in range(2)] == ["status", "location"]
+        client.patch(f"/api/cars/{car_id}/status", json={"status": "available"})
+        live = ws.receive_json()
+        assert (live["seq"], live["changes"]) == (seq + 4, {"status": "available", "version": 3})
+
+
+def test_change_feed_ring_buffer_and_sse_resume():
+    import asyncio
+    from app.feed import ChangeFeed
+
+    feed = ChangeFeed(capacity=3)
+    for i in range(5):
+        feed.publish(f"car-{i}", "status", {"status": "in_trip"})
+    assert [e["seq"] for e in feed.since(2)] == [3, 4, 5]
+    assert feed.since(1) is None  # событие 2 уже вытеснено
+
+    # события выходят в порядке номеров, взятых под замком записи;
+    # отменённый номер (запись не удалась) событием не становится
+    feed = ChangeFeed()
+    applied = []
+    first, second, third = feed.reserve(), feed.reserve(), feed.reserve()
+    feed.publish("car-x", "status", {"n": 3}, ticket=third, apply=lambda: applied.append(3))
+    feed.cancel(second)
+    assert feed.last_seq == 0 and applied == []
+    feed.publish("car-x", "status", {"n": 1}, ticket=first, apply=lambda: applied.append(1))
+    assert [e["changes"]["n"] for e in feed.since(0)] == [1, 3]
+    assert applied == [1, 3]
+
+    car_id = _new_car("F002EE77")
+    seq = main.feed.last_seq
+    client.patch(f"/api/cars/{car_id}/status", json={"status": "unavailable"})
+
+    async def first_chunks():
+        response = await main.stream_car_changes(since=None, epoch=None, last_event_id=f"{main.feed.epoch}:{seq - 1}")
+        chunks = [await response.body_iterator.__anext__() for _ in range(2)]
+        await response.body_iterator.aclose()
+        return chunks
+
+    created, status = asyncio.run(first_chunks())
+    assert created.startswith(f"id: {main.feed.epoch}:{seq}\nevent: change\n")
+    assert '"status": "unavailable"' in status
+
+
+def test_reserve_is_compare_and_set_under_contention():
+    from concurrent.futures import ThreadPoolExecutor
+
+    car_id = _new_car("S001SS77")
+
+    def reserve(i):
+        return shared_client.post(f"/api/cars/{car_id}/reserve", json={"booking_id": f"booking-{i}"})
+
+    # общий event loop на все запросы вместо нового на каждый вызов
+    with TestClient(app) as shared_client, ThreadPoolExecutor(max_workers=32) as pool:
+        responses = list(pool.map(reserve, range(200)))
+
+    winners = [r.json() for r in responses if r.status_code == 200]
+    assert len(winners) == 1
+    assert {r.status_code for r in responses} == {200, 409}
+    winner = winners[0]
+    assert (winner["status"], winner["version"]) == ("reserved", 2)
+
+    car = main.cars.get(car_id)
+    assert car["reserved_by"] == winner["reserved_by"]
+
+    # чужая бронь не может начать поездку, устаревшая версия – тоже
+    other = {"booking_id": "booking-other"}
+    assert client.post(f"/api/cars/{car_id}/start-trip", json=other).status_code == 409
+    r = client.post(f"/api/cars/{car_id}/start-trip", json={"booking_id": car["reserved_by"], "expected_version": 1})
+    assert r.status_code == 409 and r.json()["detail"]["version"] == 2
+
+    r = client.post(f"/api/cars/{car_id}/start-trip", json={"booking_id": car["reserved_by"], "expected_version": 2})
+    assert (r.json()["status"], r.json()["version"]) == ("in_trip", 3)
+    assert client.post(f"/api/cars/{car_id}/reserve").status_code == 409
+    # недопустимый переход и неизвестный статус
+    assert client.patch(f"/api/cars/{car_id}/status", json={"status": "reserved"}).status_code == 409
+    assert client.patch(f"/api/cars/{car_id}/status", json={"status": "flying"}).status_code == 400
+
+    r = client.post(f"/api/cars/{car_id}/release")
+    assert (r.json()["status"], r.json()["reserved_by"]) == ("available", None)
+    assert car_id in {c["id"] for c in client.get("/api/cars", params={"status": "available"}).json()}
+
+
+def test_capture_middleware_records_sampled_requests_to_rotating_jsonl(tmp_path):
+    import json
+    from fastapi import FastAPI
+    from common import capture
+    from common.metrics import UNMATCHED_ENDPOINT
+
+    writer = capture.CaptureWriter(str(tmp_path / "car_service.jsonl"), max_bytes=4000, backups=10)
+    captured = FastAPI()
+    captured.add_middleware(capture.CaptureMiddleware, writer=writer, sample_rate=1.0, max_body=200)
+
+    @captured.post("/api/cars/{car_id}/location")
+    def move(car_id: str, payload: dict):
+        return {"id": car_id, **payload}
+
+    with TestClient(captured) as capture_client:
+        for i in range(20):
+            r = capture_client.post(
+                f"/api/cars/car-{i}/location", json={"lat": 55.75, "lon": 37.61},
+                headers={"Authorization": "Bearer secret", "X-Request-ID": f"req-{i}"},
+            )
+            assert r.status_code == 200
+        capture_client.post("/api/cars/car-big/location", json={"note": "x" * 500})
+        capture_client.get("/nowhere")
+    writer.close()
+
+    files = list(tmp_path.iterdir())
+    assert len(files) > 1  # файл ротировался
+    records = sorted(
+        (json.loads(line) for f in files for line in f.read_text().splitlines()), key=lambda record: record["ts"]
+    )
+    assert len(records) == 22
+    first = records[0]
+    assert first["method"] == "POST"
+    assert first["endpoint"] == "/api/cars/{car_id}/location"
+    assert first["json"] == {"lat": 55.75, "lon": 37.61}
+    assert first["response_json"] == {"id": "car-0", "lat": 55.75, "lon": 37.61}
+    assert first["status"] == 200 and first["duration_ms"] >= 0
+    assert first["headers"]["x-request-id"] == "req-0"
+    assert "authorization" not in first["headers"]
+    # длинное тело не сохраняется, только его размер; без маршрута – общая метка
+    assert "json" not in records[-2] and records[-2]["body_size"] > 200
+    assert records[-1]["endpoint"] == UNMATCHED_ENDPOINT and records[-1]["status"] == 404
+
+
+def test_get_car_is_served_from_cache_until_the_car_changes():
+    car = client.post("/api/cars", json={
+        "model": "Kia Rio", "plate_number": f"C{uuid4().hex[:8]}", "color": "white",
+        "location": "Москва", "lat": 55.75, "lon": 37.61,
+    }).json()
+
+    first = client.get(f"/api/cars/{car['id']}")
+    assert first.json() == car
+    assert client.get(f"/api/cars/{car['id']}", headers={"If-None-Match": first.headers["etag"]}).status_code == 304
+
+    client.patch(f"/api/cars/{car['id']}/location", json={"lat": 55.80, "lon": 37.70})
+    r = client.get(f"/api/cars/{car['id']}", headers={"If-None-Match": first.headers["etag"]})
+    assert r.status_code == 200
+    assert (r.json()["lat"], r.json()["lon"]) == (55.80, 37.70)
+
+    client.post(f"/api/cars/{car['id']}/reserve")
+    assert client.get(f"/api/cars/{car['id']}").json()["status"] == "reserved"
+    assert client.get("/api/cars/missing").status_code == 404
@@ -0,0 +1 @@
+"""Общий код сервисов каршеринга (инструментация и т.п.)."""
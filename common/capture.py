@@ -0,0 +1,183 @@
+"""
+Запись трафика сервиса для воспроизведения (python -m benchmarks.loadtest replay).
+
+CaptureMiddleware – чистый ASGI: для доли запросов CAPTURE_SAMPLE_RATE
+сохраняет запрос, ответ и время обработки одной JSON-строкой в формате
+benchmarks/loadtest/traffic.py. Строки пишет поток QueueListener в
+RotatingFileHandler, запрос на диск не ждёт.
+
+Включается только при заданном CAPTURE_DIR:
+    CAPTURE_DIR          – каталог, файл <service>.jsonl (+ .1, .2 ... после ротации)
+    CAPTURE_SAMPLE_RATE  – доля записываемых запросов, 0..1 (0.01)
+    CAPTURE_MAX_BYTES    – размер файла до ротации (100 МБ)
+    CAPTURE_BACKUPS      – сколько старых файлов хранить (10)
+    CAPTURE_MAX_BODY     – тела длиннее не сохраняются, только размер (256 КБ)
+    CAPTURE_REDACT       – заголовки, которые не пишутся (authorization,cookie,set-cookie)
+
+В записи остаются тела запросов с пользовательскими данными – файлы
+захвата хранить как логи с персональными данными.
+
+Подключение в сервисе:
+
+    capture.setup_capture(app, SERVICE_NAME)
+"""
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional
+
+from common.metrics import route_template
+
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "0.01"))
+CAPTURE_MAX_BYTES = int(os.getenv("CAPTURE_MAX_BYTES", str(100 * 1024 * 1024)))
+CAPTURE_BACKUPS = int(os.getenv("CAPTURE_BACKUPS", "10"))
+CAPTURE_MAX_BODY = int(os.getenv("CAPTURE_MAX_BODY", str(256 * 1024)))
+CAPTURE_REDACT = frozenset(
+    h.strip().lower() for h in os.getenv("CAPTURE_REDACT", "authorization,cookie,set-cookie").split(",") if h.strip()
+)
+
+
+class _RecordQueueHandler(QueueHandler):
+    # запись (dict) уходит в очередь как есть: json.dumps делает поток записи
+    def prepare(self, record):
+        return record
+
+
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.msg, ensure_ascii=False, separators=(",", ":"))
+
+
+class CaptureWriter:
+    """Ротируемый JSONL-файл, запись в фоновом потоке."""
+
+    def __init__(self, path: str, max_bytes: int = CAPTURE_MAX_BYTES, backups: int = CAPTURE_BACKUPS):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(_JsonLineFormatter())
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._handler = _RecordQueueHandler(self._queue)
+        self._listener = QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def write(self, record: Dict) -> None:
+        self._handler.handle(logging.makeLogRecord({"msg": record}))
+
+    def close(self) -> None:
+        """Дописывает очередь и закрывает файл."""
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+
+def _body_fields(body: bytes, size: int, content_type: str, prefix: str = "") -> Dict:
+    """Тело как json / body (текст) / body_b64; слишком длинное – только размер."""
+    if size > len(body):
+        return {f"{prefix}body_size": size}
+    if not body:
+        return {}
+    if "json" in content_type:
+        try:
+            return {f"{prefix}json": json.loads(body)}
+        except ValueError:
+            pass
+    try:
+        return {f"{prefix}body": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {f"{prefix}body_b64": base64.b64encode(body).decode("ascii")}
+
+
+class CaptureMiddleware:
+    def __init__(
+        self,
+        app,
+        writer: CaptureWriter,
+        sample_rate: float = CAPTURE_SAMPLE_RATE,
+        max_body: int = CAPTURE_MAX_BODY,
+        redact=CAPTURE_REDACT,
+    ):
+        self.app = app
+        self.writer = writer
+        self.sample_rate = sample_rate
+        self.max_body = max_body
+        self.redact = frozenset(h.lower().encode("latin-1") for h in redact)
+
+    def _collect(self, chunks: List[bytes], size: int, chunk: bytes) -> int:
+        size += len(chunk)
+        if size <= self.max_body:
+            chunks.append(chunk)
+        return size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        ts = time.time()
+        request_chunks: List[bytes] = []
+        response_chunks: List[bytes] = []
+        request_size = response_size = 0
+        status_code = 500
+        response_type = ""
+
+        async def receive_wrapper():
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request":
+                request_size = self._collect(request_chunks, request_size, message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status_code, response_size, response_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name == b"content-type":
+                        response_type = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                response_size = self._collect(response_chunks, response_size, message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            headers = {}
+            request_type = ""
+            for name, value in scope["headers"]:
+                if name == b"content-type":
+                    request_type = value.decode("latin-1")
+                if name not in self.redact:
+                    headers[name.decode("latin-1")] = value.decode("latin-1")
+            record = {
+                "ts": round(ts, 6),
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "endpoint": route_template(scope),
+                "headers": headers,
+                **_body_fields(b"".join(request_chunks), request_size, request_type),
+                "status": status_code,
+                "duration_ms": round(duration_ms, 3),
+                **_body_fields(b"".join(response_chunks), response_size, response_type, prefix="response_"),
+            }
+            self.writer.write(record)
+
+
+def setup_capture(app, service_name: str, directory: Optional[str] = CAPTURE_DIR) -> Optional[CaptureWriter]:
+    """Подключает CaptureMiddleware, если задан каталог; иначе ничего не делает."""
+    if not directory:
+        return None
+    writer = CaptureWriter(os.path.join(directory, f"{service_name}.jsonl"))
+    atexit.register(writer.close)
+    app.add_middleware(CaptureMiddleware, writer=writer)
+    return writer
@@ -0,0 +1,112 @@
+"""
+Prometheus-метрики HTTP для всех сервисов.
+
+PrometheusMiddleware – чистый ASGI-middleware (без BaseHTTPMiddleware):
+- endpoint в метках – шаблон маршрута ("/api/cars/{car_id}"), а не сырой
+  путь, поэтому число временных рядов не растёт с числом id;
+- запросы без маршрута (404) попадают в одну метку UNMATCHED_ENDPOINT;
+- длительность меряется по time.perf_counter();
+- дочерние метрики для (method, endpoint[, status]) создаются один раз
+  и кешируются, на запросе нет .labels() с разбором kwargs.
+
+Подключение в сервисе:
+
+    app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+
+    @app.get("/metrics")
+    def metrics():
+        return metrics_response()
+"""
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+from starlette.responses import Response
+
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "Total HTTP requests",
+    ["service", "method", "endpoint", "status_code"],
+)
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request duration in seconds",
+    ["service", "method", "endpoint"],
+)
+
+ACTIVE_REQUESTS = Gauge(
+    "http_active_requests",
+    "Active HTTP requests",
+    ["service"],
+)
+
+UNMATCHED_ENDPOINT = "<unmatched>"
+
+# нестандартные методы схлопываются в одну метку, чтобы клиент не мог
+# плодить ряды произвольными глаголами
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+
+def route_template(scope) -> str:
+    """Шаблон пути маршрута, который обработал запрос, или UNMATCHED_ENDPOINT."""
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    return path if path is not None else UNMATCHED_ENDPOINT
+
+
+class PrometheusMiddleware:
+    def __init__(self, app, service_name: str):
+        self.app = app
+        self.service_name = service_name
+        self._active = ACTIVE_REQUESTS.labels(service=service_name)
+        self._durations = {}
+        self._counts = {}
+
+    def _duration(self, method: str, endpoint: str):
+        key = (method, endpoint)
+        child = self._durations.get(key)
+        if child is None:
+            child = REQUEST_DURATION.labels(service=self.service_name, method=method, endpoint=endpoint)
+            self._durations[key] = child
+        return child
+
+    def _count(self, method: str, endpoint: str, status_code: int):
+        key = (method, endpoint, status_code)
+        child = self._counts.get(key)
+        if child is None:
+            child = REQUEST_COUNT.labels(
+                service=self.service_name, method=method, endpoint=endpoint, status_code=str(status_code)
+            )
+            self._counts[key] = child
+        return child
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        self._active.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            self._active.dec()
+            method = scope["method"]
+            if method not in KNOWN_METHODS:
+                method = "OTHER"
+            endpoint = route_template(scope)
+            self._duration(method, endpoint).observe(duration)
+            self._count(method, endpoint, status_code).inc()
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
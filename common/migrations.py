@@ -0,0 +1,66 @@
+"""
+Версионированные миграции схемы для сервисов на SQLAlchemy.
+
+Версия хранится в таблице <service>_schema_version – у каждого сервиса
+своя, чтобы сервисы могли делить одну БД (DATABASE_URL). Пустая БД
+создаётся сразу по актуальным моделям и помечается последней версией;
+БД без таблицы версий, но с основной таблицей сервиса считается версией 1
+и доводится до актуальной по шагам из списка миграций.
+
+Общая таблица schema_version прежних версий не читается: по ней не
+отличить версию этого сервиса от версии соседнего. Поэтому миграции
+пишутся идемпотентными – повторный шаг на уже обновлённой схеме ничего
+не меняет.
+
+В сервисе (app/migrations.py) остаётся только список шагов:
+
+    MIGRATIONS = [(2, _add_query_indexes)]
+    migrator = SchemaMigrator("booking", models.Base.metadata, "bookings", MIGRATIONS)
+    upgrade = migrator.upgrade
+"""
+from typing import Callable, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, inspect, select
+from sqlalchemy.engine import Connection, Engine
+
+LEGACY_VERSION = 1
+
+# (версия, функция) – версия, до которой функция поднимает схему
+Migration = Tuple[int, Callable[[Connection], None]]
+
+
+class SchemaMigrator:
+    def __init__(self, service: str, metadata: MetaData, main_table: str, migrations: Sequence[Migration]):
+        self.metadata = metadata
+        self.main_table = main_table
+        self.migrations = list(migrations)
+        self.head_version = self.migrations[-1][0] if self.migrations else LEGACY_VERSION
+        self.version_table = Table(
+            f"{service}_schema_version",
+            MetaData(),
+            Column("version", Integer, nullable=False),
+        )
+
+    def current_version(self, conn: Connection) -> Optional[int]:
+        tables = inspect(conn).get_table_names()
+        if self.version_table.name not in tables:
+            return LEGACY_VERSION if self.main_table in tables else None
+        return conn.execute(select(func.max(self.version_table.c.version))).scalar() or LEGACY_VERSION
+
+    def upgrade(self, engine: Engine) -> int:
+        """Доводит схему до head_version и возвращает итоговую версию."""
+        with engine.begin() as conn:
+            version = self.current_version(conn)
+            self.version_table.create(conn, checkfirst=True)
+
+            if version is None:
+                self.metadata.create_all(bind=conn)
+                conn.execute(self.version_table.insert().values(version=self.head_version))
+                return self.head_version
+
+            for target, migrate in self.migrations:
+                if target > version:
+                    migrate(conn)
+                    conn.execute(self.version_table.insert().values(version=target))
+                    version = target
+        return version
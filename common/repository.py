@@ -0,0 +1,615 @@
+"""
+Хранилище записей для сервисов без собственной БД (car, user, geo,
+promo, support, fines).
+
+Запись – обычный dict с ключом в поле key. Бэкенд выбирается переменной
+окружения STORAGE_URL:
+    не задана или memory://  – словарь в памяти процесса (MemoryRepository),
+                               как было раньше; данные теряются при рестарте;
+    sqlite:///./cars.db и т.п. – SQLAlchemy (SqlRepository), данные общие
+                               для нескольких воркеров uvicorn.
+
+Поля из indexed получают индекс, поля из unique – уникальный индекс
+(в памяти – хеш-индексы, в БД – колонки с индексами), find() по ним не
+просматривает все записи. Вся запись хранится в колонке data как JSON.
+
+Изменения идут только через add/update/modify/delete: get() и find()
+отдают копии. modify() – атомарное чтение-изменение-запись одной записи.
+
+SqlRepository пишет ключ каждой изменённой записи в журнал <name>_changes
+(seq по возрастанию) той же транзакцией, что и саму запись. Процесс, у
+которого есть свои производные данные (пространственный индекс, кеш
+ответов), следит за журналом через follow() и применяет только
+изменённые другими воркерами записи, а не перестраивает всё. Журнал
+хранит CHANGE_LOG_RETENTION секунд; отставший читатель получает reset.
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    event,
+    func,
+    inspect,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import IntegrityError
+
+STORAGE_URL = os.getenv("STORAGE_URL", "memory://")
+
+# сколько секунд хранить журнал изменений SqlRepository
+CHANGE_LOG_RETENTION = float(os.getenv("STORAGE_CHANGE_LOG_RETENTION_SECONDS", "3600"))
+# старые записи журнала удаляются раз в столько записей этого процесса
+CHANGE_LOG_PRUNE_EVERY = 1000
+# пропуск в seq журнала (транзакция с меньшим seq ещё не закоммичена или
+# откатилась) ждём столько секунд, потом считаем его откатом
+CHANGE_GAP_SETTLE = 2.0
+
+# те же PRAGMA, что в booking_service/app/database.py
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+_COLUMN_TYPES = {str: String, int: Integer, float: Float, bool: Boolean}
+
+Fields = Union[Sequence[str], Mapping[str, type]]
+
+
+class DuplicateKeyError(Exception):
+    """Запись с таким ключом или значением уникального поля уже есть."""
+
+    def __init__(self, field: str, values: Iterable):
+        self.field = field
+        self.values = sorted(set(values), key=str)
+        super().__init__(f"Duplicate {field}: {', '.join(map(str, self.values))}")
+
+
+def _field_types(fields: Fields) -> Dict[str, type]:
+    if isinstance(fields, Mapping):
+        return dict(fields)
+    return {name: str for name in fields}
+
+
+def _matches(row: dict, equals: dict) -> bool:
+    return all(row.get(name) == value for name, value in equals.items())
+
+
+# ====== В памяти ======
+
+class MemoryRepository:
+    shared = False  # данные видит только этот процесс
+
+    # число замков для modify(): записи с разными ключами почти всегда
+    # попадают под разные замки и не ждут друг друга
+    LOCK_STRIPES = 64
+
+    def __init__(self, name: str, key: str = "id", indexed: Fields = (), unique: Fields = ()):
+        self.name = name
+        self.key = key
+        self.unique = tuple(_field_types(unique))
+        self.indexed = tuple(_field_types(indexed))
+        self._rows: Dict[str, dict] = {}
+        self._unique: Dict[str, Dict[object, str]] = {field: {} for field in self.unique}
+        # значения индекса – dict как упорядоченное множество (порядок
+        # попадания в индекс); all() отдаёт записи в порядке вставки
+        self._indexes: Dict[str, Dict[object, Dict[str, None]]] = {field: {} for field in self.indexed}
+        self._lock = threading.RLock()
+        self._stripes = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._revision = 0
+
+    def _stripe(self, key: str) -> threading.Lock:
+        return self._stripes[hash(key) % self.LOCK_STRIPES]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def revision(self) -> int:
+        return self._revision
+
+    def _index(self, row: dict, fields: Optional[Set[str]] = None) -> None:
+        key = row[self.key]
+        for field in self.unique:
+            if row.get(field) is not None and (fields is None or field in fields):
+                self._unique[field][row[field]] = key
+        for field in self.indexed:
+            if fields is None or field in fields:
+                self._indexes[field].setdefault(row.get(field), {})[key] = None
+
+    def _unindex(self, row: dict, fields: Optional[Set[str]] = None) -> None:
+        key = row[self.key]
+        for field in self.unique:
+            if self._unique[field].get(row.get(field)) == key and (fields is None or field in fields):
+                del self._unique[field][row[field]]
+        for field in self.indexed:
+            if fields is not None and field not in fields:
+                continue
+            bucket = self._indexes[field].get(row.get(field))
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._indexes[field][row.get(field)]
+
+    def _check_unique(self, rows: List[dict], replacing: Optional[str] = None) -> None:
+        keys = [row[self.key] for row in rows]
+        taken = [k for k in keys if k in self._rows and k != replacing]
+        seen: Set[str] = set()
+        taken += [k for k in keys if k in seen or seen.add(k)]
+        if taken:
+            raise DuplicateKeyError(self.key, taken)
+        for field in self.unique:
+            index = self._unique[field]
+            seen_values: Set[object] = set()
+            duplicates = []
+            for row in rows:
+                value = row.get(field)
+                if value is None:
+                    continue
+                owner = index.get(value)
+                if (owner is not None and owner != replacing) or value in seen_values:
+                    duplicates.append(value)
+                seen_values.add(value)
+            if duplicates:
+                raise DuplicateKeyError(field, duplicates)
+
+    def add(self, row: dict) -> dict:
+        return self.add_many([row])[0]
+
+    def add_many(self, rows: List[dict]) -> List[dict]:
+        """Либо добавляются все записи, либо ни одной (DuplicateKeyError)."""
+        rows = [dict(row) for row in rows]
+        with self._lock:
+            self._check_unique(rows)
+            for row in rows:
+                self._rows[row[self.key]] = row
+                self._index(row)
+            self._revision += 1
+        return [dict(row) for row in rows]
+
+    def get(self, key: str) -> Optional[dict]:
+        row = self._rows.get(key)
+        return dict(row) if row is not None else None
+
+    def get_many(self, keys: Iterable[str]) -> List[dict]:
+        rows = self._rows
+        return [dict(rows[key]) for key in keys if key in rows]
+
+    def all(self, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        """Записи в порядке вставки; offset/limit – страница без копии всего словаря."""
+        if not offset and limit is None:
+            return [dict(row) for row in list(self._rows.values())]
+        stop = offset + limit if limit is not None else None
+        with self._lock:
+            return [dict(row) for row in islice(self._rows.values(), offset, stop)]
+
+    def find(self, offset: int = 0, limit: Optional[int] = None, **equals) -> List[dict]:
+        """
+        Записи с заданными значениями полей; offset/limit – страница среди
+        них в порядке попадания в индекс (для записей, чьё значение поля
+        не менялось, – в порядке вставки).
+        """
+        candidates = None
+        for field, value in equals.items():
+            if field in self._unique:
+                key = self._unique[field].get(value)
+                candidates = (key,) if key is not None else ()
+                break
+            if field in self._indexes:
+                bucket = self._indexes[field].get(value, ())
+                if candidates is None or len(bucket) < len(candidates):
+                    candidates = bucket
+        stop = offset + limit if limit is not None else None
+        with self._lock:
+            if candidates is None:
+                rows = self._rows.values()
+            else:
+                rows = (self._rows[key] for key in candidates if key in self._rows)
+            matched = (row for row in rows if _matches(row, equals))
+            return [dict(row) for row in islice(matched, offset, stop)]
+
+    def find_one(self, **equals) -> Optional[dict]:
+        found = self.find(**equals)
+        return found[0] if found else None
+
+    def existing(self, field: str, values: Iterable) -> Set:
+        """Какие из values уже заняты в уникальном поле (или ключе)."""
+        index = self._rows if field == self.key else self._unique[field]
+        return {value for value in values if value in index}
+
+    def modify(self, key: str, change: Callable[[dict], Optional[dict]]) -> Optional[dict]:
+        """
+        Атомарно применяет change(копия записи) -> dict изменений и возвращает
+        новую запись; None – записи нет. Исключение из change отменяет изменение.
+        """
+        with self._stripe(key):
+            row = self._rows.get(key)
+            if row is None:
+                return None
+            changes = change(dict(row)) or {}
+            if not changes:
+                return dict(row)
+            new_row = {**row, **changes, self.key: key}
+            # переиндексируются только изменившиеся поля: остальные индексы
+            # сохраняют место записи, и страницы find() не перемешиваются
+            changed = {field for field in self.unique + self.indexed if row.get(field) != new_row.get(field)}
+            with self._lock:
+                self._check_unique([new_row], replacing=key)
+                self._unindex(row, changed)
+                self._rows[key] = new_row
+                self._index(new_row, changed)
+                self._revision += 1
+            return dict(new_row)
+
+    def update(self, key: str, **changes) -> Optional[dict]:
+        return self.modify(key, lambda row: changes)
+
+    def delete(self, key: str) -> bool:
+        with self._stripe(key), self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return False
+            self._unindex(row)
+            self._revision += 1
+            return True
+
+
+# ====== SQLAlchemy ======
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode_hook(obj: dict):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def _dumps(row: dict) -> str:
+    return json.dumps(row, default=_encode, ensure_ascii=False, separators=(",", ":"))
+
+
+def _loads(data: str) -> dict:
+    return json.loads(data, object_hook=_decode_hook)
+
+
+_engines: Dict[str, object] = {}
+_engines_lock = threading.Lock()
+
+
+def make_engine(url: str):
+    """Один engine на URL; для SQLite – WAL и PRAGMA из SQLITE_PRAGMAS."""
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is not None:
+            return engine
+        if url.startswith("sqlite"):
+            engine = create_engine(url, connect_args={"check_same_thread": False})
+
+            @event.listens_for(engine, "connect")
+            def set_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in SQLITE_PRAGMAS.items():
+                    if value:
+                        cursor.execute(f"PRAGMA {name}={value}")
+                cursor.close()
+        else:
+            engine = create_engine(url, pool_pre_ping=True)
+        _engines[url] = engine
+        return engine
+
+
+class SqlRepository:
+    shared = True  # данные общие для всех процессов с тем же STORAGE_URL
+
+    # по сколько значений отправлять в один IN (...)
+    IN_CHUNK = 500
+
+    def __init__(self, name: str, url: str, key: str = "id", indexed: Fields = (), unique: Fields = ()):
+        self.name = name
+        self.key = key
+        self.engine = make_engine(url)
+        unique_types = _field_types(unique)
+        indexed_types = _field_types(indexed)
+        self.unique = tuple(unique_types)
+        self.indexed = tuple(indexed_types)
+        self.columns = (key,) + self.unique + self.indexed
+
+        metadata = MetaData()
+        # seq сохраняет порядок вставки для all()/find(), как у dict
+        self.table = Table(
+            name,
+            metadata,
+            Column("seq", Integer, primary_key=True, autoincrement=True),
+            Column(key, String, nullable=False, unique=True),
+            *[Column(field, _COLUMN_TYPES[tp], unique=True) for field, tp in unique_types.items()],
+            *[Column(field, _COLUMN_TYPES[tp], index=True) for field, tp in indexed_types.items()],
+            Column("data", Text, nullable=False),
+        )
+        # журнал: только вставки, общей строки-счётчика, на которой
+        # выстраивались бы в очередь все пишущие, нет
+        self.changes = Table(
+            f"{name}_changes",
+            metadata,
+            Column("seq", Integer, primary_key=True, autoincrement=True),
+            Column("key", String, nullable=False),
+            Column("ts", Float, nullable=False),
+            Index(f"ix_{name}_changes_ts", "ts"),
+            sqlite_autoincrement=True,
+        )
+        metadata.create_all(self.engine)
+        self._add_indexed_columns()
+        # SQLite: запись в журнал первым оператором берёт блокировку на запись,
+        # так что чтение-изменение-запись в modify() не пересекается с другими
+        # воркерами; в остальных БД строку блокирует SELECT ... FOR UPDATE
+        self._log_first = self.engine.dialect.name == "sqlite"
+        self._writes = 0
+
+    def _add_indexed_columns(self) -> None:
+        """
+        Индексированные поля, добавленные после создания таблицы: колонка и
+        индекс. В старых строках колонка пустая (NULL), пока запись не
+        обновят, – заполнить её по data должен сервис.
+        """
+        with self.engine.begin() as conn:
+            existing = {column["name"] for column in inspect(conn).get_columns(self.name)}
+            for field in self.indexed:
+                if field in existing:
+                    continue
+                column_type = self.table.c[field].type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {self.name} ADD COLUMN {field} {column_type}"))
+                for index in self.table.indexes:
+                    if field in index.columns:
+                        index.create(conn, checkfirst=True)
+
+    def _values(self, row: dict) -> dict:
+        values = {column: row.get(column) for column in self.columns}
+        values["data"] = _dumps(row)
+        return values
+
+    def _log(self, conn, keys: Iterable[str]) -> None:
+        now = time.time()
+        conn.execute(self.changes.insert(), [{"key": key, "ts": now} for key in keys])
+        self._writes += 1
+        if self._writes % CHANGE_LOG_PRUNE_EVERY == 0:
+            conn.execute(self.changes.delete().where(self.changes.c.ts < now - CHANGE_LOG_RETENTION))
+
+    def _duplicate_error(self, conn, rows: List[dict], replacing: Optional[str] = None) -> DuplicateKeyError:
+        fields = self.unique if replacing is not None else (self.key,) + self.unique
+        for field in fields:
+            values = [row.get(field) for row in rows if row.get(field) is not None]
+            seen: Set = set()
+            duplicates = {v for v in values if v in seen or seen.add(v)}
+            duplicates |= self._existing(conn, field, values, replacing)
+            if duplicates:
+                return DuplicateKeyError(field, duplicates)
+        return DuplicateKeyError(self.key, [row.get(self.key) for row in rows])
+
+    def _existing(self, conn, field: str, values: List, replacing: Optional[str] = None) -> Set:
+        column = self.table.c[field]
+        where = [self.table.c[self.key] != replacing] if replacing is not None else []
+        found: Set = set()
+        for i in range(0, len(values), self.IN_CHUNK):
+            chunk = values[i:i + self.IN_CHUNK]
+            found.update(conn.execute(select(column).where(column.in_(chunk), *where)).scalars())
+        return found
+
+    def __len__(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(self.table)).scalar_one()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def revision(self) -> int:
+        """seq последнего изменения в журнале (0 – журнал пуст)."""
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.max(self.changes.c.seq))).scalar() or 0
+
+    def changes_since(self, seq: int) -> Tuple[List[Tuple[int, str]], bool]:
+        """
+        (seq, ключ) изменений после seq по возрастанию и признак reset:
+        часть журнала после seq уже удалена, изменения надо перечитать целиком.
+        """
+        column = self.changes.c.seq
+        with self.engine.connect() as conn:
+            rows = [tuple(row) for row in conn.execute(
+                select(column, self.changes.c.key).where(column > seq).order_by(column)
+            )]
+            reset = False
+            if rows and rows[0][0] > seq + 1:
+                # пропуск сразу после seq: откат или удалённая часть журнала
+                reset = conn.execute(select(func.min(column))).scalar() > seq + 1
+        return rows, reset
+
+    def follow(self, on_change: Callable[[List[str]], None], on_reset: Callable[[], None]) -> "ChangeFollower":
+        return ChangeFollower(self, on_change, on_reset)
+
+    def add(self, row: dict) -> dict:
+        return self.add_many([row])[0]
+
+    def add_many(self, rows: List[dict]) -> List[dict]:
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return []
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(self.table.insert(), [self._values(row) for row in rows])
+                self._log(conn, [row[self.key] for row in rows])
+        except IntegrityError:
+            with self.engine.connect() as conn:
+                raise self._duplicate_error(conn, rows) from None
+        return rows
+
+    def _select(self, conn, *where, offset: int = 0, limit: Optional[int] = None, for_update: bool = False) -> List[dict]:
+        stmt = select(self.table.c.data).where(*where).order_by(self.table.c.seq).offset(offset or None).limit(limit)
+        if for_update:
+            stmt = stmt.with_for_update()
+        return [_loads(data) for data in conn.execute(stmt).scalars()]
+
+    def get(self, key: str) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            found = self._select(conn, self.table.c[self.key] == key)
+        return found[0] if found else None
+
+    def get_many(self, keys: Iterable[str]) -> List[dict]:
+        keys = list(keys)
+        by_key = {}
+        column = self.table.c[self.key]
+        with self.engine.connect() as conn:
+            for i in range(0, len(keys), self.IN_CHUNK):
+                for row in self._select(conn, column.in_(keys[i:i + self.IN_CHUNK])):
+                    by_key[row[self.key]] = row
+        return [by_key[key] for key in keys if key in by_key]
+
+    def all(self, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        with self.engine.connect() as conn:
+            return self._select(conn, offset=offset, limit=limit)
+
+    def find(self, offset: int = 0, limit: Optional[int] = None, **equals) -> List[dict]:
+        where = [self.table.c[field] == value for field, value in equals.items() if field in self.columns]
+        # поля без колонки дофильтровываются по JSON, страница – уже после этого
+        rest = {field: value for field, value in equals.items() if field not in self.columns}
+        with self.engine.connect() as conn:
+            if not rest:
+                return self._select(conn, *where, offset=offset, limit=limit)
+            rows = self._select(conn, *where)
+        rows = [row for row in rows if _matches(row, rest)]
+        return rows[offset:offset + limit if limit is not None else None]
+
+    def find_one(self, **equals) -> Optional[dict]:
+        found = self.find(**equals)
+        return found[0] if found else None
+
+    def existing(self, field: str, values: Iterable) -> Set:
+        with self.engine.connect() as conn:
+            return self._existing(conn, field, list(values))
+
+    def modify(self, key: str, change: Callable[[dict], Optional[dict]]) -> Optional[dict]:
+        try:
+            with self.engine.begin() as conn:
+                if self._log_first:
+                    self._log(conn, [key])
+                found = self._select(conn, self.table.c[self.key] == key, for_update=True)
+                if not found:
+                    return None
+                changes = change(dict(found[0])) or {}
+                new_row = {**found[0], **changes, self.key: key}
+                if changes:
+                    conn.execute(
+                        update(self.table).where(self.table.c[self.key] == key).values(**self._values(new_row))
+                    )
+                    if not self._log_first:
+                        self._log(conn, [key])
+                return new_row
+        except IntegrityError:
+            with self.engine.connect() as conn:
+                raise self._duplicate_error(conn, [new_row], replacing=key) from None
+
+    def update(self, key: str, **changes) -> Optional[dict]:
+        return self.modify(key, lambda row: changes)
+
+    def delete(self, key: str) -> bool:
+        with self.engine.begin() as conn:
+            result = conn.execute(self.table.delete().where(self.table.c[self.key] == key))
+            if result.rowcount > 0:
+                self._log(conn, [key])
+            return result.rowcount > 0
+
+
+class ChangeFollower:
+    """
+    Читатель журнала изменений SqlRepository для производных данных процесса.
+
+    sync() передаёт в on_change ключи записей, изменённых после прошлого
+    вызова (в том числе этим процессом – применять их нужно идемпотентно),
+    а при первом вызове и после reset зовёт on_reset – перестроить всё.
+    Колбэки выполняются под замком: параллельный sync() дождётся, пока
+    изменения применятся.
+
+    Пропуск в seq (в Postgres транзакция с меньшим seq может закоммититься
+    позже) не сдвигает позицию CHANGE_GAP_SETTLE секунд: всё, что после
+    него, перечитывается и применяется повторно, пока пропуск не заполнится
+    или не будет признан откатом.
+    """
+
+    def __init__(self, repo: SqlRepository, on_change: Callable[[List[str]], None], on_reset: Callable[[], None]):
+        self.repo = repo
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self.position: Optional[int] = None
+        self._gaps: Dict[int, float] = {}  # seq пропуска -> когда замечен
+        self._lock = threading.Lock()
+
+    def sync(self) -> None:
+        with self._lock:
+            if self.position is None:
+                # позиция – до перестроения: изменения во время него не потеряются
+                self.position = self.repo.revision()
+                self.on_reset()
+                return
+
+            rows, reset = self.repo.changes_since(self.position)
+            if reset:
+                self.position = max(self.repo.revision(), rows[-1][0])
+                self._gaps.clear()
+                self.on_reset()
+                return
+            if not rows:
+                return
+
+            now = time.monotonic()
+            position = self.position
+            for seq, _ in rows:
+                while position + 1 < seq:
+                    noticed = self._gaps.setdefault(position + 1, now)
+                    if now - noticed < CHANGE_GAP_SETTLE:
+                        break
+                    del self._gaps[position + 1]
+                    position += 1
+                if position + 1 < seq:
+                    break
+                self._gaps.pop(seq, None)
+                position = seq
+            self.position = position
+            self.on_change(list(dict.fromkeys(key for _, key in rows)))
+
+
+Repository = Union[MemoryRepository, SqlRepository]
+
+
+def make_repository(
+    name: str,
+    key: str = "id",
+    indexed: Fields = (),
+    unique: Fields = (),
+    url: Optional[str] = None,
+) -> Repository:
+    """Хранилище с бэкендом из url или STORAGE_URL (по умолчанию – в памяти)."""
+    url = url or STORAGE_URL
+    if url.startswith("memory"):
+        return MemoryRepository(name, key=key, indexed=indexed, unique=unique)
+    return SqlRepository(name, url, key=key, indexed=indexed, unique=unique)
@@ -0,0 +1,149 @@
+"""
+Кеш готовых JSON-ответов для часто читаемых GET.
+
+ResponseCache хранит уже сериализованное тело (bytes) и его ETag:
+попадание не строит Pydantic-модель и не сериализует её заново.
+Записи живут RESPONSE_CACHE_TTL_SECONDS, общий объём ограничен
+RESPONSE_CACHE_MAX_BYTES – при переполнении вытесняются давно не
+читанные (LRU). Пишущие эндпоинты вызывают invalidate(key).
+
+Запрос, который начал строить ответ до invalidate, результат в кеш не
+кладёт (счётчик поколений), так что устаревший ответ не переживает
+запись, сделанную параллельно с ним.
+
+Кеш свой у каждого процесса. Для хранилища, общего с другими
+воркерами, передаётся sync – функция, которая перед поиском в кеше
+применяет чужие изменения (ChangeFollower.sync() из common.repository
+с invalidate по изменённым ключам): сбрасываются только они.
+
+ETag отдаётся с каждым ответом; If-None-Match с тем же значением
+получает 304 без тела. Попадания и промахи – в /metrics
+(response_cache_hits_total / response_cache_misses_total).
+
+    car_cache = ResponseCache("cars")
+
+    @app.get("/api/cars/{car_id}", response_model=CarOut)
+    def get_car(car_id: str, request: Request):
+        return car_cache.response(request, car_id, lambda: _car_json(car_id))
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from starlette.requests import Request
+from starlette.responses import Response
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "30"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# ответ всегда перепроверяется у сервера, но по ETag – без тела
+CACHE_CONTROL = "no-cache"
+
+# примерные накладные расходы на запись сверх тела (ключ, ETag, кортеж)
+ENTRY_OVERHEAD = 200
+
+CACHE_HITS = Counter("response_cache_hits_total", "Response cache hits", ["cache"])
+CACHE_MISSES = Counter("response_cache_misses_total", "Response cache misses", ["cache"])
+CACHE_EVICTIONS = Counter("response_cache_evictions_total", "Response cache LRU evictions", ["cache"])
+CACHE_BYTES = Gauge("response_cache_bytes", "Bytes held by the response cache", ["cache"])
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        name: str,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        sync: Optional[Callable[[], None]] = None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sync = sync
+        # ключ -> (момент устаревания, тело, ETag)
+        self._entries: "OrderedDict[Hashable, Tuple[float, bytes, str]]" = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._hits = CACHE_HITS.labels(cache=name)
+        self._misses = CACHE_MISSES.labels(cache=name)
+        self._evictions = CACHE_EVICTIONS.labels(cache=name)
+        self._size = CACHE_BYTES.labels(cache=name)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1]) + ENTRY_OVERHEAD
+
+    def get(self, key: Hashable, build: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """Тело и ETag из кеша или из build(); исключение build() не кешируется."""
+        if self.sync is not None:
+            self.sync()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return entry[1], entry[2]
+            generation = self._generation
+
+        self._misses.inc()
+        body = build()
+        etag = make_etag(body)
+        size = len(body) + ENTRY_OVERHEAD
+        if self.ttl <= 0 or size > self.max_bytes:
+            return body, etag
+
+        with self._lock:
+            if generation == self._generation:
+                self._drop(key)
+                self._entries[key] = (now + self.ttl, body, etag)
+                self._bytes += size
+                while self._bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+                    self._evictions.inc()
+                self._size.set(self._bytes)
+        return body, etag
+
+    def response(self, request: Request, key: Hashable, build: Callable[[], bytes]) -> Response:
+        """JSON-ответ с ETag; 304, если у клиента уже есть это тело."""
+        body, etag = self.get(key, build)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._drop(key)
+            self._size.set(self._bytes)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._size.set(0)
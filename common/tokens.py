@@ -0,0 +1,163 @@
+"""
+Подписанные токены доступа и их локальная проверка.
+
+Формат – JWT с HS256 (header.payload.signature в base64url), claims:
+sub (id пользователя), iat, exp. user_service выпускает токен через
+issue_token(), остальные сервисы проверяют его verify_token() сами,
+без запроса в user_service: достаточно общего секрета.
+
+Проверенные токены кешируются в LRU (ключ – строка токена целиком,
+в кеш попадают только токены с верной подписью), срок действия
+проверяется при каждом обращении.
+
+Эндпоинты, где user_id приходит в запросе, сверяют его с sub токена
+через ensure_subject() – чужой user_id получает 403.
+
+Настройки через переменные окружения:
+    AUTH_TOKEN_SECRET      – общий секрет HMAC; при AUTH_REQUIRED без него
+                             сервис не стартует, без AUTH_REQUIRED – dev-секрет
+                             и предупреждение в лог
+    AUTH_TOKEN_TTL         – время жизни токена в секундах (3600)
+    AUTH_TOKEN_CACHE_SIZE  – размер LRU проверенных токенов (10000)
+    AUTH_REQUIRED          – 1/true: запросы без токена получают 401
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+TOKEN_TTL = int(os.getenv("AUTH_TOKEN_TTL", "3600"))
+CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_REQUIRED = os.getenv("AUTH_REQUIRED", "").lower() in ("1", "true", "yes", "on")
+
+# известный всем секрет: токены с ним может выпустить кто угодно
+DEV_SECRET = "dev-insecure-secret"
+
+SECRET = os.getenv("AUTH_TOKEN_SECRET", "")
+if not SECRET:
+    if AUTH_REQUIRED:
+        raise RuntimeError("AUTH_TOKEN_SECRET must be set when AUTH_REQUIRED is on")
+    logging.getLogger(__name__).warning(
+        "AUTH_TOKEN_SECRET is not set, using the insecure development secret: tokens can be forged"
+    )
+    SECRET = DEV_SECRET
+
+ALGORITHM = "HS256"
+
+
+class TokenError(Exception):
+    """Токен испорчен, подписан другим ключом или просрочен."""
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    sub: str
+    iat: int
+    exp: int
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _json_segment(data: dict) -> str:
+    return _b64encode(json.dumps(data, separators=(",", ":")).encode())
+
+
+_HEADER_SEGMENT = _json_segment({"alg": ALGORITHM, "typ": "JWT"})
+
+
+def _sign(signing_input: str) -> str:
+    return _b64encode(hmac.new(SECRET.encode(), signing_input.encode(), hashlib.sha256).digest())
+
+
+def issue_token(subject: str, ttl: int | None = None, now: float | None = None) -> str:
+    iat = int(now if now is not None else time.time())
+    payload = _json_segment({"sub": subject, "iat": iat, "exp": iat + (ttl or TOKEN_TTL)})
+    signing_input = f"{_HEADER_SEGMENT}.{payload}"
+    return f"{signing_input}.{_sign(signing_input)}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _decode(token: str) -> TokenClaims:
+    # исключения lru_cache не кеширует, так что мусорные токены кеш не засоряют
+    try:
+        header, payload, signature = token.split(".")
+    except ValueError:
+        raise TokenError("Malformed token") from None
+
+    if not hmac.compare_digest(_sign(f"{header}.{payload}"), signature):
+        raise TokenError("Invalid token signature")
+
+    try:
+        if json.loads(_b64decode(header)).get("alg") != ALGORITHM:
+            raise TokenError("Unsupported token algorithm")
+        claims = json.loads(_b64decode(payload))
+        return TokenClaims(sub=str(claims["sub"]), iat=int(claims["iat"]), exp=int(claims["exp"]))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise TokenError("Malformed token") from None
+
+
+def verify_token(token: str, now: float | None = None) -> TokenClaims:
+    claims = _decode(token)
+    if claims.exp <= (now if now is not None else time.time()):
+        raise TokenError("Token expired")
+    return claims
+
+
+def clear_cache() -> None:
+    """Сбросить кеш проверенных токенов (например, после смены SECRET)."""
+    _decode.cache_clear()
+
+
+async def authenticate(authorization: Optional[str] = Header(None)) -> Optional[TokenClaims]:
+    """
+    FastAPI-зависимость: разбирает "Authorization: Bearer <token>".
+    Без заголовка возвращает None, если не включён AUTH_REQUIRED;
+    с неверным токеном – всегда 401. Объявлена async, чтобы лёгкая
+    проверка HMAC не уходила в threadpool.
+    """
+    if not authorization:
+        if AUTH_REQUIRED:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        return None
+
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid authorization header", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return verify_token(token.strip())
+    except TokenError as exc:
+        raise HTTPException(status_code=401, detail=str(exc), headers={"WWW-Authenticate": "Bearer"})
+
+
+def ensure_subject(claims: Optional[TokenClaims], user_id: Optional[str]) -> Optional[str]:
+    """
+    user_id, которым ограничить запрос: без токена – как пришёл; с токеном –
+    только владелец токена (не указан – claims.sub, чужой – 403).
+    """
+    if claims is None:
+        return user_id
+    if user_id is not None and claims.sub != user_id:
+        raise HTTPException(status_code=403, detail="Token does not belong to this user")
+    return claims.sub
+
+
+def token_owner(claims: Optional[TokenClaims]) -> Optional[str]:
+    """
+    Владелец записей, доступных по id: с токеном – claims.sub (чужие записи
+    отвечают 404, как несуществующие), без токена – None, без ограничений.
+    """
+    return claims.sub if claims is not None else None
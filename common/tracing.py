@@ -0,0 +1,265 @@
+"""
+Трассировка OpenTelemetry для всех сервисов.
+
+Сервер: FastAPIInstrumentor – span на каждый запрос, входящий
+traceparent (W3C trace-context) продолжает трассу вызывающего сервиса.
+X-Request-ID из запроса пишется в атрибут request.id и передаётся
+дальше в исходящих вызовах вместе с traceparent.
+
+Внутри: @traced на функциях crud и span на каждый SQL-запрос
+(instrument_engine, события SQLAlchemy before/after_cursor_execute).
+
+Клиент: httpx.Client(event_hooks={"request": [inject_headers]}).
+
+Head sampling – ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO)):
+решение принимает первый сервис в цепочке, остальные ему следуют.
+Spans копятся в BatchSpanProcessor и выгружаются фоновым потоком.
+
+TRACING_EXPORTER:
+    none     – трассировка выключена, приложение не инструментируется (по умолчанию)
+    memory   – InMemorySpanExporter (тесты, бенчмарки): tracing.memory_exporter
+    file     – JSON-строка на span в TRACING_FILE, коллектор не нужен
+    console  – то же в stdout
+    otlp     – OTLP/gRPC на OTEL_EXPORTER_OTLP_ENDPOINT
+
+Провайдер один на процесс: в процессе работает один сервис.
+
+Пакеты opentelemetry импортируются только при включённой трассировке:
+с TRACING_EXPORTER=none сервису они не нужны, а tracer() и client_span()
+отдают no-op spans.
+
+Подключение в сервисе:
+
+    tracing.setup_tracing(app, SERVICE_NAME, engines=[database.engine])
+"""
+import functools
+import inspect
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
+
+if TYPE_CHECKING:
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SpanExporter
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+TRACING_FILE = os.getenv("TRACING_FILE", "./traces.jsonl")
+# метрики и пробы не трассируются
+TRACING_EXCLUDED_URLS = os.getenv("TRACING_EXCLUDED_URLS", "/metrics,/health")
+
+# длинные запросы (bulk INSERT) обрезаются в атрибуте db.statement
+MAX_STATEMENT = 2000
+
+REQUEST_ID_HEADER = "x-request-id"
+
+provider: Optional["TracerProvider"] = None
+memory_exporter: Optional["InMemorySpanExporter"] = None
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("trace_request_id", default=None)
+
+
+class _NoOpSpan:
+    """Span без трассировки: тот же интерфейс, что используют сервисы."""
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key, value) -> None:
+        pass
+
+    def set_status(self, status) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+class _NoOpTracer:
+    """Tracer без opentelemetry: start_span / start_as_current_span ничего не пишут."""
+
+    _span = _NoOpSpan()
+
+    def start_span(self, name: str, **kwargs) -> _NoOpSpan:
+        return self._span
+
+    @contextmanager
+    def start_as_current_span(self, name: str, **kwargs) -> Iterator[_NoOpSpan]:
+        yield self._span
+
+
+_NOOP_TRACER = _NoOpTracer()
+
+
+def make_exporter(kind: str, path: str = TRACING_FILE) -> "SpanExporter":
+    from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    if kind == "memory":
+        return InMemorySpanExporter()
+    if kind == "file":
+        out = open(path, "a", buffering=1, encoding="utf-8")
+        return ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    if kind == "console":
+        return ConsoleSpanExporter()
+    if kind == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown TRACING_EXPORTER: {kind}")
+
+
+def setup_tracing(
+    app,
+    service_name: str,
+    engines: Iterable = (),
+    exporter: str = TRACING_EXPORTER,
+    sample_ratio: float = TRACING_SAMPLE_RATIO,
+) -> Optional["TracerProvider"]:
+    """
+    Создаёт провайдер процесса и инструментирует app и engines.
+    При exporter="none" ничего не делает и возвращает None.
+    """
+    global provider, memory_exporter
+    if exporter == "none":
+        return None
+
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.sdk.resources import SERVICE_INSTANCE_ID, SERVICE_NAME, Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+    from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+    if provider is None:
+        resource = Resource.create({SERVICE_NAME: service_name, SERVICE_INSTANCE_ID: os.getenv("INSTANCE_ID", "")})
+        provider = TracerProvider(resource=resource, sampler=ParentBased(TraceIdRatioBased(sample_ratio)))
+        span_exporter = make_exporter(exporter)
+        if isinstance(span_exporter, InMemorySpanExporter):
+            memory_exporter = span_exporter
+        provider.add_span_processor(BatchSpanProcessor(span_exporter))
+
+    FastAPIInstrumentor.instrument_app(
+        app,
+        tracer_provider=provider,
+        server_request_hook=_server_request_hook,
+        excluded_urls=TRACING_EXCLUDED_URLS,
+        # отдельные spans на каждое ASGI-сообщение ответа только зашумляют трассу
+        exclude_spans=["receive", "send"],
+    )
+    for engine in engines:
+        if engine is not None:
+            instrument_engine(engine)
+    return provider
+
+
+def tracer():
+    """Tracer процесса; без setup_tracing – no-op."""
+    if provider is None:
+        return _NOOP_TRACER
+    return provider.get_tracer("carsharing")
+
+
+def client_span(name: str):
+    """Текущий span исходящего вызова (SpanKind.CLIENT): with tracing.client_span(...) as span."""
+    if provider is None:
+        return _NOOP_TRACER.start_as_current_span(name)
+    from opentelemetry.trace import SpanKind
+
+    return tracer().start_as_current_span(name, kind=SpanKind.CLIENT)
+
+
+# ====== Request id ======
+
+def bind_request_id(request_id: str) -> None:
+    """Запоминает id запроса для исходящих вызовов и пишет его в текущий span."""
+    request_id_var.set(request_id)
+    if provider is None:
+        return
+    from opentelemetry import trace
+
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_attribute("request.id", request_id)
+
+
+def _server_request_hook(span, scope) -> None:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-request-id":
+            bind_request_id(value.decode("latin-1"))
+            return
+
+
+def inject_headers(request) -> None:
+    """httpx request hook: traceparent/tracestate и X-Request-ID текущего запроса."""
+    if provider is not None:
+        from opentelemetry import propagate
+
+        propagate.inject(request.headers)
+    request_id = request_id_var.get()
+    if request_id and REQUEST_ID_HEADER not in request.headers:
+        request.headers[REQUEST_ID_HEADER] = request_id
+
+
+# ====== crud и SQL ======
+
+def traced(fn=None, *, name: Optional[str] = None):
+    """Span на вызов функции (sync или async): @traced или @traced(name=...)."""
+    if fn is None:
+        return functools.partial(traced, name=name)
+    span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with tracer().start_as_current_span(span_name):
+                return await fn(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with tracer().start_as_current_span(span_name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_engine(engine) -> None:
+    """Span на каждый запрос к БД; для AsyncEngine – через его sync_engine."""
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if getattr(sync_engine, "_carsharing_traced", False):
+        return
+    sync_engine._carsharing_traced = True
+    system = sync_engine.dialect.name
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        span = tracer().start_span(
+            statement.split(None, 1)[0].upper() if statement else system,
+            kind=SpanKind.CLIENT,
+        )
+        if span.is_recording():
+            span.set_attribute("db.system", system)
+            span.set_attribute("db.statement", statement[:MAX_STATEMENT])
+        conn.info.setdefault("_otel_spans", []).append(span)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("_otel_spans")
+        if spans:
+            spans.pop().end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("_otel_spans") if conn is not None else None
+        if spans:
+            span = spans.pop()
+            span.set_status(Status(StatusCode.ERROR, str(exception_context.original_exception)))
+            span.end()
@@ -1,55 +1,26 @@
-import time
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi import Depends, FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import List, Optional
 from uuid import uuid4
 from datetime import datetime
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import make_repository
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
 
 app = FastAPI(title="Fines Service")
 
 # ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
-
 SERVICE_NAME = "fines_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 
 class FineCreate(BaseModel):
@@ -68,10 +39,11 @@ class FineOut(BaseModel):
     created_at: datetime
 
 
-fines: Dict[str, Dict] = {}
+# штрафы по id; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти)
+fines = make_repository("fines", indexed=("user_id",))
 
 
-@app.post("/api/fines", response_model=FineOut)
+@app.post("/api/fines", response_model=FineOut, dependencies=[Depends(authenticate)])
 def create_fine(payload: FineCreate):
     fine_id = str(uuid4())
     fine = {
@@ -82,21 +54,22 @@ def create_fine(payload: FineCreate):
         "amount": payload.amount,
         "created_at": datetime.utcnow(),
     }
-    fines[fine_id] = fine
+    fines.add(fine)
     return FineOut(**fine)
 
 
 @app.get("/api/fines/{fine_id}", response_model=FineOut)
-def get_fine(fine_id: str):
+def get_fine(fine_id: str, claims: Optional[TokenClaims] = Depends(authenticate)):
     fine = fines.get(fine_id)
-    if not fine:
+    owner_id = token_owner(claims)
+    # чужой штраф – как несуществующий
+    if not fine or (owner_id is not None and fine["user_id"] != owner_id):
         raise HTTPException(status_code=404, detail="Fine not found")
     return FineOut(**fine)
 
 
 @app.get("/api/fines", response_model=List[FineOut])
-def list_fines(user_id: Optional[str] = None):
-    result = list(fines.values())
-    if user_id:
-        result = [f for f in result if f["user_id"] == user_id]
+def list_fines(user_id: Optional[str] = None, claims: Optional[TokenClaims] = Depends(authenticate)):
+    user_id = ensure_subject(claims, user_id)
+    result = fines.find(user_id=user_id) if user_id else fines.all()
     return [FineOut(**f) for f in result]
@@ -31,3 +31,21 @@ def test_create_and_list_fines():
     assert r3.status_code == 200
     data3 = r3.json()
     assert any(f["id"] == fine_id for f in data3)
+
+
+def test_token_only_reaches_its_own_fines(monkeypatch):
+    from common import tokens
+
+    monkeypatch.setattr(tokens, "AUTH_REQUIRED", True)
+    owner = {"Authorization": f"Bearer {tokens.issue_token('user-fine-owner')}"}
+    other = {"Authorization": f"Bearer {tokens.issue_token('user-fine-other')}"}
+    fine_id = client.post("/api/fines", json={
+        "user_id": "user-fine-owner", "trip_id": "trip-owner", "reason": "Штраф", "amount": 100.0,
+    }, headers=owner).json()["id"]
+
+    # без user_id – только свои штрафы, чужой по id – 404
+    assert client.get("/api/fines", headers=other).json() == []
+    assert client.get(f"/api/fines/{fine_id}", headers=other).status_code == 404
+    assert client.get("/api/fines", params={"user_id": "user-fine-owner"}, headers=other).status_code == 403
+    assert [f["id"] for f in client.get("/api/fines", headers=owner).json()] == [fine_id]
+    assert client.get(f"/api/fines/{fine_id}", headers=owner).status_code == 200
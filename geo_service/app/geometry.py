@@ -0,0 +1,150 @@
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+Point = Tuple[float, float]  # (lat, lon)
+
+_NUMBER_RE = re.compile(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+# что остаётся от списка координат без чисел: скобки и разделители
+_SEPARATORS_RE = re.compile(r"[\s,;()\[\]]*")
+
+
+def parse_polygon(text: str) -> List[Point]:
+    """
+    Разбирает строку вида "[(55.75,37.6),(55.76,37.7),...]" или
+    "[[55.75,37.6],...]" в список вершин (lat, lon).
+
+    Текст, не похожий на список координат (описание вроде "Зона 5"),
+    даёт пустой список – такую зону хранят без индекса, как вырожденный
+    контур. ValueError – только для списка координат с ошибкой.
+    """
+    if not _SEPARATORS_RE.fullmatch(_NUMBER_RE.sub(" ", text)):
+        return []
+    numbers = [float(n) for n in _NUMBER_RE.findall(text)]
+    if len(numbers) % 2:
+        raise ValueError("Polygon must consist of (lat, lon) pairs")
+    vertices = list(zip(numbers[0::2], numbers[1::2]))
+    # замкнутый контур часто передают с повтором первой вершины в конце
+    if len(vertices) > 1 and vertices[0] == vertices[-1]:
+        vertices.pop()
+    for lat, lon in vertices:
+        if not -90 <= lat <= 90:
+            raise ValueError(f"Latitude {lat} is out of range [-90, 90]")
+        if not -180 <= lon <= 180:
+            raise ValueError(f"Longitude {lon} is out of range [-180, 180]")
+    return vertices
+
+
+class Polygon:
+    __slots__ = ("vertices", "min_lat", "min_lon", "max_lat", "max_lon")
+
+    def __init__(self, vertices: List[Point]):
+        if len(vertices) < 3:
+            raise ValueError("Polygon needs at least 3 vertices")
+        self.vertices = vertices
+        lats = [v[0] for v in vertices]
+        lons = [v[1] for v in vertices]
+        self.min_lat, self.max_lat = min(lats), max(lats)
+        self.min_lon, self.max_lon = min(lons), max(lons)
+
+    def in_bbox(self, lat: float, lon: float) -> bool:
+        return self.min_lat <= lat <= self.max_lat and self.min_lon <= lon <= self.max_lon
+
+    def contains(self, lat: float, lon: float) -> bool:
+        if not self.in_bbox(lat, lon):
+            return False
+        # ray casting: считаем пересечения луча вдоль долготы с рёбрами
+        inside = False
+        vertices = self.vertices
+        lat_j, lon_j = vertices[-1]
+        for lat_i, lon_i in vertices:
+            if (lat_i > lat) != (lat_j > lat):
+                cross_lon = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+                if lon < cross_lon:
+                    inside = not inside
+            lat_j, lon_j = lat_i, lon_i
+        return inside
+
+
+class ZoneIndex:
+    """
+    Сетка по bbox зон: каждая зона регистрируется во всех ячейках,
+    которые покрывает её bbox, точный point-in-polygon считается
+    только для зон из ячейки точки.
+
+    Зона, bbox которой занял бы больше max_cells ячеек (регион, страна),
+    в сетку не кладётся: такие зоны лежат отдельным списком и
+    проверяются при каждом поиске – по bbox, затем точно.
+    """
+
+    def __init__(self, cell_deg: float = 0.05, max_cells: int = 1024):
+        self.cell_deg = cell_deg
+        self.max_cells = max_cells
+        self._polygons: Dict[str, Polygon] = {}
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._large: Dict[str, Polygon] = {}
+        self._lock = threading.Lock()
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _is_large(self, polygon: Polygon) -> bool:
+        min_row, min_col = self._cell(polygon.min_lat, polygon.min_lon)
+        max_row, max_col = self._cell(polygon.max_lat, polygon.max_lon)
+        return (max_row - min_row + 1) * (max_col - min_col + 1) > self.max_cells
+
+    def _cells_of(self, polygon: Polygon):
+        min_row, min_col = self._cell(polygon.min_lat, polygon.min_lon)
+        max_row, max_col = self._cell(polygon.max_lat, polygon.max_lon)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                yield row, col
+
+    def __len__(self) -> int:
+        return len(self._polygons)
+
+    def add(self, zone_id: str, polygon: Polygon) -> None:
+        with self._lock:
+            self._remove(zone_id)
+            self._polygons[zone_id] = polygon
+            if self._is_large(polygon):
+                self._large[zone_id] = polygon
+                return
+            for cell in self._cells_of(polygon):
+                self._cells.setdefault(cell, set()).add(zone_id)
+
+    def remove(self, zone_id: str) -> None:
+        with self._lock:
+            self._remove(zone_id)
+
+    def _remove(self, zone_id: str) -> None:
+        polygon = self._polygons.pop(zone_id, None)
+        if polygon is None:
+            return
+        if self._large.pop(zone_id, None) is not None:
+            return
+        for cell in self._cells_of(polygon):
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(zone_id)
+                if not bucket:
+                    del self._cells[cell]
+
+    def locate(self, lat: float, lon: float) -> List[str]:
+        result = []
+        bucket = self._cells.get(self._cell(lat, lon))
+        if bucket:
+            polygons = self._polygons
+            for zone_id in tuple(bucket):
+                polygon: Optional[Polygon] = polygons.get(zone_id)
+                if polygon is not None and polygon.contains(lat, lon):
+                    result.append(zone_id)
+        if self._large:
+            for zone_id, polygon in tuple(self._large.items()):
+                if polygon.contains(lat, lon):
+                    result.append(zone_id)
+        return result
+
+    def locate_many(self, points: List[Point]) -> List[List[str]]:
+        return [self.locate(lat, lon) for lat, lon in points]
@@ -1,54 +1,26 @@
-import time
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
-from pydantic import BaseModel
-from typing import Dict, List
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, Field, TypeAdapter, model_validator
+from typing import Annotated, List, Optional, Tuple
 from uuid import uuid4
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import ChangeFollower, make_repository
+from common.response_cache import ResponseCache
+from .geometry import Polygon, ZoneIndex, parse_polygon
 
 app = FastAPI(title="Geo Service")
 
 # ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
-
 SERVICE_NAME = "geo_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 # ====== Модели ======
 
@@ -66,11 +38,102 @@ class ZoneOut(BaseModel):
     polygon: str
 
 
-zones: Dict[str, Dict] = {}
+Latitude = Annotated[float, Field(ge=-90, le=90)]
+Longitude = Annotated[float, Field(ge=-180, le=180)]
+
+
+class ZoneLocateRequest(BaseModel):
+    # либо одна точка (lat/lon), либо пачка точек [[lat, lon], ...]
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    points: Optional[List[Tuple[Latitude, Longitude]]] = Field(default=None, max_length=50_000)
+
+    @model_validator(mode="after")
+    def check_points(self):
+        if self.points is None and (self.lat is None or self.lon is None):
+            raise ValueError("Either lat/lon or points must be provided")
+        return self
+
+
+class ZoneLocateResponse(BaseModel):
+    # results[i] – id зон, в которые попала i-я точка запроса
+    results: List[List[str]]
+
+
+# зоны по id; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти)
+zones = make_repository("zones")
+
+# индекс полигонов для поиска по точке – свой в каждом процессе
+zone_index = ZoneIndex()
+# журнал изменений общего хранилища (None – хранилище в памяти процесса)
+_zones_follower: Optional[ChangeFollower] = None
+
+
+def _sync_zones() -> None:
+    """
+    В общем хранилище зоны добавляют и другие воркеры: их изменения из
+    журнала применяются к индексу и кешу этого процесса по одной зоне.
+    """
+    global _zones_follower
+    if not zones.shared:
+        return
+    if _zones_follower is None or _zones_follower.repo is not zones:
+        _zones_follower = zones.follow(_apply_zone_changes, _rebuild_zones)
+    _zones_follower.sync()
+
+
+# готовые ответы GET /api/zones и /api/zones/{zone_id}: список зон
+# запрашивает каждый клиент при старте, а меняется он редко
+zone_cache = ResponseCache("zones", sync=_sync_zones)
+ZONE_LIST = TypeAdapter(List[ZoneOut])
+# ключ списка не совпадает ни с одним id зоны
+ALL_ZONES = ("all",)
+
+
+def _index_zone(index: ZoneIndex, zone_id: str, vertices) -> None:
+    # вырожденные контуры (меньше 3 вершин) храним, но в поиск по точке они не попадают
+    if len(vertices) >= 3:
+        index.add(zone_id, Polygon(vertices))
+
+
+def _apply_zone_changes(zone_ids: List[str]) -> None:
+    found = {zone["id"]: zone for zone in zones.get_many(zone_ids)}
+    for zone_id in zone_ids:
+        zone_index.remove(zone_id)
+        zone = found.get(zone_id)
+        if zone is not None:
+            try:
+                _index_zone(zone_index, zone_id, parse_polygon(zone["polygon"]))
+            except ValueError:
+                pass
+        zone_cache.invalidate(zone_id)
+    zone_cache.invalidate(ALL_ZONES)
+
+
+def _rebuild_zones() -> None:
+    global zone_index
+    index = ZoneIndex()
+    for zone in zones.all():
+        try:
+            _index_zone(index, zone["id"], parse_polygon(zone["polygon"]))
+        except ValueError:
+            continue
+    zone_index = index
+    zone_cache.clear()
+
+
+def _current_zone_index() -> ZoneIndex:
+    _sync_zones()
+    return zone_index
 
 
 @app.post("/api/zones", response_model=ZoneOut)
 def create_zone(payload: ZoneCreate):
+    try:
+        vertices = parse_polygon(payload.polygon)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
     zone_id = str(uuid4())
     zone = {
         "id": zone_id,
@@ -78,18 +141,32 @@ def create_zone(payload: ZoneCreate):
         "city": payload.city,
         "polygon": payload.polygon,
     }
-    zones[zone_id] = zone
+    zones.add(zone)
+    zone_cache.invalidate(ALL_ZONES)
+    _index_zone(zone_index, zone_id, vertices)
     return ZoneOut(**zone)
 
 
+@app.post("/api/zones/locate", response_model=ZoneLocateResponse)
+def locate_zones(payload: ZoneLocateRequest):
+    index = _current_zone_index()
+    if payload.points is not None:
+        return ZoneLocateResponse(results=index.locate_many(payload.points))
+    return ZoneLocateResponse(results=[index.locate(payload.lat, payload.lon)])
+
+
 @app.get("/api/zones", response_model=List[ZoneOut])
-def list_zones():
-    return [ZoneOut(**z) for z in zones.values()]
+def list_zones(request: Request):
+    return zone_cache.response(request, ALL_ZONES, lambda: ZONE_LIST.dump_json([ZoneOut(**z) for z in zones.all()]))
 
 
-@app.get("/api/zones/{zone_id}", response_model=ZoneOut)
-def get_zone(zone_id: str):
+def _zone_json(zone_id: str) -> bytes:
     zone = zones.get(zone_id)
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
-    return ZoneOut(**zone)
+    return ZoneOut(**zone).model_dump_json().encode()
+
+
+@app.get("/api/zones/{zone_id}", response_model=ZoneOut)
+def get_zone(zone_id: str, request: Request):
+    return zone_cache.response(request, zone_id, lambda: _zone_json(zone_id))
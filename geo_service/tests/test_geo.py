@@ -1,5 +1,6 @@
 import sys
 import os
+import time
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # geo_service/tests/test_geo.py
@@ -31,3 +32,109 @@ def test_create_and_list_zones():
     assert r3.status_code == 200
     data3 = r3.json()
     assert any(z["id"] == zone_id for z in data3)
+
+
+def test_locate_single_point_and_batch():
+    square = {
+        "name": "Квадрат",
+        "city": "Москва",
+        "polygon": "[(55.70,37.50),(55.70,37.60),(55.80,37.60),(55.80,37.50)]",
+    }
+    triangle = {
+        "name": "Треугольник",
+        "city": "Москва",
+        "polygon": "[[55.70,37.60],[55.80,37.70],[55.70,37.70]]",
+    }
+    square_id = client.post("/api/zones", json=square).json()["id"]
+    triangle_id = client.post("/api/zones", json=triangle).json()["id"]
+
+    r = client.post("/api/zones/locate", json={"lat": 55.75, "lon": 37.55})
+    assert r.status_code == 200
+    assert r.json()["results"] == [[square_id]]
+
+    points = [[55.75, 37.55], [55.72, 37.69], [55.78, 37.62], [10.0, 10.0]]
+    r2 = client.post("/api/zones/locate", json={"points": points})
+    assert r2.status_code == 200
+    results = r2.json()["results"]
+    assert results[0] == [square_id]
+    assert results[1] == [triangle_id]
+    # точка выше гипотенузы треугольника, но внутри его bbox
+    assert results[2] == []
+    assert results[3] == []
+
+    assert client.post("/api/zones/locate", json={"lat": 55.75}).status_code == 422
+
+
+def test_large_zones_skip_the_grid_and_coordinates_are_validated():
+    from app.main import zone_index
+
+    # 60° x 60° – миллион ячеек сетки, если класть зону в каждую
+    ocean = {"name": "Океан", "city": "-", "polygon": "[(-30,-170),(-30,-110),(30,-110),(30,-170)]"}
+    start = time.perf_counter()
+    ocean_id = client.post("/api/zones", json=ocean).json()["id"]
+    assert time.perf_counter() - start < 1
+    assert ocean_id in zone_index._large
+
+    r = client.post("/api/zones/locate", json={"points": [[0, -140], [0, 140]]})
+    assert r.json()["results"] == [[ocean_id], []]
+
+    bad = {"name": "Мимо", "city": "-", "polygon": "[(10000,0),(10001,0),(10000,10000)]"}
+    assert client.post("/api/zones", json=bad).status_code == 400
+    assert client.post("/api/zones", json={**bad, "polygon": "[(55.7,37.5),(55.8)]"}).status_code == 400
+    # описание вместо координат – зона без индекса, а не ошибка
+    r = client.post("/api/zones", json={**bad, "polygon": "Zone 5"})
+    assert r.status_code == 200 and r.json()["polygon"] == "Zone 5"
+    assert r.json()["id"] not in zone_index._polygons
+    assert client.post("/api/zones/locate", json={"points": [[91, 0]]}).status_code == 422
+    assert client.post("/api/zones/locate", json={"points": [[0, 181]]}).status_code == 422
+
+
+def test_zone_list_is_cached_with_etag_and_refreshed_after_create():
+    from prometheus_client import REGISTRY
+
+    def counter(name):
+        return REGISTRY.get_sample_value(f"response_cache_{name}_total", {"cache": "zones"}) or 0
+
+    polygon = "[(55.70,37.50),(55.71,37.50),(55.71,37.51)]"
+    client.post("/api/zones", json={"name": "Кеш 1", "city": "Москва", "polygon": polygon})
+
+    first = client.get("/api/zones")
+    hits, misses = counter("hits"), counter("misses")
+    second = client.get("/api/zones")
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+    assert (counter("hits"), counter("misses")) == (hits + 1, misses)
+
+    r = client.get("/api/zones", headers={"If-None-Match": first.headers["etag"]})
+    assert r.status_code == 304
+    assert r.content == b""
+
+    # новая зона сбрасывает список: старый ETag больше не совпадает
+    client.post("/api/zones", json={"name": "Кеш 2", "city": "Москва", "polygon": polygon})
+    r = client.get("/api/zones", headers={"If-None-Match": first.headers["etag"]})
+    assert r.status_code == 200
+    assert "Кеш 2" in [z["name"] for z in r.json()]
+    assert r.headers["etag"] != first.headers["etag"]
+
+    metrics = client.get("/metrics").text
+    assert 'response_cache_hits_total{cache="zones"}' in metrics
+    assert 'response_cache_misses_total{cache="zones"}' in metrics
+
+
+def test_response_cache_evicts_by_bytes_and_skips_stale_builds():
+    from common.response_cache import ENTRY_OVERHEAD, ResponseCache
+
+    cache = ResponseCache("test-lru", ttl=60, max_bytes=3 * (100 + ENTRY_OVERHEAD))
+    for key in "abc":
+        cache.get(key, lambda: b"x" * 100)
+    cache.get("a", lambda: b"unused")  # "a" становится самым свежим
+    cache.get("d", lambda: b"y" * 100)
+    assert list(cache._entries) == ["c", "a", "d"]
+
+    # запись пришла, пока строился ответ: его результат не кешируется
+    def build_during_write():
+        cache.invalidate("e")
+        return b"old"
+
+    assert cache.get("e", build_during_write)[0] == b"old"
+    assert cache.get("e", lambda: b"new")[0] == b"new"
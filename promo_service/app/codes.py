@@ -0,0 +1,41 @@
+import secrets
+from typing import Callable, Dict, Iterable, List, Set
+
+# 32 символа без похожих 0/O и 1/I; 256 делится на 32, так что байт
+# из secrets.token_bytes отображается в символ без перекоса
+ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZ"
+PLACEHOLDER = "#"
+_TRANSLATE = bytes(ord(ALPHABET[b % len(ALPHABET)]) for b in range(256))
+
+
+def capacity(template: str) -> int:
+    """Сколько разных кодов даёт шаблон."""
+    return len(ALPHABET) ** template.count(PLACEHOLDER)
+
+
+def random_codes(template: str, count: int) -> List[str]:
+    """count случайных кодов: каждый '#' в шаблоне заменяется символом ALPHABET."""
+    slots = template.count(PLACEHOLDER)
+    fmt = template.upper().replace("{", "{{").replace("}", "}}").replace(PLACEHOLDER, "{}")
+    chars = secrets.token_bytes(count * slots).translate(_TRANSLATE).decode("ascii")
+    return [fmt.format(*chars[i:i + slots]) for i in range(0, count * slots, slots)]
+
+
+def unique_codes(
+    template: str, count: int, taken: Callable[[List[str]], Iterable[str]], attempts: int = 10
+) -> List[str]:
+    """
+    count разных кодов, которых нет среди занятых: taken(кандидаты) возвращает
+    уже существующие. Коллизии догенерируются, пока не кончатся попытки.
+    """
+    codes: Dict[str, None] = {}
+    for _ in range(attempts):
+        need = count - len(codes)
+        if not need:
+            break
+        batch = [code for code in dict.fromkeys(random_codes(template, need)) if code not in codes]
+        busy: Set[str] = set(taken(batch))
+        codes.update((code, None) for code in batch if code not in busy)
+    if len(codes) < count:
+        raise ValueError("Not enough free codes for template")
+    return list(codes)
@@ -0,0 +1,63 @@
+import heapq
+import threading
+import time
+from typing import Callable, List, Tuple
+
+
+class ExpiryHeap:
+    """Min-heap (срок, код): pop_due() за O(k log n) отдаёт коды, срок которых наступил."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, due: float, key: str) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, (due, key))
+
+    def push_many(self, due: float, keys: List[str]) -> None:
+        # пачку больше самой кучи дешевле добавить и перестроить за O(n)
+        with self._lock:
+            if len(keys) > len(self._heap):
+                self._heap.extend((due, key) for key in keys)
+                heapq.heapify(self._heap)
+            else:
+                for key in keys:
+                    heapq.heappush(self._heap, (due, key))
+
+    def pop_due(self, now: float) -> List[str]:
+        due_keys = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_keys.append(heapq.heappop(self._heap)[1])
+        return due_keys
+
+
+class Sweeper:
+    """Фоновый поток, который раз в interval секунд вызывает sweep(now)."""
+
+    def __init__(self, sweep: Callable[[float], int], interval: float):
+        self.sweep = sweep
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="promo-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sweep(time.time())
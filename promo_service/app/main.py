@@ -1,56 +1,40 @@
+import os
 import time
-from datetime import datetime, timedelta
-from typing import Dict, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
-from pydantic import BaseModel
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from fastapi import FastAPI, Header, HTTPException, Query
+from pydantic import BaseModel, Field
 
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import DuplicateKeyError, make_repository
 
-app = FastAPI(title="Promo Service")
+from . import codes as codegen
+from .expiry import ExpiryHeap, Sweeper
 
-# ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    _load_expiry_heap()
+    sweeper.start()
+    yield
+    sweeper.stop()
+
+
+app = FastAPI(title="Promo Service", lifespan=lifespan)
+
+# ====== Prometheus Metrics ======
 SERVICE_NAME = "promo_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 # ====== Модели ======
 
@@ -60,6 +44,25 @@ class PromoCreate(BaseModel):
     expires_at: Optional[datetime] = None
     min_order_amount: float = 0.0
     max_uses: int = 100
+    # сколько раз один пользователь может применить код; None – без ограничений
+    max_uses_per_user: Optional[int] = Field(default=None, ge=1)
+
+
+class PromoBulkCreate(BaseModel):
+    # каждый '#' заменяется случайным символом, например SPRING-########
+    template: str = "PROMO-########"
+    count: int = Field(ge=1, le=1_000_000)
+    discount_percent: float
+    expires_at: Optional[datetime] = None
+    min_order_amount: float = 0.0
+    # по умолчанию – одноразовые коды
+    max_uses: int = 1
+    max_uses_per_user: Optional[int] = Field(default=None, ge=1)
+
+
+class PromoBulkCreateResponse(BaseModel):
+    created: int
+    codes: List[str]
 
 
 class PromoInfo(BaseModel):
@@ -68,6 +71,7 @@ class PromoInfo(BaseModel):
     expires_at: Optional[datetime]
     min_order_amount: float
     max_uses: int
+    max_uses_per_user: Optional[int] = None
     used_count: int
 
 
@@ -85,6 +89,14 @@ class PromoValidateResponse(BaseModel):
     message: str
 
 
+class PromoValidateBatchRequest(BaseModel):
+    items: List[PromoValidateRequest] = Field(max_length=10_000)
+
+
+class PromoValidateBatchResponse(BaseModel):
+    results: List[PromoValidateResponse]
+
+
 class PromoApplyRequest(BaseModel):
     promo_code: str
     user_id: str
@@ -100,47 +112,169 @@ class PromoApplyResponse(BaseModel):
     max_usages: int
 
 
-# ====== "База" в памяти ======
-
-promocodes: Dict[str, Dict] = {}
+# ====== Хранилище ======
+
+# промокоды по коду; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти).
+# В записи кода – только его параметры и счётчик used_count: применение
+# меняет запись постоянного размера, сколько бы раз код ни применяли.
+# active – индексированный признак "не истёк и не исчерпан": список кодов
+# листает только активные, не перебирая ждущие уборки неактивные
+promocodes = make_repository("promocodes", key="code", indexed={"active": bool})
+
+# применения по Idempotency-Key: id = _pair_key(код, ключ); state pending,
+# пока запрос выполняется, затем done с результатом до expires_ts
+redemptions = make_repository("promo_redemptions", indexed=("code",))
+
+# применения одним пользователем: id = _pair_key(код, user_id), count;
+# ведутся только для кодов с max_uses_per_user
+usage = make_repository("promo_usage", indexed=("code",))
+
+# сколько хранится результат применения для повторов с тем же Idempotency-Key
+IDEMPOTENCY_TTL = float(os.getenv("PROMO_IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# сколько живёт незавершённое применение (если воркер упал посреди запроса)
+PENDING_LEASE = 30.0
+# сколько повтор ждёт завершения параллельного запроса с тем же ключом
+PENDING_WAIT = 5.0
+
+# истёкшие и исчерпанные коды убираются из promocodes фоновым потоком;
+# если задан PROMO_ARCHIVE_URL, они переносятся туда, иначе удаляются
+PROMO_ARCHIVE_URL = os.getenv("PROMO_ARCHIVE_URL")
+archive = make_repository("promocodes_archive", key="code", url=PROMO_ARCHIVE_URL) if PROMO_ARCHIVE_URL else None
+
+# сколько секунд неактивный код ещё хранится (чтобы validate/apply и повторы
+# по Idempotency-Key отвечали "истёк"/"лимит", а не "не найден")
+SWEEP_GRACE = float(os.getenv("PROMO_SWEEP_GRACE_SECONDS", "3600"))
+SWEEP_INTERVAL = float(os.getenv("PROMO_SWEEP_INTERVAL_SECONDS", "5"))
+
+# (срок, код) – по времени ближайший сверху, без перебора всех кодов: в срок
+# код снимается с active, через SWEEP_GRACE после него – удаляется
+expiry_heap = ExpiryHeap()
+# (expires_ts, id применения) – сроки хранения результатов по Idempotency-Key
+redemption_heap = ExpiryHeap()
+
+
+def _pair_key(code: str, part: str) -> str:
+    # длина кода в начале – пары ("A:B", "C") и ("A", "B:C") не совпадут
+    return f"{len(code)}:{code}:{part}"
+
+
+def _to_epoch(value: datetime) -> float:
+    """Время без таймзоны считаем UTC."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _is_expired(promo: Dict, now: float) -> bool:
+    return promo["expires_ts"] <= now
+
+
+def _is_exhausted(promo: Dict) -> bool:
+    return promo["used_count"] >= promo["max_uses"]
+
+
+def _is_active(promo: Dict, now: float) -> bool:
+    return not (_is_expired(promo, now) or _is_exhausted(promo))
+
+
+def _schedule(promo: Dict) -> None:
+    expiry_heap.push(promo["expires_ts"], promo["code"])
+
+
+def _load_expiry_heap() -> None:
+    # при общем хранилище коды могли создать другие воркеры
+    now = time.time()
+    for promo in promocodes.all():
+        if promo.get("active") is None:
+            # код из хранилища, где ещё не было признака active
+            promocodes.update(promo["code"], active=_is_active(promo, now))
+        _schedule(promo)
+        if _is_exhausted(promo):
+            expiry_heap.push(now + SWEEP_GRACE, promo["code"])
+    for redemption in redemptions.all():
+        redemption_heap.push(redemption["expires_ts"], redemption["id"])
+
+
+def sweep_promocodes(now: Optional[float] = None) -> int:
+    """Убирает коды, срок удаления которых наступил; возвращает их число."""
+    now = time.time() if now is None else now
+    removed = 0
+    for code in expiry_heap.pop_due(now):
+        promo = promocodes.get(code)
+        # код могли уже убрать (две записи в куче) или продлить
+        if promo is None:
+            continue
+        if _is_expired(promo, now) and not _is_expired(promo, now - SWEEP_GRACE):
+            # истёк недавно: из списка активных – сейчас, из хранилища – после SWEEP_GRACE
+            if promo["active"]:
+                promocodes.update(code, active=False)
+            expiry_heap.push(promo["expires_ts"] + SWEEP_GRACE, code)
+            continue
+        if not (_is_expired(promo, now - SWEEP_GRACE) or _is_exhausted(promo)):
+            continue
+        if archive is not None and code not in archive:
+            archive.add(promo)
+        if promocodes.delete(code):
+            removed += 1
+        for repo in (usage, redemptions):
+            for row in repo.find(code=code):
+                repo.delete(row["id"])
+    for redemption_id in redemption_heap.pop_due(now):
+        redemption = redemptions.get(redemption_id)
+        # срок могли продлить: pending -> done
+        if redemption is not None and redemption["expires_ts"] <= now:
+            redemptions.delete(redemption_id)
+    return removed
+
+
+sweeper = Sweeper(sweep_promocodes, SWEEP_INTERVAL)
+
+# ёмкость шаблона должна превышать размер пачки хотя бы во столько раз
+BULK_CAPACITY_FACTOR = 1000
+BULK_ATTEMPTS = 3
 
 
 def _calculate_discount(promo: Dict, order_amount: float) -> float:
     return round(order_amount * promo["discount_percent"] / 100.0, 2)
 
 
-# ====== Эндпоинты ======
-
-@app.post("/api/promocodes", response_model=PromoInfo)
-def create_promocode(payload: PromoCreate):
-    """
-    Создание промокода (условно админская операция).
-    Если expires_at не задан, сделаем по дефолту +30 дней.
-    """
-    code = payload.code.upper()
-    if code in promocodes:
-        raise HTTPException(status_code=400, detail="Promo code already exists")
+def _expires_ts(expires_at: Optional[datetime]) -> float:
+    if expires_at is not None:
+        return _to_epoch(expires_at)
+    return time.time() + timedelta(days=30).total_seconds()
 
-    expires_at = payload.expires_at or (datetime.utcnow() + timedelta(days=30))
 
-    promo = {
+def _new_promo(code: str, payload, expires_ts: float) -> Dict:
+    """Запись промокода; payload – PromoCreate или PromoBulkCreate."""
+    return {
         "code": code,
         "discount_percent": payload.discount_percent,
-        "expires_at": expires_at,
+        # срок в UTC: epoch для проверок, дата без таймзоны для ответа
+        "expires_ts": expires_ts,
+        "expires_at": datetime.fromtimestamp(expires_ts, timezone.utc).replace(tzinfo=None),
         "min_order_amount": payload.min_order_amount,
         "max_uses": payload.max_uses,
+        "max_uses_per_user": payload.max_uses_per_user,
         "used_count": 0,
+        "active": expires_ts > time.time() and payload.max_uses > 0,
     }
-    promocodes[code] = promo
-    return PromoInfo(**promo)
 
 
-@app.post("/api/promocodes/validate", response_model=PromoValidateResponse)
-def validate_promocode(payload: PromoValidateRequest):
-    code = payload.promo_code.upper()
-    order_amount = payload.order_amount
+def _user_limit_reached(promo: Dict, user_uses: int) -> bool:
+    limit = promo.get("max_uses_per_user")
+    return limit is not None and user_uses >= limit
 
-    promo = promocodes.get(code)
+
+def _user_uses(codes_and_users: List[Tuple[str, str]]) -> Dict[str, int]:
+    """Число применений по _pair_key(код, user_id) одним get_many."""
+    keys = dict.fromkeys(_pair_key(code, user_id) for code, user_id in codes_and_users)
+    return {row["id"]: row["count"] for row in usage.get_many(keys)}
+
+
+def _validate(
+    promo: Optional[Dict], code: str, user_id: str, order_amount: float, now: float, user_uses: int = 0
+) -> PromoValidateResponse:
+    """Правила проверки промокода – общие для /validate и /validate/batch."""
     if not promo:
         return PromoValidateResponse(
             valid=False,
@@ -150,25 +284,16 @@ def validate_promocode(payload: PromoValidateRequest):
             message="Промокод не найден",
         )
 
-    # --- фикс с датами ---
-    now = datetime.utcnow()
-    expires_at = promo["expires_at"]
-    if expires_at is not None:
-        # если дата с таймзоной – отбрасываем tzinfo, сравниваем как "наивные"
-        if expires_at.tzinfo is not None:
-            expires_at = expires_at.replace(tzinfo=None)
-
-        if expires_at < now:
-            return PromoValidateResponse(
-                valid=False,
-                promo_code=code,
-                discount_amount=0.0,
-                discount_percent=promo["discount_percent"],
-                message="Промокод истёк",
-            )
-    # ----------------------
+    if _is_expired(promo, now):
+        return PromoValidateResponse(
+            valid=False,
+            promo_code=code,
+            discount_amount=0.0,
+            discount_percent=promo["discount_percent"],
+            message="Промокод истёк",
+        )
 
-    if promo["used_count"] >= promo["max_uses"]:
+    if _is_exhausted(promo):
         return PromoValidateResponse(
             valid=False,
             promo_code=code,
@@ -177,6 +302,15 @@ def validate_promocode(payload: PromoValidateRequest):
             message="Достигнут лимит использований",
         )
 
+    if _user_limit_reached(promo, user_uses):
+        return PromoValidateResponse(
+            valid=False,
+            promo_code=code,
+            discount_amount=0.0,
+            discount_percent=promo["discount_percent"],
+            message="Достигнут лимит использований для пользователя",
+        )
+
     if order_amount < promo["min_order_amount"]:
         return PromoValidateResponse(
             valid=False,
@@ -197,44 +331,252 @@ def validate_promocode(payload: PromoValidateRequest):
     )
 
 
+# ====== Эндпоинты ======
 
-@app.post("/api/promocodes/apply", response_model=PromoApplyResponse)
-def apply_promocode(payload: PromoApplyRequest):
-    code = payload.promo_code.upper()
-    order_amount = payload.order_amount
+@app.post("/api/promocodes", response_model=PromoInfo)
+def create_promocode(payload: PromoCreate):
+    """
+    Создание промокода (условно админская операция).
+    Если expires_at не задан, сделаем по дефолту +30 дней.
+    """
+    code = payload.code.upper()
+    promo = _new_promo(code, payload, _expires_ts(payload.expires_at))
+    try:
+        promocodes.add(promo)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Promo code already exists")
+    _schedule(promo)
+    return PromoInfo(**promo)
 
-    promo = promocodes.get(code)
+
+@app.post("/api/promocodes/bulk", response_model=PromoBulkCreateResponse)
+def create_promocodes_bulk(payload: PromoBulkCreate):
+    """
+    Выпуск count случайных кодов по шаблону с общими параметрами кампании.
+    Коды добавляются одной пачкой: либо все, либо ни одного.
+    """
+    # запас ёмкости, чтобы коллизии были редки, а коды – не угадывались перебором
+    if codegen.capacity(payload.template) < payload.count * BULK_CAPACITY_FACTOR:
+        raise HTTPException(status_code=400, detail="Template has too few '#' placeholders for this count")
+
+    expires_ts = _expires_ts(payload.expires_at)
+    # общие поля кампании считаются один раз, а не на каждый код
+    base = _new_promo("", payload, expires_ts)
+    for _ in range(BULK_ATTEMPTS):
+        try:
+            new_codes = codegen.unique_codes(
+                payload.template, payload.count, lambda batch: promocodes.existing("code", batch)
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        try:
+            promocodes.add_many([{**base, "code": code} for code in new_codes])
+            break
+        except DuplicateKeyError:
+            # кто-то занял код между проверкой и вставкой – выпускаем пачку заново
+            continue
+    else:
+        raise HTTPException(status_code=409, detail="Could not allocate unique promo codes")
+
+    expiry_heap.push_many(expires_ts + SWEEP_GRACE, new_codes)
+    return PromoBulkCreateResponse(created=len(new_codes), codes=new_codes)
+
+
+@app.get("/api/promocodes", response_model=List[PromoInfo])
+def list_promocodes(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    """
+    Активные промокоды постранично: offset и limit считаются по индексу
+    active, истёкшие/исчерпанные коды, ждущие уборки, в него не входят.
+    Код, истёкший после последнего прохода уборщика (не дольше
+    SWEEP_INTERVAL), ещё числится активным: в страницу он не попадает,
+    и она добирается следующими.
+    """
+    now = time.time()
+    page: List[PromoInfo] = []
+    position = offset
+    while len(page) < limit:
+        want = limit - len(page)
+        batch = promocodes.find(active=True, offset=position, limit=want)
+        position += len(batch)
+        page.extend(PromoInfo(**promo) for promo in batch if not _is_expired(promo, now))
+        if len(batch) < want:
+            break
+    return page
+
+
+@app.get("/api/promocodes/{code}", response_model=PromoInfo)
+def get_promocode(code: str):
+    promo = promocodes.get(code.upper())
     if not promo:
         raise HTTPException(status_code=404, detail="Promo code not found")
+    return PromoInfo(**promo)
 
-    now = datetime.utcnow()
-    expires_at = promo["expires_at"]
-    if expires_at is not None:
-        if expires_at.tzinfo is not None:
-            expires_at = expires_at.replace(tzinfo=None)
 
-        if expires_at < now:
-            raise HTTPException(status_code=400, detail="Promo code expired")
+@app.post("/api/promocodes/validate", response_model=PromoValidateResponse)
+def validate_promocode(payload: PromoValidateRequest):
+    code = payload.promo_code.upper()
+    promo = promocodes.get(code)
+    user_uses = 0
+    if promo is not None and promo.get("max_uses_per_user") is not None:
+        user_uses = _user_uses([(code, payload.user_id)]).get(_pair_key(code, payload.user_id), 0)
+    return _validate(promo, code, payload.user_id, payload.order_amount, time.time(), user_uses)
 
-    if promo["used_count"] >= promo["max_uses"]:
-        raise HTTPException(status_code=400, detail="Promo code usage limit reached")
 
-    if order_amount < promo["min_order_amount"]:
-        raise HTTPException(
-            status_code=400,
-            detail="Order amount is less than minimal for this promo code",
+@app.post("/api/promocodes/validate/batch", response_model=PromoValidateBatchResponse)
+def validate_promocodes_batch(payload: PromoValidateBatchRequest):
+    """
+    Проверка многих (код, пользователь, сумма) для предпросмотра корзины:
+    те же правила, что у /validate, но все коды читаются одним get_many.
+    Каждая строка проверяется независимо, применения не резервируются.
+    """
+    codes = [item.promo_code.upper() for item in payload.items]
+    found = {promo["code"]: promo for promo in promocodes.get_many(dict.fromkeys(codes))}
+    uses = _user_uses([
+        (code, item.user_id)
+        for code, item in zip(codes, payload.items)
+        if code in found and found[code].get("max_uses_per_user") is not None
+    ])
+    now = time.time()
+    return PromoValidateBatchResponse(results=[
+        _validate(
+            found.get(code), code, item.user_id, item.order_amount, now, uses.get(_pair_key(code, item.user_id), 0)
         )
+        for code, item in zip(codes, payload.items)
+    ])
 
-    discount = _calculate_discount(promo, order_amount)
-    final_amount = round(order_amount - discount, 2)
 
-    promo["used_count"] += 1
+def _claim_redemption(redemption_id: str, code: str, payload: PromoApplyRequest) -> Optional[Dict]:
+    """
+    Занимает Idempotency-Key под этот запрос (None) или возвращает результат
+    прежнего запроса с тем же ключом. Пока тот ещё выполняется, повтор ждёт.
+    """
+    deadline = time.monotonic() + PENDING_WAIT
+    while True:
+        now = time.time()
+        previous = redemptions.get(redemption_id)
+        if previous is not None and previous["expires_ts"] <= now:
+            redemptions.delete(redemption_id)
+            previous = None
+        if previous is None:
+            try:
+                redemptions.add({
+                    "id": redemption_id, "code": code, "state": "pending",
+                    "user_id": payload.user_id, "order_amount": payload.order_amount,
+                    "expires_ts": now + PENDING_LEASE,
+                })
+                redemption_heap.push(now + PENDING_LEASE, redemption_id)
+                return None
+            except DuplicateKeyError:
+                continue  # ключ только что занял параллельный запрос
+        if previous["user_id"] != payload.user_id or previous["order_amount"] != payload.order_amount:
+            raise HTTPException(status_code=409, detail="Idempotency key was already used for another request")
+        if previous["state"] == "done":
+            return previous["result"]
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=409, detail="Request with this Idempotency key is still in progress")
+        time.sleep(0.01)
+
+
+def _take_user_use(code: str, user_id: str, limit: int) -> str:
+    """Атомарно увеличивает счётчик применений пользователя; 400 – лимит исчерпан."""
+    key = _pair_key(code, user_id)
+
+    def take(row: Dict) -> Dict:
+        if row["count"] >= limit:
+            raise HTTPException(status_code=400, detail="Promo code usage limit per user reached")
+        return {"count": row["count"] + 1}
+
+    if usage.modify(key, take) is None:
+        try:
+            usage.add({"id": key, "code": code, "user_id": user_id, "count": 0})
+        except DuplicateKeyError:
+            pass  # первую запись создал параллельный запрос
+        usage.modify(key, take)
+    return key
+
+
+def _release_user_use(key: str) -> None:
+    usage.modify(key, lambda row: {"count": max(0, row["count"] - 1)})
+
+
+def _redeem(code: str, payload: PromoApplyRequest) -> Dict:
+    """Проверки и списание; возвращает результат применения или бросает HTTPException."""
+    order_amount = payload.order_amount
 
-    return PromoApplyResponse(
-        status="applied",
-        promo_code=code,
-        discount_applied=discount,
-        final_amount=final_amount,
-        usage_count=promo["used_count"],
-        max_usages=promo["max_uses"],
-    )
+    def check(promo: Dict) -> None:
+        if _is_expired(promo, time.time()):
+            raise HTTPException(status_code=400, detail="Promo code expired")
+        if _is_exhausted(promo):
+            raise HTTPException(status_code=400, detail="Promo code usage limit reached")
+        if order_amount < promo["min_order_amount"]:
+            raise HTTPException(
+                status_code=400,
+                detail="Order amount is less than minimal for this promo code",
+            )
+
+    promo = promocodes.get(code)
+    if promo is None:
+        raise HTTPException(status_code=404, detail="Promo code not found")
+    # быстрый отказ до счётчика пользователя; окончательно – под замком кода
+    check(promo)
+
+    user_key = None
+    if promo["max_uses_per_user"] is not None:
+        user_key = _take_user_use(code, payload.user_id, promo["max_uses_per_user"])
+
+    result: Dict = {}
+
+    def redeem(promo: Dict) -> Dict:
+        check(promo)
+        discount = _calculate_discount(promo, order_amount)
+        result.update(
+            discount_applied=discount,
+            final_amount=round(order_amount - discount, 2),
+            usage_count=promo["used_count"] + 1,
+            max_usages=promo["max_uses"],
+        )
+        used_count = promo["used_count"] + 1
+        return {"used_count": used_count, "active": used_count < promo["max_uses"]}
+
+    try:
+        promo = promocodes.modify(code, redeem)
+        if promo is None:
+            raise HTTPException(status_code=404, detail="Promo code not found")
+    except BaseException:
+        if user_key is not None:
+            _release_user_use(user_key)
+        raise
+    if _is_exhausted(promo):
+        expiry_heap.push(time.time() + SWEEP_GRACE, code)
+    return result
+
+
+@app.post("/api/promocodes/apply", response_model=PromoApplyResponse)
+def apply_promocode(payload: PromoApplyRequest, idempotency_key: Optional[str] = Header(None)):
+    """
+    Применение промокода. used_count увеличивается атомарным изменением
+    записи кода (под замком кода, в БД – в одной транзакции), счётчик
+    пользователя – своей записью в usage; если списание не удалось, он
+    возвращается. Параллельные запросы не превышают max_uses и max_uses_per_user.
+    Повтор запроса с тем же заголовком Idempotency-Key в течение
+    PROMO_IDEMPOTENCY_TTL_SECONDS возвращает прежний результат и не
+    списывает промокод второй раз.
+    """
+    code = payload.promo_code.upper()
+    redemption_id = _pair_key(code, idempotency_key) if idempotency_key is not None else None
+
+    result = _claim_redemption(redemption_id, code, payload) if redemption_id is not None else None
+    if result is None:
+        try:
+            result = _redeem(code, payload)
+        except BaseException:
+            # отказ не запоминается: повтор проверит код заново
+            if redemption_id is not None:
+                redemptions.delete(redemption_id)
+            raise
+        if redemption_id is not None:
+            expires_ts = time.time() + IDEMPOTENCY_TTL
+            redemptions.update(redemption_id, state="done", result=result, expires_ts=expires_ts)
+            redemption_heap.push(expires_ts, redemption_id)
+
+    return PromoApplyResponse(status="applied", promo_code=code, **result)
@@ -3,8 +3,12 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # promo_service/tests/test_promo.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from fastapi.testclient import TestClient
-from app.main import app
+from app import main
+from app.main import app, promocodes, redemptions, usage
 
 client = TestClient(app)
 
@@ -50,3 +54,125 @@ def test_create_validate_and_apply_promo():
     assert a["status"] == "applied"
     assert a["discount_applied"] == 20.0
     assert a["final_amount"] == 180.0
+
+
+def test_parallel_applies_respect_limits_and_idempotency():
+    r = client.post("/api/promocodes", json={
+        "code": "RUSH100",
+        "discount_percent": 15,
+        "max_uses": 100,
+        "max_uses_per_user": 2,
+    })
+    assert r.status_code == 200
+
+    # 2000 одновременных применений от 300 пользователей; каждый запрос
+    # отправляется дважды с одним Idempotency-Key, как при ретраях клиента
+    requests = [(f"user-{i % 300}", f"key-{i}") for i in range(1000)] * 2
+
+    def apply(args):
+        user_id, key = args
+        return shared_client.post(
+            "/api/promocodes/apply",
+            json={"promo_code": "rush100", "user_id": user_id, "order_amount": 1000.0},
+            headers={"Idempotency-Key": key},
+        )
+
+    # общий event loop на все запросы вместо нового на каждый вызов
+    with TestClient(app) as shared_client, ThreadPoolExecutor(max_workers=64) as pool:
+        responses = list(pool.map(apply, requests))
+
+    assert {r.status_code for r in responses} <= {200, 400}
+    applied = [r.json() for r in responses if r.status_code == 200]
+    # 100 списаний и 100 повторов с тем же ключом, получивших тот же ответ
+    assert len(applied) == 200
+    assert sorted(a["usage_count"] for a in applied) == sorted(list(range(1, 101)) * 2)
+
+    promo = promocodes.get("RUSH100")
+    assert promo["used_count"] == 100
+    # счётчики пользователей и результаты – отдельными записями, не в коде
+    assert "used_by" not in promo and "redemptions" not in promo
+    per_user = [row["count"] for row in usage.find(code="RUSH100")]
+    assert sum(per_user) == 100
+    assert max(per_user) <= 2
+    done = [row for row in redemptions.find(code="RUSH100") if row["state"] == "done"]
+    assert len(done) == 100
+
+    # тот же ключ с другим запросом – конфликт
+    key = done[0]["id"].rsplit(":", 1)[1]
+    r = client.post(
+        "/api/promocodes/apply",
+        json={"promo_code": "RUSH100", "user_id": "someone-else", "order_amount": 1000.0},
+        headers={"Idempotency-Key": key},
+    )
+    assert r.status_code == 409
+
+
+def test_expired_and_exhausted_codes_are_swept():
+    r = client.post("/api/promocodes", json={
+        "code": "TZCODE", "discount_percent": 5, "expires_at": "2030-01-01T03:00:00+03:00",
+    })
+    # срок хранится в UTC
+    assert r.json()["expires_at"] == "2030-01-01T00:00:00"
+
+    client.post("/api/promocodes", json={
+        "code": "OLD", "discount_percent": 5, "expires_at": "2020-01-01T00:00:00",
+    })
+    client.post("/api/promocodes", json={"code": "ONCE", "discount_percent": 5, "max_uses": 1})
+    client.post("/api/promocodes/apply", json={"promo_code": "ONCE", "user_id": "u1", "order_amount": 100.0})
+
+    r = client.post("/api/promocodes/validate", json={"promo_code": "OLD", "user_id": "u1", "order_amount": 100.0})
+    assert r.json()["message"] == "Промокод истёк"
+
+    active = {p["code"] for p in client.get("/api/promocodes", params={"limit": 1000}).json()}
+    assert "TZCODE" in active
+    assert not active & {"OLD", "ONCE"}
+    # страницы считаются по активным кодам: неактивные не дают пустых страниц
+    pages = [client.get("/api/promocodes", params={"offset": i, "limit": 1}).json() for i in range(len(active))]
+    assert all(len(page) == 1 for page in pages)
+    assert {page[0]["code"] for page in pages} == active
+    # исчерпанный и истёкший коды ждут уборки вне индекса активных
+    assert promocodes.get("ONCE")["active"] is False and promocodes.get("OLD")["active"] is False
+
+    # код истёк после создания: уборщик в срок снимает его с active, но хранит SWEEP_GRACE
+    soon = time.time() + 60
+    client.post("/api/promocodes", json={
+        "code": "SOON", "discount_percent": 5, "expires_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(soon)),
+    })
+    assert promocodes.get("SOON")["active"] is True
+    main.sweep_promocodes(soon + 1)
+    assert promocodes.get("SOON")["active"] is False
+    assert "SOON" not in {p["code"] for p in client.get("/api/promocodes", params={"limit": 1000}).json()}
+
+    # после льготного периода уборщик удаляет неактивные коды
+    assert main.sweep_promocodes(soon + main.SWEEP_GRACE + 1) >= 2
+    assert "OLD" not in promocodes and "ONCE" not in promocodes and "SOON" not in promocodes
+    assert "TZCODE" in promocodes
+
+
+def test_bulk_generation_and_batch_validation():
+    r = client.post("/api/promocodes/bulk", json={
+        "template": "spring-######", "count": 500, "discount_percent": 20, "min_order_amount": 300.0,
+    })
+    assert r.status_code == 200
+    codes = r.json()["codes"]
+    assert r.json()["created"] == 500 and len(set(codes)) == 500
+    assert all(code.startswith("SPRING-") and len(code) == 13 for code in codes)
+    assert promocodes.get(codes[0])["max_uses"] == 1
+
+    # шаблону не хватает '#' на такую пачку
+    r = client.post("/api/promocodes/bulk", json={"template": "X#", "count": 10, "discount_percent": 5})
+    assert r.status_code == 400
+
+    client.post("/api/promocodes/apply", json={"promo_code": codes[1], "user_id": "u1", "order_amount": 500.0})
+    items = [
+        {"promo_code": codes[0].lower(), "user_id": "u1", "order_amount": 500.0},
+        {"promo_code": codes[0], "user_id": "u2", "order_amount": 100.0},
+        {"promo_code": codes[1], "user_id": "u1", "order_amount": 500.0},
+        {"promo_code": "NOPE", "user_id": "u1", "order_amount": 500.0},
+    ]
+    r = client.post("/api/promocodes/validate/batch", json={"items": items})
+    results = r.json()["results"]
+    # те же ответы, что у одиночной проверки
+    assert results == [client.post("/api/promocodes/validate", json=item).json() for item in items]
+    assert [res["valid"] for res in results] == [True, False, False, False]
+    assert results[0]["discount_amount"] == 100.0
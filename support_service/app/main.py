@@ -1,55 +1,26 @@
-import time
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response
+from fastapi import Depends, FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import Dict, List, Optional
+from typing import List, Optional
 from uuid import uuid4
 from datetime import datetime
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import make_repository
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
 
 app = FastAPI(title="Support Service")
 
 # ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
-
 SERVICE_NAME = "support_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 
 class TicketStatus(str):
@@ -77,11 +48,13 @@ class TicketOut(BaseModel):
     created_at: datetime
 
 
-tickets: Dict[str, Dict] = {}
+# обращения по id; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти)
+tickets = make_repository("tickets", indexed=("user_id", "status"))
 
 
 @app.post("/api/support/tickets", response_model=TicketOut)
-def create_ticket(payload: TicketCreate):
+def create_ticket(payload: TicketCreate, claims: Optional[TokenClaims] = Depends(authenticate)):
+    ensure_subject(claims, payload.user_id)
     ticket_id = str(uuid4())
     ticket = {
         "id": ticket_id,
@@ -91,32 +64,52 @@ def create_ticket(payload: TicketCreate):
         "status": TicketStatus.OPEN,
         "created_at": datetime.utcnow(),
     }
-    tickets[ticket_id] = ticket
+    tickets.add(ticket)
     return TicketOut(**ticket)
 
 
+def _owned(ticket: Optional[dict], claims: Optional[TokenClaims]) -> bool:
+    # чужое обращение – как несуществующее
+    owner_id = token_owner(claims)
+    return ticket is not None and (owner_id is None or ticket["user_id"] == owner_id)
+
+
 @app.get("/api/support/tickets/{ticket_id}", response_model=TicketOut)
-def get_ticket(ticket_id: str):
+def get_ticket(ticket_id: str, claims: Optional[TokenClaims] = Depends(authenticate)):
     ticket = tickets.get(ticket_id)
-    if not ticket:
+    if not _owned(ticket, claims):
         raise HTTPException(status_code=404, detail="Ticket not found")
     return TicketOut(**ticket)
 
 
 @app.get("/api/support/tickets", response_model=List[TicketOut])
-def list_tickets(user_id: Optional[str] = None, status: Optional[str] = None):
-    result = list(tickets.values())
+def list_tickets(
+    user_id: Optional[str] = None,
+    status: Optional[str] = None,
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    user_id = ensure_subject(claims, user_id)
+    filters = {}
     if user_id:
-        result = [t for t in result if t["user_id"] == user_id]
+        filters["user_id"] = user_id
     if status:
-        result = [t for t in result if t["status"] == status]
+        filters["status"] = status
+    result = tickets.find(**filters)
     return [TicketOut(**t) for t in result]
 
 
 @app.patch("/api/support/tickets/{ticket_id}/status", response_model=TicketOut)
-def update_ticket_status(ticket_id: str, payload: TicketUpdateStatus):
-    ticket = tickets.get(ticket_id)
+def update_ticket_status(
+    ticket_id: str,
+    payload: TicketUpdateStatus,
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    def change(ticket: dict) -> dict:
+        if not _owned(ticket, claims):
+            raise HTTPException(status_code=404, detail="Ticket not found")
+        return {"status": payload.status}
+
+    ticket = tickets.modify(ticket_id, change)
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
-    ticket["status"] = payload.status
     return TicketOut(**ticket)
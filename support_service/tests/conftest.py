@@ -6,6 +6,11 @@ service_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if service_path not in sys.path:
     sys.path.insert(0, service_path)
 
+# Корень репозитория – для общего пакета common
+repo_root = os.path.dirname(service_path)
+if repo_root not in sys.path:
+    sys.path.append(repo_root)
+
 # Удаляем закэшированные модули app, чтобы избежать конфликтов
 modules_to_remove = [key for key in sys.modules.keys() if key == 'app' or key.startswith('app.')]
 for mod in modules_to_remove:
@@ -40,3 +40,22 @@ def test_create_update_and_list_tickets():
     assert r3.status_code == 200
     data3 = r3.json()
     assert any(t["id"] == ticket_id for t in data3)
+
+
+def test_token_only_reaches_its_own_tickets(monkeypatch):
+    from common import tokens
+
+    monkeypatch.setattr(tokens, "AUTH_REQUIRED", True)
+    owner = {"Authorization": f"Bearer {tokens.issue_token('user-support-owner')}"}
+    other = {"Authorization": f"Bearer {tokens.issue_token('user-support-other')}"}
+    ticket_id = client.post("/api/support/tickets", json={
+        "user_id": "user-support-owner", "subject": "Вопрос", "message": "Текст",
+    }, headers=owner).json()["id"]
+
+    # без user_id – только свои обращения, чужое по id – 404 и не меняется
+    assert client.get("/api/support/tickets", headers=other).json() == []
+    assert client.get(f"/api/support/tickets/{ticket_id}", headers=other).status_code == 404
+    r = client.patch(f"/api/support/tickets/{ticket_id}/status", json={"status": "closed"}, headers=other)
+    assert r.status_code == 404
+    assert client.get(f"/api/support/tickets/{ticket_id}", headers=owner).json()["status"] == "open"
+    assert [t["id"] for t in client.get("/api/support/tickets", headers=owner).json()] == [ticket_id]
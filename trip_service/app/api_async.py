@@ -0,0 +1,70 @@
+"""
+Эндпоинты поездок поверх AsyncSession – подключаются в main.py
+вместо sync-роутера, когда DB_ASYNC=1.
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
+
+from . import crud, crud_async, database, schemas
+
+router = APIRouter()
+
+
+@router.post("/api/trips/start", response_model=schemas.TripOut)
+async def start_trip(
+    payload: schemas.TripStart,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    ensure_subject(claims, payload.user_id)
+    return await crud_async.start_trip(db, payload)
+
+
+@router.post("/api/trips/{trip_id}/finish", response_model=schemas.TripOut)
+async def finish_trip(
+    trip_id: str,
+    payload: schemas.TripFinish,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    trip = await crud_async.finish_trip(db, trip_id, payload, token_owner(claims))
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return trip
+
+
+@router.get("/api/trips/{trip_id}", response_model=schemas.TripOut)
+async def get_trip(
+    trip_id: str,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    trip = await crud_async.get_trip(db, trip_id, token_owner(claims))
+    if not trip:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return trip
+
+
+@router.get("/api/trips", response_model=schemas.TripList)
+async def list_trips(
+    user_id: Optional[str] = None,
+    status: Optional[schemas.TripStatus] = None,
+    offset: int = 0,
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = True,
+    db: AsyncSession = Depends(database.get_async_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    user_id = ensure_subject(claims, user_id)
+    try:
+        total, items = await crud_async.list_trips(db, user_id, status, offset, limit, cursor, with_total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    next_cursor = crud.encode_cursor(items[-1]) if len(items) == limit else None
+    return schemas.TripList(total=total, items=items, next_cursor=next_cursor)
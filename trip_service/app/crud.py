@@ -1,9 +1,14 @@
+import base64
+from sqlalchemy import select, tuple_, update
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timezone
 
-from . import models, schemas
+from common import tracing
 
+from . import models, promo_client, schemas, tariffs, telemetry
 
+
+@tracing.traced
 def start_trip(db: Session, payload: schemas.TripStart) -> models.Trip:
     trip = models.Trip(
         booking_id=payload.booking_id,
@@ -11,58 +16,253 @@ def start_trip(db: Session, payload: schemas.TripStart) -> models.Trip:
         car_id=payload.car_id,
         status=models.TripStatus.in_progress,
     )
+    # server_default (started_at) возвращается тем же INSERT ... RETURNING,
+    # а expire_on_commit=False избавляет от refresh после commit
     db.add(trip)
     db.commit()
-    db.refresh(trip)
     return trip
 
 
+def amounts(ride_amount: float, parking_fines: float, discount_percent: float) -> dict:
+    """Суммы поездки: скидка по промокоду – только на поездку, не на штрафы."""
+    base = round(ride_amount + parking_fines, 2)
+    discount = round(ride_amount * discount_percent / 100.0, 2)
+    return {"base_amount": base, "discount_amount": discount, "final_amount": round(base - discount, 2)}
+
+
+def track_distance(trip_id: str) -> float | None:
+    """Пробег по записанному GPS-треку; None, если точек меньше двух."""
+    track = telemetry.buffer.track(trip_id)
+    if len(track) < 2:
+        return None
+    return round(telemetry.track_distance_km(track), 3)
+
+
+def _utc_naive(value: datetime) -> datetime:
+    # started_at из БД: naive UTC в SQLite, с таймзоной в PostgreSQL
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+@tracing.traced
+def finish_values(payload: schemas.TripFinish, trip: models.Trip) -> dict:
+    """
+    Пробег, время и суммы завершённой поездки по текущей таблице тарифов.
+    Если по поездке есть телеметрия, пробег считается по треку, а
+    distance_km из запроса используется только без неё. Суточный
+    коэффициент – по сохранённому началу поездки.
+    """
+    distance_km = payload.distance_km
+    tracked_km = track_distance(trip.id)
+    if tracked_km is not None:
+        distance_km = tracked_km
+
+    table = tariffs.store.current()
+    finished_at = datetime.utcnow()
+    started_at = _utc_naive(trip.started_at)
+    ride = table.ride_amount(distance_km, payload.duration_minutes, started_at, payload.zone, payload.car_class)
+    discount_percent = 0.0
+    if payload.promo_code:
+        discount_percent = promo_client.client.redeem(payload.promo_code, trip.user_id, ride, finished_at, trip.id)
+
+    return {
+        "finished_at": finished_at,
+        "distance_km": distance_km,
+        "duration_minutes": payload.duration_minutes,
+        "zone": payload.zone,
+        "car_class": payload.car_class,
+        "parking_fines": payload.parking_fines,
+        "promo_code": payload.promo_code,
+        "discount_percent": discount_percent,
+        "tariff_version": table.version,
+        **amounts(ride, payload.parking_fines, discount_percent),
+        "status": models.TripStatus.finished,
+    }
+
+
+def finish_trip_statement(trip: models.Trip, payload: schemas.TripFinish):
+    return (
+        update(models.Trip)
+        .where(models.Trip.id == trip.id)
+        .values(**finish_values(payload, trip))
+        .returning(models.Trip)
+    )
+
+
+@tracing.traced
 def finish_trip(
     db: Session,
     trip_id: str,
     payload: schemas.TripFinish,
+    owner_id: str | None = None,
 ) -> models.Trip | None:
-    trip = db.query(models.Trip).filter(models.Trip.id == trip_id).first()
-    if not trip:
+    """
+    Два запроса: чтение поездки и UPDATE ... RETURNING. Между ними читающая
+    транзакция закрывается, так что трек и списание промокода (HTTP-запрос
+    в promo_service) идут без соединения из пула и без открытой транзакции.
+    """
+    # несуществующая (или чужая) поездка – 404 без чтения трека и списания промокода
+    trip = get_trip(db, trip_id, owner_id)
+    if trip is None:
         return None
+    # expire_on_commit=False: trip остаётся загруженным, соединение уходит в пул
+    db.commit()
+    stmt = finish_trip_statement(trip, payload)
+    trip = db.scalars(stmt).one_or_none()
+    db.commit()
+    telemetry.active_trips.discard(trip_id)
+    return trip
 
-    trip.finished_at = datetime.utcnow()
-    trip.distance_km = payload.distance_km
-    trip.duration_minutes = payload.duration_minutes
 
-    # простая формула тарифа: 10 руб/км + 5 руб/мин
-    base = payload.distance_km * 10 + payload.duration_minutes * 5 + payload.parking_fines
-    discount = 0.0
-    if payload.promo_code:
-        discount = base * 0.1  # 10%
+def trip_accepts_telemetry(db: Session, trip_id: str, owner_id: str | None = None) -> bool | None:
+    """
+    True – поездка идёт, False – уже не идёт, None – такой поездки нет
+    (или она не пользователя owner_id).
+    """
+    user_id = telemetry.active_trips.owner(trip_id)
+    if user_id is None:
+        row = db.execute(select(models.Trip.status, models.Trip.user_id).where(models.Trip.id == trip_id)).first()
+        if row is None:
+            return None
+        status, user_id = row
+    else:
+        status = models.TripStatus.in_progress
+    if owner_id is not None and user_id != owner_id:
+        return None
+    if status != models.TripStatus.in_progress:
+        return False
+    telemetry.active_trips.add(trip_id, user_id)
+    return True
 
-    trip.base_amount = base
-    trip.discount_amount = discount
-    trip.final_amount = base - discount
-    trip.status = models.TripStatus.finished
 
-    db.commit()
-    db.refresh(trip)
+def owned(trip: models.Trip | None, owner_id: str | None) -> models.Trip | None:
+    """Поездка, если она пользователя owner_id (None – без проверки); чужая – как несуществующая."""
+    if trip is None or (owner_id is not None and trip.user_id != owner_id):
+        return None
     return trip
 
 
-def get_trip(db: Session, trip_id: str) -> models.Trip | None:
-    return db.query(models.Trip).filter(models.Trip.id == trip_id).first()
+@tracing.traced
+def get_trip(db: Session, trip_id: str, owner_id: str | None = None) -> models.Trip | None:
+    # db.get – без запроса, если поездка уже в identity map сессии
+    return owned(db.get(models.Trip, trip_id), owner_id)
+
 
+def encode_cursor(trip: models.Trip) -> str:
+    raw = f"{trip.created_at.isoformat()}|{trip.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    """Разбирает курсор из encode_cursor, при мусоре на входе бросает ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, trip_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), trip_id
+    except (UnicodeError, ValueError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+@tracing.traced
 def list_trips(
     db: Session,
     user_id: str | None = None,
     status: schemas.TripStatus | None = None,
     offset: int = 0,
     limit: int = 20,
+    cursor: str | None = None,
+    with_total: bool = True,
 ):
+    """
+    Страница поездок в порядке (created_at, id).
+    Если передан cursor, offset игнорируется и страница начинается сразу
+    после указанной записи (keyset-пагинация). with_total=False пропускает COUNT.
+    """
     query = db.query(models.Trip)
     if user_id:
         query = query.filter(models.Trip.user_id == user_id)
     if status:
         query = query.filter(models.Trip.status == status)
 
-    total = query.count()
-    items = query.offset(offset).limit(limit).all()
+    total = query.count() if with_total else None
+
+    query = query.order_by(models.Trip.created_at, models.Trip.id)
+    if cursor:
+        created_at, trip_id = decode_cursor(cursor)
+        query = query.filter(tuple_(models.Trip.created_at, models.Trip.id) > tuple_(created_at, trip_id))
+    else:
+        query = query.offset(offset)
+
+    items = query.limit(limit).all()
     return total, items
+
+
+def iter_trips(
+    db: Session,
+    user_id: str | None = None,
+    status: schemas.TripStatus | None = None,
+    chunk_size: int = 1000,
+):
+    """Отдаёт поездки пачками по chunk_size строк потоковым чтением, без .all()."""
+    stmt = select(models.Trip).order_by(models.Trip.created_at, models.Trip.id)
+    if user_id:
+        stmt = stmt.where(models.Trip.user_id == user_id)
+    if status:
+        stmt = stmt.where(models.Trip.status == status)
+
+    result = db.execute(stmt.execution_options(yield_per=chunk_size))
+    for chunk in result.scalars().partitions():
+        yield chunk
+
+
+# tariff_version поездок, заполненных миграцией v3 по старой формуле
+LEGACY_TARIFF = "legacy"
+
+
+def reprice_values(table: tariffs.TariffTable, trip: models.Trip) -> dict:
+    """Суммы завершённой поездки по таблице table; процент скидки – тот, что был дан."""
+    started_at = _utc_naive(trip.started_at)
+    ride = table.ride_amount(trip.distance_km, trip.duration_minutes, started_at, trip.zone, trip.car_class)
+    return {
+        "tariff_version": table.version,
+        **amounts(ride, trip.parking_fines or 0.0, trip.discount_percent or 0.0),
+    }
+
+
+@tracing.traced
+def reprice_trips(
+    db: Session,
+    user_id: str | None = None,
+    dry_run: bool = False,
+    chunk_size: int = 1000,
+) -> dict:
+    """
+    Пересчёт завершённых поездок по текущей таблице тарифов: keyset-пачками
+    по chunk_size, изменившиеся строки – одним bulk UPDATE по первичному
+    ключу на пачку. Вся выборка считается по одной версии таблицы.
+    Поездки с tariff_version="legacy" не пересчитываются: их скидка
+    считалась со штрафами, а процент восстановлен миграцией приблизительно.
+    """
+    table = tariffs.store.current()
+    processed = changed = 0
+    cursor = None
+    while True:
+        _, trips = list_trips(
+            db, user_id, schemas.TripStatus.finished, limit=chunk_size, cursor=cursor, with_total=False
+        )
+        rows = []
+        for trip in trips:
+            if trip.tariff_version == LEGACY_TARIFF:
+                continue
+            values = reprice_values(table, trip)
+            if any(getattr(trip, field) != value for field, value in values.items()):
+                rows.append({"id": trip.id, **values})
+        processed += len(trips)
+        changed += len(rows)
+        if rows and not dry_run:
+            db.execute(update(models.Trip), rows)
+            db.commit()
+        if len(trips) < chunk_size:
+            break
+        cursor = encode_cursor(trips[-1])
+
+    return {"tariff_version": table.version, "processed": processed, "changed": changed, "dry_run": dry_run}
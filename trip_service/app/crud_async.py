@@ -0,0 +1,81 @@
+"""
+Асинхронные версии функций из crud.py поверх AsyncSession (режим DB_ASYNC=1).
+Семантика и курсоры те же, что в crud.py.
+"""
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from common import tracing
+
+from . import models, schemas, telemetry
+from .crud import decode_cursor, finish_trip_statement, owned
+
+
+@tracing.traced
+async def start_trip(db: AsyncSession, payload: schemas.TripStart) -> models.Trip:
+    trip = models.Trip(
+        booking_id=payload.booking_id,
+        user_id=payload.user_id,
+        car_id=payload.car_id,
+        status=models.TripStatus.in_progress,
+    )
+    db.add(trip)
+    await db.commit()
+    return trip
+
+
+@tracing.traced
+async def get_trip(db: AsyncSession, trip_id: str, owner_id: str | None = None) -> models.Trip | None:
+    return owned(await db.get(models.Trip, trip_id), owner_id)
+
+
+@tracing.traced
+async def finish_trip(
+    db: AsyncSession,
+    trip_id: str,
+    payload: schemas.TripFinish,
+    owner_id: str | None = None,
+) -> models.Trip | None:
+    trip = await get_trip(db, trip_id, owner_id)
+    if trip is None:
+        return None
+    # соединение – в пул до запроса в promo_service, как в crud.finish_trip
+    await db.commit()
+    # чтение трека телеметрии и запрос скидки в promo_service (sync httpx) – не на event loop
+    stmt = await run_in_threadpool(finish_trip_statement, trip, payload)
+    trip = (await db.scalars(stmt)).one_or_none()
+    await db.commit()
+    telemetry.active_trips.discard(trip_id)
+    return trip
+
+
+@tracing.traced
+async def list_trips(
+    db: AsyncSession,
+    user_id: str | None = None,
+    status: schemas.TripStatus | None = None,
+    offset: int = 0,
+    limit: int = 20,
+    cursor: str | None = None,
+    with_total: bool = True,
+):
+    stmt = select(models.Trip)
+    if user_id:
+        stmt = stmt.where(models.Trip.user_id == user_id)
+    if status:
+        stmt = stmt.where(models.Trip.status == status)
+
+    total = None
+    if with_total:
+        total = await db.scalar(select(func.count()).select_from(stmt.subquery()))
+
+    stmt = stmt.order_by(models.Trip.created_at, models.Trip.id)
+    if cursor:
+        created_at, trip_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(models.Trip.created_at, models.Trip.id) > tuple_(created_at, trip_id))
+    else:
+        stmt = stmt.offset(offset)
+
+    items = (await db.scalars(stmt.limit(limit))).all()
+    return total, items
@@ -1,19 +1,103 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./trips.db")
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(
-        DATABASE_URL, connect_args={"check_same_thread": False}
-    )
-else:
-    engine = create_engine(DATABASE_URL)
+# PRAGMA, которые ставятся на каждое новое SQLite-соединение;
+# пустое значение переменной окружения отключает соответствующую PRAGMA
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    # отрицательное значение – размер кэша в KiB
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-65536"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+# DB_ASYNC=1 – эндпоинты работают через AsyncSession (aiosqlite/asyncpg),
+# а не через sync Session в пуле потоков Starlette
+DB_ASYNC = _env_bool("DB_ASYNC", False)
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def _pool_settings() -> dict:
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
+
+def _set_sqlite_pragmas(engine) -> None:
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            if value:
+                cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def make_engine(url: str = DATABASE_URL):
+    """
+    Создаёт engine с настройками под нагрузку: для SQLite – WAL и PRAGMA
+    из SQLITE_PRAGMAS, для остальных БД – пул из DB_POOL_SIZE,
+    DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE.
+    """
+    if url.startswith("sqlite"):
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        _set_sqlite_pragmas(engine)
+        return engine
+
+    return create_engine(url, **_pool_settings())
+
+
+def async_url(url: str) -> str:
+    """sqlite:///x.db -> sqlite+aiosqlite:///x.db, postgresql://… -> postgresql+asyncpg://…"""
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+", 1)[0]
+    return f"{ASYNC_DRIVERS.get(dialect, scheme)}://{rest}"
+
+
+def make_async_engine(url: str = DATABASE_URL):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if url.startswith("sqlite"):
+        engine = create_async_engine(async_url(url))
+        _set_sqlite_pragmas(engine.sync_engine)
+        return engine
+
+    return create_async_engine(async_url(url), **_pool_settings())
+
+
+engine = make_engine()
+
+# expire_on_commit=False: объекты, полученные через RETURNING, остаются
+# заполненными после commit и не перечитываются отдельным SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    async_engine = make_async_engine()
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -21,3 +105,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
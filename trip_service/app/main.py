@@ -1,98 +1,181 @@
-import time
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.responses import Response
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from typing import Optional
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
 
-from . import database, models, schemas, crud
+from common import capture, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.tokens import TokenClaims, authenticate, ensure_subject, token_owner
+from . import database, schemas, crud, migrations, tariffs, telemetry
 
-models.Base.metadata.create_all(bind=database.engine)
+# создаём или обновляем схему при старте
+migrations.upgrade(database.engine)
 
-app = FastAPI(title="Trip Service")
 
-# ====== Prometheus Metrics ======
-REQUEST_COUNT = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "endpoint", "status_code"],
-)
-
-REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "endpoint"],
-)
-
-ACTIVE_REQUESTS = Gauge(
-    "http_active_requests",
-    "Active HTTP requests",
-    ["service"],
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # фоновый сброс буфера телеметрии; при остановке – дописать остаток
+    telemetry.buffer.start()
+    yield
+    telemetry.buffer.stop()
+
+
+app = FastAPI(title="Trip Service", lifespan=lifespan)
 
+# ====== Prometheus Metrics ======
 SERVICE_NAME = "trip_service"
 
-@app.middleware("http")
-async def metrics_middleware(request, call_next):
-    start = time.time()
-    method = request.method
-    endpoint = request.url.path
-    ACTIVE_REQUESTS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        REQUEST_DURATION.labels(service=SERVICE_NAME, method=method, endpoint=endpoint).observe(duration)
-        REQUEST_COUNT.labels(service=SERVICE_NAME, method=method, endpoint=endpoint, status_code=str(status_code)).inc()
-        ACTIVE_REQUESTS.labels(service=SERVICE_NAME).dec()
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME, engines=[database.engine, database.async_engine])
+capture.setup_capture(app, SERVICE_NAME)
 
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
+
+
+@app.get("/api/trips/export")
+def export_trips(
+    user_id: Optional[str] = None,
+    status: Optional[schemas.TripStatus] = None,
+    claims: Optional[TokenClaims] = Depends(authenticate),
+):
+    """
+    Выгрузка поездок в NDJSON потоком – для ночной сверки биллинга.
+    Сессия открывается внутри генератора и живёт, пока отдаётся ответ.
+    """
+    user_id = ensure_subject(claims, user_id)
+    def generate():
+        db = database.SessionLocal()
+        try:
+            for chunk in crud.iter_trips(db, user_id, status):
+                yield "".join(schemas.TripOut.model_validate(t).model_dump_json() + "\n" for t in chunk)
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def _trip_accepts_telemetry(trip_id: str, owner_id: Optional[str]) -> Optional[bool]:
+    # сессия не берёт соединение, пока поездка есть в active_trips
+    with database.SessionLocal() as db:
+        return crud.trip_accepts_telemetry(db, trip_id, owner_id)
+
+
+@app.post("/api/trips/{trip_id}/telemetry", response_model=schemas.TelemetryAccepted)
+async def ingest_telemetry(trip_id: str, request: Request, claims: Optional[TokenClaims] = Depends(authenticate)):
+    """
+    Пачка GPS-точек поездки: NDJSON или бинарный массив '<f8' (ts, lat, lon).
+    Точки только кладутся в буфер – диска на пути запроса нет, а статус
+    поездки читается из БД раз в TELEMETRY_TRIP_CACHE_SECONDS.
+    """
+    accepts = await run_in_threadpool(_trip_accepts_telemetry, trip_id, token_owner(claims))
+    if accepts is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    if not accepts:
+        raise HTTPException(status_code=409, detail="Trip is not in progress")
+    try:
+        points = telemetry.parse_points(await request.body(), request.headers.get("content-type"))
+        telemetry.buffer.add(trip_id, points)
+    except telemetry.TelemetryError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return schemas.TelemetryAccepted(trip_id=trip_id, accepted=len(points))
+
+
+@app.get("/api/tariffs", response_model=schemas.TariffInfo)
+def get_tariffs():
+    table = tariffs.store.current()
+    return schemas.TariffInfo(version=table.version, table=table.data)
 
 
-@app.post("/api/trips/start", response_model=schemas.TripOut)
+@app.post("/api/tariffs/reload", response_model=schemas.TariffInfo, dependencies=[Depends(authenticate)])
+def reload_tariffs():
+    """Перечитать таблицу тарифов сразу, не дожидаясь проверки mtime."""
+    try:
+        table = tariffs.store.reload(force=True)
+    except (OSError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=f"Tariff table not reloaded: {exc}")
+    return schemas.TariffInfo(version=table.version, table=table.data)
+
+
+@app.post("/api/trips/reprice", response_model=schemas.RepriceResult, dependencies=[Depends(authenticate)])
+def reprice_trips(
+    user_id: Optional[str] = None,
+    dry_run: bool = False,
+    db: Session = Depends(database.get_db),
+):
+    """Пересчёт завершённых поездок по текущей таблице тарифов (dry_run – только подсчёт)."""
+    return crud.reprice_trips(db, user_id, dry_run)
+
+
+# CRUD-эндпоинты на sync Session; при DB_ASYNC=1 вместо них подключается api_async.router
+router = APIRouter()
+
+
+@router.post("/api/trips/start", response_model=schemas.TripOut)
 def start_trip(
     payload: schemas.TripStart,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
+    ensure_subject(claims, payload.user_id)
     trip = crud.start_trip(db, payload)
     return trip
 
 
-@app.post("/api/trips/{trip_id}/finish", response_model=schemas.TripOut)
+@router.post("/api/trips/{trip_id}/finish", response_model=schemas.TripOut)
 def finish_trip(
     trip_id: str,
     payload: schemas.TripFinish,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    trip = crud.finish_trip(db, trip_id, payload)
+    trip = crud.finish_trip(db, trip_id, payload, token_owner(claims))
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     return trip
 
 
-@app.get("/api/trips/{trip_id}", response_model=schemas.TripOut)
+@router.get("/api/trips/{trip_id}", response_model=schemas.TripOut)
 def get_trip(
     trip_id: str,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    trip = crud.get_trip(db, trip_id)
+    trip = crud.get_trip(db, trip_id, token_owner(claims))
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     return trip
 
 
-@app.get("/api/trips", response_model=schemas.TripList)
+@router.get("/api/trips", response_model=schemas.TripList)
 def list_trips(
     user_id: Optional[str] = None,
     status: Optional[schemas.TripStatus] = None,
     offset: int = 0,
-    limit: int = 20,
+    limit: int = Query(20, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    with_total: bool = True,
     db: Session = Depends(database.get_db),
+    claims: Optional[TokenClaims] = Depends(authenticate),
 ):
-    total, items = crud.list_trips(db, user_id, status, offset, limit)
-    return schemas.TripList(total=total, items=items)
+    user_id = ensure_subject(claims, user_id)
+    try:
+        total, items = crud.list_trips(db, user_id, status, offset, limit, cursor, with_total)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    next_cursor = crud.encode_cursor(items[-1]) if len(items) == limit else None
+    return schemas.TripList(total=total, items=items, next_cursor=next_cursor)
+
+
+# Bearer-токен из user_service проверяется локально (common.tokens)
+if database.DB_ASYNC:
+    from . import api_async
+
+    app.include_router(api_async.router, dependencies=[Depends(authenticate)])
+else:
+    app.include_router(router, dependencies=[Depends(authenticate)])
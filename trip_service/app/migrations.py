@@ -0,0 +1,58 @@
+"""
+Шаги миграций схемы trip_service; запускает их common.migrations.SchemaMigrator,
+версия – в таблице trip_schema_version. Шаги должны быть идемпотентными.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from common.migrations import SchemaMigrator
+
+from . import models
+
+
+def _add_query_indexes(conn: Connection) -> None:
+    for index in models.Trip.__table__.indexes:
+        index.create(conn, checkfirst=True)
+    if conn.dialect.name == "sqlite":
+        # CURRENT_TIMESTAMP пишет время без микросекунд, а ORM – с ними;
+        # приводим старые строки к одному формату для keyset-пагинации
+        conn.execute(text(
+            "UPDATE trips SET created_at = created_at || '.000000' "
+            "WHERE length(created_at) = 19"
+        ))
+
+
+PRICING_COLUMNS = ("zone", "car_class", "parking_fines", "promo_code", "discount_percent", "tariff_version")
+
+
+def _add_pricing_columns(conn: Connection) -> None:
+    table = models.Trip.__table__
+    existing = {column["name"] for column in inspect(conn).get_columns("trips")}
+    for name in PRICING_COLUMNS:
+        if name in existing:
+            continue
+        column_type = table.c[name].type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE trips ADD COLUMN {name} {column_type}"))
+    # старые поездки считались по 10 руб/км + 5 руб/мин со скидкой 10%
+    # при любом промокоде – восстанавливаем из этого штрафы и процент скидки
+    conn.execute(text(
+        "UPDATE trips SET "
+        "parking_fines = CASE WHEN base_amount > distance_km * 10 + duration_minutes * 5 "
+        "THEN base_amount - distance_km * 10 - duration_minutes * 5 ELSE 0 END, "
+        "discount_percent = CASE WHEN discount_amount > 0 THEN 10 ELSE 0 END, "
+        "tariff_version = 'legacy' "
+        "WHERE status = 'finished' AND base_amount IS NOT NULL AND tariff_version IS NULL"
+    ))
+
+
+# (версия, функция) – версия, до которой функция поднимает схему
+MIGRATIONS = [
+    (2, _add_query_indexes),
+    (3, _add_pricing_columns),
+]
+
+migrator = SchemaMigrator("trip", models.Base.metadata, models.Trip.__tablename__, MIGRATIONS)
+
+HEAD_VERSION = migrator.head_version
+current_version = migrator.current_version
+upgrade = migrator.upgrade
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, DateTime, Float, Integer, Enum
+from sqlalchemy import Column, String, DateTime, Float, Integer, Enum, Index
 from sqlalchemy.sql import func
 import uuid
 import enum
+from datetime import datetime
 
 from .database import Base
 
@@ -13,6 +14,13 @@ class TripStatus(str, enum.Enum):
 
 class Trip(Base):
     __tablename__ = "trips"
+    # индексы под реальные фильтры списков и проверки по машине;
+    # при изменении набора индексов нужна новая миграция в migrations.py
+    __table_args__ = (
+        Index("ix_trips_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_trips_car_status", "car_id", "status"),
+        Index("ix_trips_created_id", "created_at", "id"),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     booking_id = Column(String, nullable=False)
@@ -25,10 +33,20 @@ class Trip(Base):
     distance_km = Column(Float, nullable=True)
     duration_minutes = Column(Integer, nullable=True)
 
+    # входные данные тарифа – по ним поездку можно пересчитать (crud.reprice_trips)
+    zone = Column(String, nullable=True)
+    car_class = Column(String, nullable=True)
+    parking_fines = Column(Float, nullable=True)
+    promo_code = Column(String, nullable=True)
+    discount_percent = Column(Float, nullable=True)
+    tariff_version = Column(String, nullable=True)
+
     base_amount = Column(Float, nullable=True)
     discount_amount = Column(Float, nullable=True)
     final_amount = Column(Float, nullable=True)
 
     status = Column(Enum(TripStatus), nullable=False, default=TripStatus.in_progress)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # значение проставляет ORM (с микросекундами), чтобы keyset-пагинация по
+    # (created_at, id) сравнивала значения в одном формате
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
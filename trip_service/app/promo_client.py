@@ -0,0 +1,144 @@
+"""
+Клиент promo_service для скидок по промокоду при завершении поездки.
+
+Условия кода (процент, минимальная сумма, срок) читаются через
+GET /api/promocodes/{code} и кешируются на PROMO_CACHE_TTL_SECONDS
+(в том числе "такого кода нет") – заведомо неподходящий код не уходит
+в promo_service. Счётчики использования не кешируются: скидка даётся,
+только если POST /api/promocodes/apply списал код, а Idempotency-Key =
+id поездки не даёт списать его дважды при повторном завершении.
+Если promo_service недоступен, скидка не даётся, а ошибка кешируется
+на PROMO_ERROR_TTL_SECONDS – чтобы не ждать таймаут на каждой поездке.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from common import tracing
+
+logger = logging.getLogger(__name__)
+
+PROMO_SERVICE_URL = os.getenv("PROMO_SERVICE_URL", "http://promo_service:8004")
+PROMO_TIMEOUT = float(os.getenv("PROMO_TIMEOUT_SECONDS", "0.5"))
+PROMO_CACHE_TTL = float(os.getenv("PROMO_CACHE_TTL_SECONDS", "60"))
+PROMO_ERROR_TTL = float(os.getenv("PROMO_ERROR_TTL_SECONDS", "5"))
+PROMO_CACHE_SIZE = int(os.getenv("PROMO_CACHE_SIZE", "10000"))
+
+
+class PromoClient:
+    def __init__(
+        self,
+        base_url: str = PROMO_SERVICE_URL,
+        timeout: float = PROMO_TIMEOUT,
+        ttl: float = PROMO_CACHE_TTL,
+        error_ttl: float = PROMO_ERROR_TTL,
+        max_size: int = PROMO_CACHE_SIZE,
+        transport: Optional[httpx.BaseTransport] = None,
+    ):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.max_size = max_size
+        # один Client на процесс – keep-alive соединения к promo_service
+        # traceparent и X-Request-ID уходят в promo_service с каждым запросом
+        self._http = httpx.Client(
+            base_url=base_url,
+            timeout=timeout,
+            transport=transport,
+            event_hooks={"request": [tracing.inject_headers]},
+        )
+        # код -> (момент устаревания, промокод или None)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fetch(self, code: str) -> Tuple[float, Optional[dict]]:
+        try:
+            with tracing.client_span("GET /api/promocodes/{code}") as span:
+                response = self._http.get(f"/api/promocodes/{quote(code, safe='')}")
+                span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code == 404:
+                return self.ttl, None
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            logger.warning("promo_service unavailable for %s: %s", code, exc)
+            return self.error_ttl, None
+
+        body = response.json()
+        expires_at = body.get("expires_at")
+        # только условия кода: used_count устаревает с первым же применением
+        promo = {
+            "discount_percent": body["discount_percent"],
+            "min_order_amount": body["min_order_amount"],
+            # срок в ответе – UTC без таймзоны; сравниваем как epoch
+            "expires_ts": (
+                datetime.fromisoformat(expires_at).replace(tzinfo=timezone.utc).timestamp() if expires_at else None
+            ),
+        }
+        return self.ttl, promo
+
+    def get(self, code: str) -> Optional[dict]:
+        """Промокод из кеша или promo_service; None – кода нет или сервис недоступен."""
+        code = code.upper()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(code)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(code)
+                return cached[1]
+
+        ttl, promo = self._fetch(code)
+        with self._lock:
+            self._cache[code] = (now + ttl, promo)
+            self._cache.move_to_end(code)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return promo
+
+    def _apply(self, code: str, user_id: str, order_amount: float, idempotency_key: str) -> bool:
+        """Списывает код в promo_service; False – код не применён или сервис недоступен."""
+        try:
+            with tracing.client_span("POST /api/promocodes/apply") as span:
+                response = self._http.post(
+                    "/api/promocodes/apply",
+                    json={"promo_code": code, "user_id": user_id, "order_amount": order_amount},
+                    headers={"Idempotency-Key": idempotency_key},
+                )
+                span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code in (400, 404, 409):
+                return False
+            response.raise_for_status()
+        except httpx.HTTPError as exc:
+            logger.warning("promo_service unavailable for %s: %s", code, exc)
+            return False
+        return True
+
+    def redeem(self, code: str, user_id: str, order_amount: float, at: datetime, trip_id: str) -> float:
+        """
+        Процент скидки по коду для поездки trip_id на order_amount в момент at
+        (UTC) с его списанием; 0 – код не применим.
+        """
+        code = code.upper()
+        promo = self.get(code)
+        if promo is None:
+            return 0.0
+        at_ts = at.replace(tzinfo=timezone.utc).timestamp() if at.tzinfo is None else at.timestamp()
+        if promo["expires_ts"] is not None and promo["expires_ts"] <= at_ts:
+            return 0.0
+        if order_amount < promo["min_order_amount"]:
+            return 0.0
+        if not self._apply(code, user_id, order_amount, trip_id):
+            return 0.0
+        return float(promo["discount_percent"])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+
+client = PromoClient()
@@ -20,6 +20,9 @@ class TripFinish(BaseModel):
     duration_minutes: int
     parking_fines: float = 0.0
     promo_code: Optional[str] = None
+    # зона и класс машины для тарифа; None – базовые ставки
+    zone: Optional[str] = None
+    car_class: Optional[str] = None
 
 
 class TripOut(BaseModel):
@@ -34,11 +37,34 @@ class TripOut(BaseModel):
     base_amount: Optional[float]
     discount_amount: Optional[float]
     final_amount: Optional[float]
+    zone: Optional[str] = None
+    car_class: Optional[str] = None
+    tariff_version: Optional[str] = None
     status: TripStatus
 
     model_config = {"from_attributes": True}
 
 
 class TripList(BaseModel):
-    total: int
+    # None, если список запрошен с with_total=false
+    total: Optional[int] = None
     items: list[TripOut]
+    # курсор следующей страницы, None – если страница последняя
+    next_cursor: Optional[str] = None
+
+
+class TariffInfo(BaseModel):
+    version: str
+    table: dict
+
+
+class RepriceResult(BaseModel):
+    tariff_version: str
+    processed: int
+    changed: int
+    dry_run: bool
+
+
+class TelemetryAccepted(BaseModel):
+    trip_id: str
+    accepted: int
@@ -0,0 +1,166 @@
+"""
+Тарифный движок поездок.
+
+Таблица тарифов – JSON-файл (TARIFFS_PATH, по умолчанию app/tariffs.json):
+    version             – версия таблицы, пишется в поездку (trips.tariff_version)
+    utc_offset_minutes  – смещение местного времени для суточных коэффициентов
+    default             – {"per_km", "per_minute", "min_fare"}
+    classes             – класс машины -> поля тарифа поверх default
+    zones               – зона -> {"rates": поля тарифа, "classes": {класс -> поля тарифа}}
+    time_multipliers    – [{"from": "HH:MM", "to": "HH:MM", "multiplier": x}],
+                          интервал с to <= from переходит через полночь
+
+Таблица разбирается один раз: ставки для всех пар (зона, класс) заранее
+сведены в словарь, коэффициенты – в список на каждую минуту суток,
+так что расчёт поездки – пара обращений к dict/list.
+
+TariffStore раз в TARIFF_RELOAD_SECONDS сверяет mtime файла и подменяет
+таблицу новой версией; битый файл не применяется, остаётся прежняя таблица.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TARIFFS_PATH = os.getenv("TARIFFS_PATH", os.path.join(os.path.dirname(__file__), "tariffs.json"))
+RELOAD_SECONDS = float(os.getenv("TARIFF_RELOAD_SECONDS", "10"))
+
+MINUTES_PER_DAY = 24 * 60
+RATE_FIELDS = ("per_km", "per_minute", "min_fare")
+
+
+@dataclass(frozen=True)
+class Rate:
+    per_km: float
+    per_minute: float
+    min_fare: float = 0.0
+
+
+def _merge(base: Dict[str, float], override: Optional[dict], where: str) -> Dict[str, float]:
+    if not override:
+        return base
+    unknown = set(override) - set(RATE_FIELDS)
+    if unknown:
+        raise ValueError(f"{where}: unknown rate fields {sorted(unknown)}")
+    return {**base, **{field: float(value) for field, value in override.items()}}
+
+
+def _minute_of_day(text: str) -> int:
+    hours, minutes = text.split(":")
+    value = int(hours) * 60 + int(minutes)
+    if not 0 <= value <= MINUTES_PER_DAY:
+        raise ValueError(f"Invalid time of day: {text}")
+    return value % MINUTES_PER_DAY
+
+
+class TariffTable:
+    """Разобранная таблица тарифов; неизменяема после создания."""
+
+    def __init__(self, data: dict):
+        try:
+            self.version = str(data["version"])
+            self.utc_offset = timedelta(minutes=int(data.get("utc_offset_minutes", 0)))
+            default = _merge({"min_fare": 0.0}, data["default"], "default")
+            self.default = Rate(**default)
+
+            classes = data.get("classes", {})
+            zones = data.get("zones", {})
+            class_names = set(classes)
+            for zone in zones.values():
+                class_names |= set(zone.get("classes", {}))
+
+            self._rates: Dict[Tuple[Optional[str], Optional[str]], Rate] = {}
+            for car_class in class_names:
+                self._rates[None, car_class] = Rate(**_merge(default, classes.get(car_class), f"class {car_class}"))
+            for name, zone in zones.items():
+                zone_rates = zone.get("rates")
+                self._rates[name, None] = Rate(**_merge(default, zone_rates, f"zone {name}"))
+                for car_class in class_names:
+                    merged = _merge(default, classes.get(car_class), f"class {car_class}")
+                    merged = _merge(merged, zone_rates, f"zone {name}")
+                    merged = _merge(merged, zone.get("classes", {}).get(car_class), f"zone {name} class {car_class}")
+                    self._rates[name, car_class] = Rate(**merged)
+
+            self._multipliers: List[float] = [1.0] * MINUTES_PER_DAY
+            for period in data.get("time_multipliers", []):
+                start, end = _minute_of_day(period["from"]), _minute_of_day(period["to"])
+                multiplier = float(period["multiplier"])
+                minutes = range(start, end) if start < end else [*range(start, MINUTES_PER_DAY), *range(end)]
+                for minute in minutes:
+                    self._multipliers[minute] = multiplier
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ValueError(f"Invalid tariff table: {exc}") from exc
+        self.data = data
+
+    def rate(self, zone: Optional[str] = None, car_class: Optional[str] = None) -> Rate:
+        """Тариф пары (зона, класс); неизвестные зона или класс – без их надбавок."""
+        rates = self._rates
+        return (
+            rates.get((zone, car_class))
+            or rates.get((zone, None))
+            or rates.get((None, car_class))
+            or self.default
+        )
+
+    def multiplier(self, at: datetime) -> float:
+        """Коэффициент на момент at (UTC) по местному времени суток."""
+        local = at + self.utc_offset
+        return self._multipliers[local.hour * 60 + local.minute]
+
+    def ride_amount(
+        self,
+        distance_km: float,
+        duration_minutes: float,
+        started_at: datetime,
+        zone: Optional[str] = None,
+        car_class: Optional[str] = None,
+    ) -> float:
+        """Стоимость самой поездки (без штрафов и скидок), не меньше минимальной."""
+        rate = self.rate(zone, car_class)
+        amount = (distance_km * rate.per_km + duration_minutes * rate.per_minute) * self.multiplier(started_at)
+        return round(max(amount, rate.min_fare), 2)
+
+
+def load_table(path: str) -> TariffTable:
+    with open(path, encoding="utf-8") as f:
+        return TariffTable(json.load(f))
+
+
+class TariffStore:
+    """Текущая таблица тарифов с горячей перезагрузкой по mtime файла."""
+
+    def __init__(self, path: str = TARIFFS_PATH, check_interval: float = RELOAD_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._table = load_table(path)
+        self._checked_at = time.monotonic()
+
+    def current(self) -> TariffTable:
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._checked_at = time.monotonic()
+            try:
+                self.reload()
+            except (OSError, ValueError) as exc:
+                logger.error("Tariff table %s not reloaded: %s", self.path, exc)
+        return self._table
+
+    def reload(self, force: bool = False) -> TariffTable:
+        """Перечитывает файл, если он изменился (или force); ошибки пробрасывает."""
+        with self._lock:
+            mtime = os.stat(self.path).st_mtime_ns
+            if force or mtime != self._mtime:
+                table = load_table(self.path)
+                self._table, self._mtime = table, mtime
+                logger.info("Tariff table %s loaded, version %s", self.path, table.version)
+            return self._table
+
+
+store = TariffStore()
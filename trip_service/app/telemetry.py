@@ -0,0 +1,233 @@
+"""
+Телеметрия поездок: GPS-точки (ts, lat, lon) пачками от машин.
+
+Приём не пишет в БД: точки копятся в памяти (TelemetryBuffer) и фоновым
+потоком раз в TELEMETRY_FLUSH_SECONDS (или раньше, если в буфере больше
+TELEMETRY_FLUSH_POINTS точек) дописываются в TrackStore – по файлу на
+поездку, float64 little-endian строками по 3 значения, только append.
+При завершении поездки её буфер сбрасывается, трек читается одним
+np.fromfile, а пробег считается векторной формулой гаверсинусов.
+
+Форматы тела запроса:
+    application/x-ndjson      – строки {"ts": epoch, "lat": ..., "lon": ...}
+    application/octet-stream  – подряд идущие тройки '<f8' (24 байта на точку)
+
+Буфер свой у каждого воркера: точки, принятые другим воркером, попадут
+в трек после его очередного сброса.
+
+Точки принимаются только для поездок в статусе in_progress: статус
+читается из БД и запоминается в ActiveTrips на TELEMETRY_TRIP_CACHE_SECONDS,
+так что поток пачек одной поездки не ходит в БД на каждую.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "./telemetry")
+FLUSH_SECONDS = float(os.getenv("TELEMETRY_FLUSH_SECONDS", "1"))
+FLUSH_POINTS = int(os.getenv("TELEMETRY_FLUSH_POINTS", "200000"))
+TRIP_CACHE_SECONDS = float(os.getenv("TELEMETRY_TRIP_CACHE_SECONDS", "5"))
+TRIP_CACHE_SIZE = 100_000
+
+EARTH_RADIUS_KM = 6371.0088
+POINT_DTYPE = np.dtype("<f8")
+POINT_FIELDS = 3  # ts, lat, lon
+POINT_SIZE = POINT_DTYPE.itemsize * POINT_FIELDS
+
+BINARY_TYPES = ("application/octet-stream",)
+_TRIP_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class TelemetryError(ValueError):
+    """Тело запроса не разбирается или точки вне допустимых значений."""
+
+
+def parse_points(body: bytes, content_type: Optional[str]) -> np.ndarray:
+    """Точки из тела запроса – массив (n, 3) float64."""
+    if (content_type or "").split(";")[0].strip() in BINARY_TYPES:
+        if len(body) % POINT_SIZE:
+            raise TelemetryError(f"Binary body must be a multiple of {POINT_SIZE} bytes")
+        points = np.frombuffer(body, dtype=POINT_DTYPE).reshape(-1, POINT_FIELDS)
+    else:
+        try:
+            rows = [json.loads(line) for line in body.splitlines() if line.strip()]
+            points = np.array([(row["ts"], row["lat"], row["lon"]) for row in rows], dtype=POINT_DTYPE)
+        except (ValueError, KeyError, TypeError) as exc:
+            raise TelemetryError(f"Invalid NDJSON telemetry: {exc}") from None
+        points = points.reshape(-1, POINT_FIELDS)
+
+    if not np.isfinite(points).all():
+        raise TelemetryError("Telemetry contains NaN or infinite values")
+    if (np.abs(points[:, 1]) > 90).any() or (np.abs(points[:, 2]) > 180).any():
+        raise TelemetryError("Coordinates out of range")
+    return points
+
+
+def track_distance_km(points: np.ndarray) -> float:
+    """Длина трека (n, 3) по гаверсинусам между соседними точками."""
+    if len(points) < 2:
+        return 0.0
+    lat = np.radians(points[:, 1])
+    lon = np.radians(points[:, 2])
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return float(2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0))).sum())
+
+
+class TrackStore:
+    """Append-only треки поездок: файл <trip_id>.f64 на поездку."""
+
+    def __init__(self, directory: str = TELEMETRY_DIR):
+        self.directory = directory
+        self._created = False
+
+    def _path(self, trip_id: str) -> str:
+        if not _TRIP_ID.match(trip_id):
+            raise TelemetryError("Invalid trip id")
+        return os.path.join(self.directory, f"{trip_id}.f64")
+
+    def append(self, trip_id: str, points: np.ndarray) -> None:
+        if not self._created:
+            os.makedirs(self.directory, exist_ok=True)
+            self._created = True
+        with open(self._path(trip_id), "ab") as f:
+            f.write(np.ascontiguousarray(points, dtype=POINT_DTYPE).tobytes())
+
+    def read(self, trip_id: str) -> np.ndarray:
+        """Трек поездки, упорядоченный по ts (пачки могут приходить не по порядку)."""
+        try:
+            points = np.fromfile(self._path(trip_id), dtype=POINT_DTYPE).reshape(-1, POINT_FIELDS)
+        except (FileNotFoundError, TelemetryError):
+            return np.empty((0, POINT_FIELDS), dtype=POINT_DTYPE)
+        return points[np.argsort(points[:, 0], kind="stable")]
+
+
+class TelemetryBuffer:
+    """Точки, ещё не записанные в TrackStore, сгруппированные по поездкам."""
+
+    def __init__(self, store: TrackStore, flush_points: int = FLUSH_POINTS, flush_seconds: float = FLUSH_SECONDS):
+        self.store = store
+        self.flush_points = flush_points
+        self.flush_seconds = flush_seconds
+        self._chunks: Dict[str, List[np.ndarray]] = {}
+        self._points = 0
+        self._lock = threading.Lock()
+        # ввод-вывод по одной поездке не идёт параллельно из двух потоков
+        self._io_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return self._points
+
+    def add(self, trip_id: str, points: np.ndarray) -> None:
+        if not _TRIP_ID.match(trip_id):
+            raise TelemetryError("Invalid trip id")
+        if not len(points):
+            return
+        with self._lock:
+            self._chunks.setdefault(trip_id, []).append(points)
+            self._points += len(points)
+            full = self._points >= self.flush_points
+        if full:
+            self._wakeup.set()
+
+    def _take(self, trip_id: Optional[str] = None) -> Dict[str, List[np.ndarray]]:
+        with self._lock:
+            if trip_id is None:
+                taken, self._chunks = self._chunks, {}
+            else:
+                chunks = self._chunks.pop(trip_id, None)
+                taken = {trip_id: chunks} if chunks else {}
+            self._points -= sum(len(chunk) for chunks in taken.values() for chunk in chunks)
+        return taken
+
+    def flush(self, trip_id: Optional[str] = None) -> int:
+        """Записывает буфер (всех поездок или одной) в TrackStore; возвращает число точек."""
+        with self._io_lock:
+            taken = self._take(trip_id)
+            pending = list(taken)
+            try:
+                while pending:
+                    self.store.append(pending[0], np.concatenate(taken[pending[0]]))
+                    pending.pop(0)
+            except OSError:
+                # незаписанные точки возвращаются в буфер до следующего сброса
+                for key in pending:
+                    for chunk in taken[key]:
+                        self.add(key, chunk)
+                raise
+        return sum(len(chunk) for chunks in taken.values() for chunk in chunks)
+
+    def track(self, trip_id: str) -> np.ndarray:
+        self.flush(trip_id)
+        return self.store.read(trip_id)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Telemetry flush failed")
+
+
+class ActiveTrips:
+    """Поездки, недавно найденные в БД в статусе in_progress; id -> (момент устаревания, user_id)."""
+
+    def __init__(self, ttl: float = TRIP_CACHE_SECONDS, max_size: int = TRIP_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, trip_id: str) -> bool:
+        return self.owner(trip_id) is not None
+
+    def owner(self, trip_id: str) -> Optional[str]:
+        """user_id идущей поездки; None – её нет в кеше или запись устарела."""
+        entry = self._entries.get(trip_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def add(self, trip_id: str, user_id: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_size:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+            self._entries[trip_id] = (now + self.ttl, user_id)
+
+    def discard(self, trip_id: str) -> None:
+        with self._lock:
+            self._entries.pop(trip_id, None)
+
+
+buffer = TelemetryBuffer(TrackStore())
+active_trips = ActiveTrips()
@@ -1,12 +1,24 @@
 import sys
 import os
+import tempfile
 
 # Добавляем путь к trip_service в начало sys.path
 service_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if service_path not in sys.path:
     sys.path.insert(0, service_path)
 
+# Корень репозитория – для общего пакета common
+repo_root = os.path.dirname(service_path)
+if repo_root not in sys.path:
+    sys.path.append(repo_root)
+
 # Удаляем закэшированные модули app, чтобы избежать конфликтов
 modules_to_remove = [key for key in sys.modules.keys() if key == 'app' or key.startswith('app.')]
 for mod in modules_to_remove:
     del sys.modules[mod]
+
+# Тесты работают с временной БД, а не с trips.db из репозитория
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test_trips.db")
+os.environ["TELEMETRY_DIR"] = os.path.join(tempfile.mkdtemp(), "telemetry")
+# Трассировка в память: тесты проверяют spans без коллектора
+os.environ["TRACING_EXPORTER"] = "memory"
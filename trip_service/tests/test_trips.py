@@ -5,6 +5,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # trip_service/tests/test_trips.py
 from fastapi.testclient import TestClient
 from app.main import app
+import json
 
 client = TestClient(app)
 
@@ -52,3 +53,429 @@ def test_start_finish_trip_and_get():
     data4 = r4.json()
     assert data4["total"] >= 1
     assert any(item["id"] == trip_id for item in data4["items"])
+
+
+def test_keyset_pagination_and_export():
+    user_id = "user-trip-keyset"
+    created_ids = []
+    for i in range(5):
+        r = client.post(
+            "/api/trips/start",
+            json={"booking_id": f"booking-keyset-{i}", "user_id": user_id, "car_id": f"car-keyset-{i}"},
+        )
+        assert r.status_code == 200
+        created_ids.append(r.json()["id"])
+
+    r = client.get("/api/trips", params={"user_id": user_id, "limit": 3})
+    first = r.json()
+    assert first["total"] == 5
+    r2 = client.get(
+        "/api/trips",
+        params={"user_id": user_id, "limit": 3, "cursor": first["next_cursor"], "with_total": False},
+    )
+    second = r2.json()
+    assert second["total"] is None
+    assert second["next_cursor"] is None
+    assert [t["id"] for t in first["items"] + second["items"]] == created_ids
+
+    r3 = client.get("/api/trips/export", params={"user_id": user_id})
+    assert r3.status_code == 200
+    assert [json.loads(line)["id"] for line in r3.text.splitlines()] == created_ids
+
+
+def test_migrations_create_fresh_database(tmp_path):
+    from sqlalchemy import create_engine, inspect
+    from app import migrations
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+    with engine.connect() as conn:
+        assert migrations.current_version(conn) == migrations.HEAD_VERSION
+
+    index_names = {ix["name"] for ix in inspect(engine).get_indexes("trips")}
+    assert {"ix_trips_user_status_created", "ix_trips_car_status"} <= index_names
+
+
+def test_async_router_mirrors_sync_endpoints(tmp_path):
+    from fastapi import FastAPI
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app import api_async, database, models
+
+    url = f"sqlite:///{tmp_path / 'async.db'}"
+    models.Base.metadata.create_all(bind=database.make_engine(url))
+    async_session = async_sessionmaker(database.make_async_engine(url), expire_on_commit=False)
+
+    async def get_async_db():
+        async with async_session() as db:
+            yield db
+
+    async_app = FastAPI()
+    async_app.include_router(api_async.router)
+    async_app.dependency_overrides[database.get_async_db] = get_async_db
+
+    with TestClient(async_app) as async_client:
+        r = async_client.post(
+            "/api/trips/start",
+            json={"booking_id": "booking-async", "user_id": "user-trip-async", "car_id": "car-async"},
+        )
+        assert r.status_code == 200
+        trip_id = r.json()["id"]
+
+        r2 = async_client.post(f"/api/trips/{trip_id}/finish", json={"distance_km": 5, "duration_minutes": 10})
+        assert r2.json()["status"] == "finished"
+        assert r2.json()["final_amount"] == 100
+
+        r3 = async_client.get("/api/trips", params={"user_id": "user-trip-async", "with_total": False})
+        assert r3.json()["total"] is None
+        assert [t["id"] for t in r3.json()["items"]] == [trip_id]
+        assert async_client.get("/api/trips/missing").status_code == 404
+
+
+def test_writes_cost_one_statement_each():
+    from sqlalchemy import event
+    from app import crud, database, schemas
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", count)
+    try:
+        with database.SessionLocal() as db:
+            trip = crud.start_trip(db, schemas.TripStart(booking_id="b-stmt", user_id="u-stmt", car_id="c-stmt"))
+            started = len(statements)
+            finished = crud.finish_trip(db, trip.id, schemas.TripFinish(distance_km=2, duration_minutes=4))
+    finally:
+        event.remove(database.engine, "before_cursor_execute", count)
+
+    assert started == 1
+    assert len(statements) == 2
+    assert trip.started_at is not None
+    assert finished.final_amount == 40
+
+
+def test_tariff_table_resolves_zone_class_and_time_of_day():
+    from datetime import datetime
+    from app.tariffs import TariffTable
+
+    table = TariffTable({
+        "version": "t1",
+        "utc_offset_minutes": 180,
+        "default": {"per_km": 10, "per_minute": 5},
+        "classes": {"comfort": {"per_km": 14, "min_fare": 150}},
+        "zones": {"airport": {"rates": {"min_fare": 500}, "classes": {"comfort": {"per_minute": 8}}}},
+        "time_multipliers": [{"from": "23:00", "to": "06:00", "multiplier": 1.5}],
+    })
+    day = datetime(2026, 1, 1, 9, 0)  # 12:00 по местному времени
+
+    assert table.ride_amount(5, 10, day) == 100
+    assert table.ride_amount(5, 10, day, car_class="comfort") == 150  # минимальная цена
+    assert table.ride_amount(40, 10, day, "airport", "comfort") == 640
+    assert table.ride_amount(1, 1, day, "airport") == 500
+    assert table.ride_amount(5, 10, day, "nowhere", "unknown") == 100
+    # 21:30 UTC – 00:30 местного, ночной коэффициент через полночь
+    assert table.ride_amount(5, 10, datetime(2026, 1, 1, 21, 30)) == 150
+
+
+def test_promo_is_redeemed_once_per_trip_and_tariffs_reprice_after_reload(tmp_path, monkeypatch):
+    import httpx
+    from app import promo_client, tariffs
+
+    from app import database
+
+    calls = []
+    applied = []
+    held = []
+
+    def promo_service(request):
+        calls.append(request.url.raw_path.decode())
+        if request.url.path == "/api/promocodes/apply":
+            held.append(database.engine.pool.checkedout())
+            applied.append((request.headers["idempotency-key"], json.loads(request.content)))
+            return httpx.Response(200, json={
+                "status": "applied", "promo_code": "RIDE20", "discount_applied": 20.0,
+                "final_amount": 80.0, "usage_count": len(applied), "max_usages": 100,
+            })
+        return httpx.Response(200, json={
+            "code": "RIDE20", "discount_percent": 20, "expires_at": "2099-01-01T00:00:00",
+            "min_order_amount": 0, "max_uses": 100, "used_count": 0,
+        })
+
+    path = tmp_path / "tariffs.json"
+    path.write_text(json.dumps({"version": "v1", "default": {"per_km": 10, "per_minute": 5}}))
+    monkeypatch.setattr(tariffs, "store", tariffs.TariffStore(str(path), check_interval=0))
+    monkeypatch.setattr(promo_client, "client", promo_client.PromoClient(transport=httpx.MockTransport(promo_service)))
+
+    user_id = "user-trip-tariff"
+    finished = []
+    for i in range(2):
+        trip_id = client.post(
+            "/api/trips/start", json={"booking_id": f"b-tariff-{i}", "user_id": user_id, "car_id": "c-tariff"}
+        ).json()["id"]
+        r = client.post(f"/api/trips/{trip_id}/finish", json={
+            "distance_km": 5, "duration_minutes": 10, "parking_fines": 50, "promo_code": "ride20",
+        })
+        finished.append(r.json())
+
+    # условия кода взяты из кеша, а списание – на каждую поездку, с её id как ключом
+    assert calls == ["/api/promocodes/RIDE20", "/api/promocodes/apply", "/api/promocodes/apply"]
+    assert [key for key, _ in applied] == [t["id"] for t in finished]
+    assert applied[0][1] == {"promo_code": "RIDE20", "user_id": user_id, "order_amount": 100.0}
+    # на время списания соединение из пула не занято
+    assert held == [0, 0]
+    # скидка 20% только на поездку, не на штраф
+    assert [(t["base_amount"], t["discount_amount"], t["final_amount"]) for t in finished] == [(150, 20, 130)] * 2
+
+    # несуществующая поездка – 404 до обращения к promo_service
+    r = client.post("/api/trips/missing-trip/finish", json={
+        "distance_km": 5, "duration_minutes": 10, "promo_code": "ride20",
+    })
+    assert r.status_code == 404
+    assert len(calls) == 3
+
+    # код с '/' уходит в путь экранированным
+    promo_client.client.get("a/b")
+    assert calls[-1] == "/api/promocodes/A%2FB"
+    del calls[-1]
+    assert finished[0]["tariff_version"] == "v1"
+
+    path.write_text(json.dumps({"version": "v2", "default": {"per_km": 20, "per_minute": 5}}))
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1_000_000))
+    assert client.get("/api/tariffs").json()["version"] == "v2"
+
+    r = client.post("/api/trips/reprice", params={"user_id": user_id, "dry_run": True})
+    assert r.json() == {"tariff_version": "v2", "processed": 2, "changed": 2, "dry_run": True}
+    r = client.post("/api/trips/reprice", params={"user_id": user_id})
+    assert r.json()["changed"] == 2
+
+    repriced = client.get(f"/api/trips/{finished[0]['id']}").json()
+    assert (repriced["base_amount"], repriced["discount_amount"], repriced["final_amount"]) == (200, 30, 170)
+    assert repriced["tariff_version"] == "v2"
+    assert len(calls) == 3
+
+
+def test_reprice_keeps_legacy_trips(tmp_path, monkeypatch):
+    from datetime import datetime
+    from app import database, models, tariffs
+
+    path = tmp_path / "tariffs.json"
+    path.write_text(json.dumps({"version": "v9", "default": {"per_km": 30, "per_minute": 5}}))
+    monkeypatch.setattr(tariffs, "store", tariffs.TariffStore(str(path), check_interval=0))
+
+    # старая формула: скидка 10% и на поездку, и на штраф
+    with database.SessionLocal() as db:
+        trip = models.Trip(
+            booking_id="b-legacy", user_id="user-trip-legacy", car_id="c-legacy",
+            status=models.TripStatus.finished, started_at=datetime(2025, 1, 1), finished_at=datetime(2025, 1, 1),
+            distance_km=10.5, duration_minutes=25, parking_fines=50, discount_percent=10,
+            base_amount=280, discount_amount=28, final_amount=252, tariff_version="legacy",
+        )
+        db.add(trip)
+        db.commit()
+
+    r = client.post("/api/trips/reprice", params={"user_id": "user-trip-legacy"})
+    assert r.json() == {"tariff_version": "v9", "processed": 1, "changed": 0, "dry_run": False}
+    kept = client.get(f"/api/trips/{trip.id}").json()
+    assert (kept["base_amount"], kept["discount_amount"], kept["final_amount"]) == (280, 28, 252)
+    assert kept["tariff_version"] == "legacy"
+
+
+def test_migration_v3_backfills_legacy_pricing(tmp_path):
+    from sqlalchemy import create_engine, text
+    from app import migrations
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'v2.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE trips (id VARCHAR PRIMARY KEY, booking_id VARCHAR, user_id VARCHAR, car_id VARCHAR, "
+            "started_at DATETIME, finished_at DATETIME, distance_km FLOAT, duration_minutes INTEGER, "
+            "base_amount FLOAT, discount_amount FLOAT, final_amount FLOAT, status VARCHAR(11), "
+            "created_at DATETIME, updated_at DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO trips (id, booking_id, user_id, car_id, distance_km, duration_minutes, base_amount, "
+            "discount_amount, final_amount, status, created_at) VALUES "
+            "('t1', 'b', 'u', 'c', 10.5, 25, 280, 28, 252, 'finished', '2025-01-01 00:00:00.000000')"
+        ))
+        conn.execute(text("CREATE TABLE schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO schema_version VALUES (2)"))
+
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT parking_fines, discount_percent, tariff_version FROM trips")).one()
+    assert tuple(row) == (50, 10, "legacy")
+
+
+def test_migrations_keep_their_own_version_in_a_shared_database(tmp_path):
+    from sqlalchemy import create_engine, inspect, text
+    from app import migrations
+
+    # в той же БД уже живёт другой сервис со своей (и старой общей) таблицей версий
+    engine = create_engine(f"sqlite:///{tmp_path / 'shared.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE booking_schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO booking_schema_version VALUES (7)"))
+        conn.execute(text("CREATE TABLE schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("INSERT INTO schema_version VALUES (7)"))
+
+    assert migrations.upgrade(engine) == migrations.HEAD_VERSION
+    assert "trips" in inspect(engine).get_table_names()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT max(version) FROM trip_schema_version")).scalar() == migrations.HEAD_VERSION
+        assert conn.execute(text("SELECT max(version) FROM booking_schema_version")).scalar() == 7
+
+
+def test_telemetry_ingest_drives_server_side_distance():
+    import numpy as np
+    from app import telemetry
+
+    trip_id = client.post(
+        "/api/trips/start", json={"booking_id": "b-gps", "user_id": "user-trip-gps", "car_id": "c-gps"}
+    ).json()["id"]
+
+    # ~1.11 км на север: 0.01° широты, 11 точек
+    lats = np.linspace(55.75, 55.76, 11)
+    points = np.column_stack([1_700_000_000 + np.arange(11) * 5.0, lats, np.full(11, 37.61)])
+
+    ndjson = "\n".join(json.dumps({"ts": ts, "lat": lat, "lon": lon}) for ts, lat, lon in points[:5])
+    r = client.post(f"/api/trips/{trip_id}/telemetry", content=ndjson,
+                    headers={"Content-Type": "application/x-ndjson"})
+    assert r.json() == {"trip_id": trip_id, "accepted": 5}
+    telemetry.buffer.flush()
+
+    # вторая пачка бинарная и приходит не по порядку
+    r = client.post(f"/api/trips/{trip_id}/telemetry", content=points[5:][::-1].astype("<f8").tobytes(),
+                    headers={"Content-Type": "application/octet-stream"})
+    assert r.json()["accepted"] == 6
+
+    r = client.post(f"/api/trips/{trip_id}/telemetry", content=b"\x00" * 10,
+                    headers={"Content-Type": "application/octet-stream"})
+    assert r.status_code == 400
+
+    # клиент прислал 50 км, но пробег берётся по треку
+    r = client.post(f"/api/trips/{trip_id}/finish", json={"distance_km": 50, "duration_minutes": 1})
+    assert abs(r.json()["distance_km"] - 1.112) < 0.001
+    assert len(telemetry.buffer) == 0
+
+    # завершённая и несуществующая поездки точки не принимают и файлов не заводят
+    one = points[:1].astype("<f8").tobytes()
+    headers = {"Content-Type": "application/octet-stream"}
+    assert client.post(f"/api/trips/{trip_id}/telemetry", content=one, headers=headers).status_code == 409
+    assert client.post("/api/trips/no-such-trip/telemetry", content=one, headers=headers).status_code == 404
+    telemetry.buffer.flush()
+    assert len(telemetry.buffer.store.read("no-such-trip")) == 0
+    assert not os.path.exists(os.path.join(telemetry.buffer.store.directory, "no-such-trip.f64"))
+
+
+def test_trace_context_flows_through_crud_sql_and_promo_call(monkeypatch):
+    import httpx
+    from common import tracing
+    from app import promo_client
+
+    outbound = []
+
+    def promo_service(request):
+        outbound.append(request.headers)
+        return httpx.Response(404)
+
+    monkeypatch.setattr(promo_client, "client", promo_client.PromoClient(transport=httpx.MockTransport(promo_service)))
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    headers = {"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01", "X-Request-ID": "req-trace-1"}
+
+    trip_id = client.post(
+        "/api/trips/start", json={"booking_id": "b-trace", "user_id": "u-trace", "car_id": "c-trace"}
+    ).json()["id"]
+    tracing.provider.force_flush()
+    tracing.memory_exporter.clear()
+
+    r = client.post(
+        f"/api/trips/{trip_id}/finish",
+        json={"distance_km": 1, "duration_minutes": 1, "promo_code": "NOPE"},
+        headers=headers,
+    )
+    assert r.status_code == 200
+    tracing.provider.force_flush()
+    spans = tracing.memory_exporter.get_finished_spans()
+    by_name = {span.name: span for span in spans}
+
+    # вся работа запроса – в трассе вызывающего сервиса
+    assert {format(span.context.trace_id, "032x") for span in spans} == {trace_id}
+    server = by_name["POST /api/trips/{trip_id}/finish"]
+    assert server.attributes["request.id"] == "req-trace-1"
+    # crud.finish_trip или crud_async.finish_trip при DB_ASYNC=1
+    finish = next(span for span in spans if span.name.endswith(".finish_trip"))
+    assert any(span.name == "UPDATE" and span.parent.span_id == finish.context.span_id for span in spans)
+    assert by_name["crud.finish_values"].parent.span_id == finish.context.span_id
+
+    # исходящий вызов несёт traceparent клиентского span и X-Request-ID
+    call = by_name["GET /api/promocodes/{code}"]
+    assert outbound[0]["traceparent"] == f"00-{trace_id}-{call.context.span_id:016x}-01"
+    assert outbound[0]["x-request-id"] == "req-trace-1"
+
+
+def test_service_runs_without_opentelemetry_when_tracing_is_off(tmp_path):
+    import subprocess
+
+    # нет opentelemetry-sdk и opentelemetry-instrumentation-fastapi: их импорт падает с ImportError
+    # (opentelemetry-api не блокируется – его импортирует сам fastapi новых версий)
+    script = """
+import sys
+sys.modules["opentelemetry.sdk"] = None
+sys.modules["opentelemetry.instrumentation"] = None
+sys.path[:0] = ["trip_service", "."]
+import httpx
+from fastapi.testclient import TestClient
+from app import promo_client
+from app.main import app
+
+def promo_service(request):
+    return httpx.Response(404)
+
+promo_client.client = promo_client.PromoClient(transport=httpx.MockTransport(promo_service))
+client = TestClient(app)
+trip_id = client.post("/api/trips/start", json={"booking_id": "b", "user_id": "u", "car_id": "c"}).json()["id"]
+r = client.post(f"/api/trips/{trip_id}/finish", json={"distance_km": 1, "duration_minutes": 1, "promo_code": "X"},
+                headers={"X-Request-ID": "req-no-otel"})
+assert r.status_code == 200, r.text
+print("ok")
+"""
+    env = {
+        **os.environ,
+        "TRACING_EXPORTER": "none",
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'trips.db'}",
+        "TELEMETRY_DIR": str(tmp_path / "telemetry"),
+    }
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    result = subprocess.run([sys.executable, "-c", script], cwd=root, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "ok"
+
+
+def test_token_only_reaches_its_own_trips(monkeypatch):
+    from common import tokens
+
+    monkeypatch.setattr(tokens, "AUTH_REQUIRED", True)
+    owner = {"Authorization": f"Bearer {tokens.issue_token('user-trip-owner')}"}
+    other = {"Authorization": f"Bearer {tokens.issue_token('user-trip-other')}"}
+
+    trip_id = client.post(
+        "/api/trips/start", json={"booking_id": "b-owner", "user_id": "user-trip-owner", "car_id": "c-owner"},
+        headers=owner,
+    ).json()["id"]
+
+    # без user_id – только свои поездки, чужие по id – 404
+    listed = client.get("/api/trips", params={"limit": 1000}, headers=other).json()["items"]
+    assert all(t["user_id"] == "user-trip-other" for t in listed)
+    assert client.get("/api/trips/export", headers=other).text == ""
+    assert client.get(f"/api/trips/{trip_id}", headers=other).status_code == 404
+    point = json.dumps({"ts": 1.0, "lat": 55.75, "lon": 37.61})
+    r = client.post(f"/api/trips/{trip_id}/telemetry", content=point,
+                    headers={**other, "Content-Type": "application/x-ndjson"})
+    assert r.status_code == 404
+    r = client.post(f"/api/trips/{trip_id}/finish", json={"distance_km": 1, "duration_minutes": 1}, headers=other)
+    assert r.status_code == 404
+
+    assert client.get(f"/api/trips/{trip_id}", headers=owner).json()["status"] == "in_progress"
+    r = client.post(f"/api/trips/{trip_id}/finish", json={"distance_km": 1, "duration_minutes": 1}, headers=owner)
+    assert r.json()["status"] == "finished"
@@ -0,0 +1,131 @@
+"""
+Логи user_service: JSON-строки с контекстом запроса, без ввода-вывода
+в потоке запроса.
+
+request_id живёт в contextvars – у каждого запроса (и у потоков
+threadpool, куда Starlette копирует контекст) своё значение, в отличие от
+прежнего общего атрибута фильтра. Логгеры пишут в QueueHandler, а
+форматирование в JSON и запись в stdout делает поток QueueListener.
+"""
+import logging
+import queue
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from common import tracing
+
+try:
+    from pythonjsonlogger.json import JsonFormatter
+except ImportError:  # python-json-logger < 3.1
+    from pythonjsonlogger.jsonlogger import JsonFormatter
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+MAX_REQUEST_ID = 128
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s %(service)s %(instance)s %(request_id)s"
+
+
+class ContextFilter(logging.Filter):
+    """Проставляет в запись service, instance и request_id текущего запроса."""
+
+    def __init__(self, service: str, instance: str):
+        super().__init__()
+        self.service = service
+        self.instance = instance
+
+    def filter(self, record):
+        record.service = self.service
+        record.instance = self.instance
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler сервиса; по нему setup_logging находит и заменяет прежний.
+    prepare() – стандартный: в потоке запроса подставляются только args в
+    msg (потом они могут измениться) и снимается exc_info, а JSON собирает
+    форматтер в QueueListener.
+    """
+
+
+def setup_logging(service: str, instance: str, level: int = logging.INFO, stream=None) -> QueueListener:
+    """
+    Направляет корневой логгер в очередь; возвращает запущенный
+    QueueListener (остановить – listener.stop(), он допишет очередь).
+    """
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter(LOG_FORMAT, rename_fields={"levelname": "level", "asctime": "time"}))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    # фильтр работает в потоке, который пишет лог, – там виден contextvars запроса
+    queue_handler.addFilter(ContextFilter(service, instance))
+
+    root = logging.getLogger()
+    for old in [h for h in root.handlers if isinstance(h, DeferredQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class RequestLoggingMiddleware:
+    """
+    Чистый ASGI: request_id из X-Request-ID (или новый) кладётся в
+    contextvars на время запроса и возвращается в ответе, по завершении
+    пишется одна структурированная запись access-лога.
+    """
+
+    def __init__(self, app, logger_name: str = "app.access"):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id: Optional[str] = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        # чужой заголовок обрезаем, чтобы он не раздувал каждую строку лога
+        request_id = (request_id or str(uuid.uuid4()))[:MAX_REQUEST_ID]
+        token = request_id_var.set(request_id)
+        tracing.bind_request_id(request_id)
+        raw_request_id = request_id.encode("latin-1")
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", raw_request_id)]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(
+                    "request",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status_code": status_code,
+                        "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                    },
+                )
+            request_id_var.reset(token)
@@ -1,90 +1,39 @@
 # app/main.py
+import atexit
 import os
-import time
-import uuid
 import socket
 import logging
-from fastapi import FastAPI, Request
-from starlette.responses import Response
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from typing import Optional, Dict
+from typing import List, Optional
 from uuid import uuid4
+
+from app import logs, passwords
+from common import capture, tokens, tracing
+from common.metrics import PrometheusMiddleware, metrics_response
+from common.repository import ChangeFollower, DuplicateKeyError, make_repository
+from common.response_cache import ResponseCache
+
 SERVICE_NAME = os.getenv("SERVICE_NAME", "unknown-service")
 INSTANCE_ID = os.getenv("INSTANCE_ID", socket.gethostname())
 
 # --- Logging ---
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s service=%(service)s instance=%(instance)s request_id=%(request_id)s %(message)s",
-)
+# JSON в stdout через очередь; request_id – из contextvars (app/logs.py)
+log_listener = logs.setup_logging(SERVICE_NAME, INSTANCE_ID)
+atexit.register(log_listener.stop)
 logger = logging.getLogger("app")
 
-class ContextFilter(logging.Filter):
-    def __init__(self):
-        super().__init__()
-        self.request_id = "-"
-
-    def set_request_id(self, rid: str):
-        self.request_id = rid
-
-    def filter(self, record):
-        record.service = SERVICE_NAME
-        record.instance = INSTANCE_ID
-        record.request_id = getattr(self, "request_id", "-")
-        return True
-
-ctx_filter = ContextFilter()
-logger.addFilter(ctx_filter)
-
-# --- Prometheus metrics ---
-HTTP_REQUESTS_TOTAL = Counter(
-    "http_requests_total",
-    "Total HTTP requests",
-    ["service", "method", "path", "status"],
-)
-HTTP_REQUEST_DURATION = Histogram(
-    "http_request_duration_seconds",
-    "HTTP request duration in seconds",
-    ["service", "method", "path"],
-)
-HTTP_INPROGRESS = Gauge(
-    "http_inprogress_requests",
-    "In-progress HTTP requests",
-    ["service"],
-)
-
 app = FastAPI(title="User Service")
 
-@app.middleware("http")
-async def observability_middleware(request: Request, call_next):
-    rid = request.headers.get("X-Request-ID") or str(uuid.uuid4())
-    ctx_filter.set_request_id(rid)
-
-    start = time.time()
-    method = request.method
-    path = request.url.path
-
-    HTTP_INPROGRESS.labels(service=SERVICE_NAME).inc()
-    status_code = 500
-
-    try:
-        response = await call_next(request)
-        status_code = response.status_code
-        return response
-    finally:
-        duration = time.time() - start
-        HTTP_INPROGRESS.labels(service=SERVICE_NAME).dec()
-
-        HTTP_REQUESTS_TOTAL.labels(
-            service=SERVICE_NAME, method=method, path=path, status=str(status_code)
-        ).inc()
-        HTTP_REQUEST_DURATION.labels(
-            service=SERVICE_NAME, method=method, path=path
-        ).observe(duration)
-
-        logger.info(f"{method} {path} -> {status_code} duration={duration:.4f}s")
+# --- Prometheus metrics ---
+app.add_middleware(PrometheusMiddleware, service_name=SERVICE_NAME)
+tracing.setup_tracing(app, SERVICE_NAME)
+capture.setup_capture(app, SERVICE_NAME)
+# добавлен последним – внешний из middleware приложения: request_id выставлен
+# до capture и метрик. Server span трассировки FastAPIInstrumentor всё равно
+# оборачивает весь стек, request_id в него пишет tracing.bind_request_id
+app.add_middleware(logs.RequestLoggingMiddleware)
 
 # ====== Pydantic-схемы ======
 
@@ -110,66 +59,124 @@ class UserResponse(BaseModel):
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str
+    expires_in: int
     user: UserResponse
 
 # ====== "База" в памяти ======
 
-users_by_id: Dict[str, dict] = {}
-users_by_login: Dict[str, str] = {}  # phone/email -> user_id
+# пользователи по id; STORAGE_URL задаёт бэкенд (по умолчанию – в памяти).
+# Телефон и email уникальны и служат логином
+users = make_repository("users", unique=("phone", "email"))
+
+# журнал изменений общего хранилища (None – хранилище в памяти процесса)
+_users_follower: Optional[ChangeFollower] = None
+
+
+def _sync_users() -> None:
+    """Профили, изменённые другими воркерами, вытесняются из кеша этого процесса."""
+    global _users_follower
+    if not users.shared:
+        return
+    if _users_follower is None or _users_follower.repo is not users:
+        _users_follower = users.follow(_forget_users, lambda: user_cache.clear())
+    _users_follower.sync()
+
+
+def _forget_users(user_ids: List[str]) -> None:
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+# готовые ответы GET /api/users/{user_id}; пересчёт хеша при логине их не
+# трогает – password_hash в ответ не входит, других изменений профиля нет
+user_cache = ResponseCache("users", sync=_sync_users)
+
+
+async def _storage(fn, *args, **kwargs):
+    """Обращения к БД уходят в threadpool, к словарю в памяти – выполняются сразу."""
+    if users.shared:
+        return await run_in_threadpool(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def _find_by_login(login: str) -> Optional[dict]:
+    return users.find_one(phone=login) or users.find_one(email=login)
+
+
+def _login_taken(phone: str, email: str) -> bool:
+    return bool(users.existing("phone", [phone]) or users.existing("email", [email]))
 
 
 # ====== Эндпоинты ======
 @app.get("/metrics")
 def metrics():
-    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return metrics_response()
 
 @app.post("/api/users/register", response_model=UserResponse)
-def register_user(payload: UserRegisterRequest):
-    # Проверяем, что логин не занят
-    if payload.phone in users_by_login or payload.email in users_by_login:
+async def register_user(payload: UserRegisterRequest):
+    # Проверяем, что логин не занят, до дорогого хеширования
+    if await _storage(_login_taken, payload.phone, payload.email):
         raise HTTPException(status_code=400, detail="User already exists")
 
-    user_id = str(uuid4())
+    # scrypt считается в пуле, event loop в это время обслуживает других
+    password_hash = await passwords.hash_password_async(payload.password)
+
     user_data = {
-        "id": user_id,
+        "id": str(uuid4()),
         "phone": payload.phone,
         "email": payload.email,
         "full_name": payload.full_name,
         "driver_license": payload.driver_license,
-        "password": payload.password,  # в реальности нужно хэшировать
+        "password_hash": password_hash,
         "status": "pending_verification",
     }
 
-    users_by_id[user_id] = user_data
-    users_by_login[payload.phone] = user_id
-    users_by_login[payload.email] = user_id
+    # за время хеширования логин мог занять параллельный запрос –
+    # уникальность телефона и email окончательно проверяет хранилище
+    try:
+        await _storage(users.add, user_data)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="User already exists")
 
     return UserResponse(**user_data)
 
 
 @app.post("/api/users/login", response_model=TokenResponse)
-def login_user(payload: UserLoginRequest):
-    user_id = users_by_login.get(payload.phone_or_email)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+async def login_user(payload: UserLoginRequest):
+    user = await _storage(_find_by_login, payload.phone_or_email)
+    stored = user["password_hash"] if user else None
 
-    user = users_by_id[user_id]
-    if user["password"] != payload.password:
+    if not await passwords.verify_password_async(payload.password, stored):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    # "Фейковый" токен
-    token = f"fake-token-for-{user_id}"
+    # параметры scrypt поменялись – пересчитываем хеш, пока знаем пароль
+    if passwords.needs_rehash(stored):
+        new_hash = await passwords.hash_password_async(payload.password)
+        # если пароль успели сменить, новый хеш не записываем
+        await _storage(
+            users.modify,
+            user["id"],
+            lambda current: {"password_hash": new_hash} if current["password_hash"] == stored else None,
+        )
+
+    # подписанный токен, остальные сервисы проверяют его сами (common.tokens)
+    token = tokens.issue_token(user["id"])
 
     return TokenResponse(
         access_token=token,
         token_type="bearer",
+        expires_in=tokens.TOKEN_TTL,
         user=UserResponse(**user),
     )
 
 
-@app.get("/api/users/{user_id}", response_model=UserResponse)
-def get_user(user_id: str):
-    user = users_by_id.get(user_id)
+def _user_json(user_id: str) -> bytes:
+    user = users.get(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return UserResponse(**user)
+    return UserResponse(**user).model_dump_json().encode()
+
+
+@app.get("/api/users/{user_id}", response_model=UserResponse)
+def get_user(user_id: str, request: Request):
+    return user_cache.response(request, user_id, lambda: _user_json(user_id))
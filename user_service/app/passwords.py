@@ -0,0 +1,111 @@
+"""
+Хеширование паролей (scrypt из hashlib) в отдельном пуле потоков.
+
+Хеш хранится строкой "scrypt$<n>$<r>$<p>$<salt>$<hash>" (base64), поэтому
+параметры каждого пароля известны при проверке, а needs_rehash() видит
+хеши, посчитанные со старым work factor.
+
+hashlib.scrypt отпускает GIL на время вычисления, так что пул потоков
+даёт параллелизм по ядрам и не держит event loop: async-обёртки
+hash_password_async / verify_password_async отдают работу в пул.
+
+Настройки через переменные окружения:
+    PASSWORD_SCRYPT_N      – work factor, степень двойки (по умолчанию 2**14)
+    PASSWORD_SCRYPT_R      – размер блока (8)
+    PASSWORD_SCRYPT_P      – параллелизм внутри одного хеша (1)
+    PASSWORD_HASH_WORKERS  – потоков в пуле (по числу ядер)
+"""
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHM = "scrypt"
+SALT_BYTES = 16
+HASH_BYTES = 64
+
+SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # OpenSSL требует maxmem не меньше 128 * r * (n + p + 2) байт
+    maxmem = 128 * r * (n + p + 2) + (1 << 20)
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=HASH_BYTES)
+
+
+def hash_password(password: str, n: int | None = None, r: int | None = None, p: int | None = None) -> str:
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{ALGORITHM}${n}${r}${p}${_b64encode(salt)}${_b64encode(digest)}"
+
+
+def _parse(stored: str):
+    algorithm, n, r, p, salt, digest = stored.split("$")
+    if algorithm != ALGORITHM:
+        raise ValueError(f"Unsupported password hash: {algorithm}")
+    return int(n), int(r), int(p), _b64decode(salt), _b64decode(digest)
+
+
+def verify_password(password: str, stored: str) -> bool:
+    try:
+        n, r, p, salt, digest = _parse(stored)
+    except ValueError:
+        return False
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+
+
+def needs_rehash(stored: str) -> bool:
+    """True, если хеш посчитан не с текущими SCRYPT_N/R/P."""
+    try:
+        n, r, p, _, _ = _parse(stored)
+    except ValueError:
+        return True
+    return (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    # по этому хешу проверяется пароль несуществующего пользователя,
+    # чтобы время ответа не выдавало, есть ли такой логин
+    return hash_password("dummy-password")
+
+
+def _verify_dummy(password: str) -> bool:
+    return verify_password(password, _dummy_hash())
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+    return _executor
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), hash_password, password)
+
+
+async def verify_password_async(password: str, stored: str | None) -> bool:
+    """Проверка в пуле; stored=None – пользователя нет, тратим то же время и возвращаем False."""
+    loop = asyncio.get_running_loop()
+    if stored is None:
+        await loop.run_in_executor(get_executor(), _verify_dummy, password)
+        return False
+    return await loop.run_in_executor(get_executor(), verify_password, password, stored)
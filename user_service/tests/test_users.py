@@ -1,6 +1,7 @@
 import sys
 import os
 import importlib.util
+import logging
 
 # Добавляем путь к user_service
 user_service_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -54,3 +55,102 @@ def test_login_wrong_credentials():
         json={"phone_or_email": "no_such_user", "password": "123"},
     )
     assert r.status_code == 401
+
+
+def test_password_is_hashed_and_rehashed_on_login(monkeypatch):
+    passwords = user_app_main.passwords
+    payload = {
+        "phone": "+79990000002",
+        "email": "test2@example.com",
+        "full_name": "Test User 2",
+        "driver_license": "7700654321",
+        "password": "secret456",
+    }
+
+    # регистрируем со "старым" work factor
+    monkeypatch.setattr(passwords, "SCRYPT_N", 2 ** 10)
+    r = client.post("/api/users/register", json=payload)
+    assert r.status_code == 200
+    user_id = r.json()["id"]
+    old_hash = user_app_main.users.get(user_id)["password_hash"]
+    assert payload["password"] not in old_hash
+    assert old_hash.startswith("scrypt$1024$")
+
+    r = client.post("/api/users/login", json={"phone_or_email": payload["email"], "password": "wrong"})
+    assert r.status_code == 401
+
+    # после повышения work factor хеш пересчитывается при успешном логине
+    monkeypatch.setattr(passwords, "SCRYPT_N", 2 ** 11)
+    r = client.post("/api/users/login", json={"phone_or_email": payload["phone"], "password": payload["password"]})
+    assert r.status_code == 200
+    new_hash = user_app_main.users.get(user_id)["password_hash"]
+    assert new_hash.startswith("scrypt$2048$")
+    assert passwords.verify_password(payload["password"], new_hash)
+
+
+def test_login_issues_verifiable_token():
+    from common import tokens
+
+    payload = {
+        "phone": "+79990000003",
+        "email": "test3@example.com",
+        "full_name": "Test User 3",
+        "driver_license": "7700111222",
+        "password": "secret789",
+    }
+    user_id = client.post("/api/users/register", json=payload).json()["id"]
+
+    r = client.post("/api/users/login", json={"phone_or_email": payload["phone"], "password": payload["password"]})
+    assert r.status_code == 200
+    data = r.json()
+    assert data["token_type"] == "bearer"
+
+    claims = tokens.verify_token(data["access_token"])
+    assert claims.sub == user_id
+    assert claims.exp - claims.iat == data["expires_in"]
+
+
+def test_concurrent_requests_log_own_request_id():
+    import io
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app import logs
+
+    stream = io.StringIO()
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    listener = logs.setup_logging("user-service", "test", stream=stream)
+    try:
+        # аргументы подставляются при вызове, а не когда запись дойдёт до listener
+        payload = {"n": 1}
+        logging.getLogger("app.test").warning("payload %s", payload)
+        payload["n"] = 2
+        with TestClient(app) as shared_client:
+            def fetch(i):
+                r = shared_client.get(f"/api/users/missing-{i}", headers={"X-Request-ID": f"req-{i}"})
+                return r.headers["x-request-id"]
+
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                echoed = list(pool.map(fetch, range(100)))
+            generated = shared_client.get("/api/users/missing").headers["x-request-id"]
+    finally:
+        # останавливаем свой listener и возвращаем обработчики приложения
+        listener.stop()
+        root.handlers[:] = saved_handlers
+        root.setLevel(saved_level)
+
+    assert echoed == [f"req-{i}" for i in range(100)]
+    assert generated
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert next(r for r in records if r["name"] == "app.test")["message"] == "payload {'n': 1}"
+    access = {r["path"]: r for r in records if r["name"] == "app.access"}
+    for i in range(100):
+        record = access[f"/api/users/missing-{i}"]
+        assert record["request_id"] == f"req-{i}"
+        assert record["status_code"] == 404
+        assert record["level"] == "INFO"
+        assert record["service"] == "user-service"
+    assert access["/api/users/missing"]["request_id"] == generated
+    # логирование – внешний из middleware приложения (добавлен последним)
+    assert app.user_middleware[0].cls is logs.RequestLoggingMiddleware